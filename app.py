@@ -1,6 +1,6 @@
 from src import create_app
 
-app = create_app()
+app = create_app({"CHECK_QUERY_PLANS": True})
 
 if __name__ == "__main__":
     app.run(port=80, debug=True)
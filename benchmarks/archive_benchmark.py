@@ -0,0 +1,109 @@
+"""
+Seed several past years of attendance, then run the archive job while a
+client keeps tapping check-ins, and compare tap latency with and without
+the job running. Also reports archive throughput and how much of the
+live table is left.
+
+    python -m benchmarks.archive_benchmark --users 2740 --years 3
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import date
+
+from benchmarks.common import make_app, percentile, seed_users
+from src.database import get_db_connection
+from src.models import archive_model
+
+
+def _seed_years(path, years):
+    first = date.today().year - years
+    conn = get_db_connection(path)
+    conn.execute(
+        """
+        WITH RECURSIVE calendar(day) AS (
+            SELECT date(?)
+            UNION ALL
+            SELECT date(day, '+2 days') FROM calendar WHERE day < date(?)
+        )
+        INSERT INTO attendance (user_id, date, in_time, out_time)
+        SELECT u.id, c.day, '09:00:00', '10:30:00' FROM users u CROSS JOIN calendar c
+        """,
+        (f"{first}-01-01", f"{first + years - 1}-12-30"),
+    )
+    conn.commit()
+    rows = conn.execute("SELECT COUNT(*) FROM attendance").fetchone()[0]
+    conn.close()
+    return rows
+
+
+def _tap_until(app, users, stop, latencies):
+    client = app.test_client()
+    user_id = 0
+    while not stop.is_set():
+        user_id = user_id % users + 1
+        for action in ("in", "out"):
+            started = time.perf_counter()
+            client.post("/attendance/mark", data={"user_id": str(user_id), "action": action})
+            latencies.append(time.perf_counter() - started)
+
+
+def _report(label, latencies):
+    latencies.sort()
+    print(
+        f"{label:18} {len(latencies):6} taps  p50 {percentile(latencies, 0.5) * 1000:6.2f} ms"
+        f"  p99 {percentile(latencies, 0.99) * 1000:6.2f} ms  max {latencies[-1] * 1000:7.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2740)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--chunk-rows", type=int, default=5000)
+    parser.add_argument("--idle-seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = make_app(workdir, ARCHIVE_FOLDER=os.path.join(workdir, "archive"))
+        path = app.config["DATABASE_PATH"]
+        seed_users(path, args.users)
+        total = _seed_years(path, args.years)
+        print(f"seeded {total} attendance rows over {args.years} years")
+
+        stop = threading.Event()
+        latencies = []
+        tapper = threading.Thread(target=_tap_until, args=(app, args.users, stop, latencies))
+        tapper.start()
+        time.sleep(args.idle_seconds)
+        idle = list(latencies)
+        del latencies[:]
+
+        conn = get_db_connection(path)
+        started = time.perf_counter()
+        moved = 0
+        for year in archive_model.archivable_years(conn, date.today().year):
+            moved += archive_model.archive_year(
+                conn, app.config["ARCHIVE_FOLDER"], year, chunk_rows=args.chunk_rows
+            )
+        elapsed = time.perf_counter() - started
+        during = list(latencies)
+        stop.set()
+        tapper.join()
+
+        live = conn.execute("SELECT COUNT(*) FROM attendance").fetchone()[0]
+        conn.close()
+        app.extensions["db_pool"].close_all()
+
+    _report("idle", idle)
+    _report("during archive", during)
+    print(
+        f"archived {moved} rows in {elapsed:.1f}s ({moved / elapsed:.0f} rows/s), "
+        f"{live} rows left in the live table"
+    )
+
+
+if __name__ == "__main__":
+    main()
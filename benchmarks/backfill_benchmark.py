@@ -0,0 +1,84 @@
+"""
+Time the set-based attendance backfill against the old one-INSERT-per-class
+loop, for a batch of students over a long window.
+
+    python -m benchmarks.backfill_benchmark --users 500 --days 365 --classes 200
+"""
+import argparse
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+from benchmarks.common import make_app, seed_users
+from src.database import get_db_connection
+from src.models import attendance_model
+
+SLOT_START, SLOT_END, DURATION = 9 * 60, 17 * 60, 90
+
+
+def _legacy(conn, user_ids, start, end, classes):
+    # The previous admin_routes implementation, once per user
+    rows = 0
+    for user_id in user_ids:
+        days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+        taken = {
+            row["date"]
+            for row in conn.execute(
+                "SELECT date FROM attendance WHERE user_id=? AND date BETWEEN ? AND ?",
+                (user_id, start.isoformat(), end.isoformat()),
+            )
+        }
+        free = [day for day in days if day.isoformat() not in taken]
+        for day in random.sample(free, min(classes, len(free))):
+            in_minutes = random.randint(SLOT_START, SLOT_END - DURATION)
+            out_minutes = in_minutes + DURATION
+            conn.execute(
+                "INSERT INTO attendance (user_id, date, in_time, out_time) VALUES (?, ?, ?, ?)",
+                (
+                    user_id,
+                    day.isoformat(),
+                    f"{in_minutes // 60:02d}:{in_minutes % 60:02d}:00",
+                    f"{out_minutes // 60:02d}:{out_minutes % 60:02d}:00",
+                ),
+            )
+            rows += 1
+        conn.commit()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--classes", type=int, default=200)
+    args = parser.parse_args()
+
+    start = date(2024, 1, 1)
+    end = start + timedelta(days=args.days - 1)
+    user_ids = list(range(1, args.users + 1))
+
+    print(f"{args.users} users, {args.days} days, {args.classes} classes each")
+    for label in ("legacy loop", "dry run", "set-based"):
+        with tempfile.TemporaryDirectory() as workdir:
+            app = make_app(workdir)
+            seed_users(app.config["DATABASE_PATH"], args.users)
+            conn = get_db_connection(app.config["DATABASE_PATH"])
+
+            started = time.perf_counter()
+            if label == "legacy loop":
+                rows = _legacy(conn, user_ids, start, end, args.classes)
+            else:
+                rows = attendance_model.backfill(
+                    conn, user_ids, start, end, SLOT_START, SLOT_END, DURATION,
+                    args.classes, dry_run=label == "dry run",
+                )["rows"]
+            elapsed = time.perf_counter() - started
+
+            conn.close()
+            app.extensions["db_pool"].close_all()
+        print(f"  {label:<12} {rows:>8} rows  {elapsed:7.2f}s  {rows / elapsed:>9.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
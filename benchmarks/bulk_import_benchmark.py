@@ -0,0 +1,116 @@
+"""
+Import synthetic candidates from a CSV and a ZIP of photos, first one
+row at a time the way the add-candidate form does it (extract, resize,
+insert, commit), then through bulk_import with one worker and with one
+worker per CPU. Reports candidates/s and the parent's peak RSS.
+
+    python -m benchmarks.bulk_import_benchmark --candidates 1000
+"""
+import argparse
+import io
+import os
+import resource
+import shutil
+import tempfile
+import time
+import zipfile
+
+from werkzeug.datastructures import FileStorage
+
+from benchmarks.common import make_app
+from benchmarks.suite import synthetic_photos
+from src.database import get_db_connection
+from src.services import bulk_import
+from src.services.image_service import resize_and_compress
+
+
+def _write_inputs(directory, count, size):
+    csv_path = os.path.join(directory, "candidates.csv")
+    zip_path = os.path.join(directory, "photos.zip")
+    with open(csv_path, "w") as handle, zipfile.ZipFile(zip_path, "w") as archive:
+        handle.write("name,phone\n")
+        # Every photo distinct, so none is skipped as already stored
+        for batch in range(0, count, 50):
+            photos = synthetic_photos(min(50, count - batch), seed=batch, size=size)
+            for number, photo in enumerate(photos, start=batch):
+                phone = f"8{number:09d}"
+                handle.write(f"Candidate {number:05d},{phone}\n")
+                archive.writestr(f"{phone}.jpg", photo)
+    return csv_path, zip_path
+
+
+def _empty_uploads(upload_folder):
+    # Outputs are content-addressed; a previous run's files would be reused
+    shutil.rmtree(upload_folder, ignore_errors=True)
+    os.makedirs(upload_folder)
+
+
+def _sequential(database, csv_path, zip_path):
+    conn = get_db_connection(database)
+    started = time.perf_counter()
+    with zipfile.ZipFile(zip_path) as archive:
+        for _, row in bulk_import._read_rows(csv_path):
+            member = f"{row['phone']}.jpg"
+            image_path = resize_and_compress(FileStorage(io.BytesIO(archive.read(member)), filename=member))
+            conn.execute(
+                "INSERT INTO users (name, phone, image_path) VALUES (?, ?, ?)",
+                (row["name"], row["phone"], image_path),
+            )
+            conn.commit()
+    elapsed = time.perf_counter() - started
+    conn.execute("DELETE FROM users")
+    conn.commit()
+    conn.close()
+    return elapsed
+
+
+def _bulk(database, job_folder, csv_path, zip_path, workers, chunk_rows):
+    conn = get_db_connection(database)
+    with open(csv_path, "rb") as csv_handle, open(zip_path, "rb") as zip_handle:
+        job_id = bulk_import.create_job(conn, job_folder, FileStorage(csv_handle), FileStorage(zip_handle))
+    bulk_import.claim_job(conn, job_id)
+
+    started = time.perf_counter()
+    imported, failed = bulk_import.run_job(database, job_folder, job_id, workers, chunk_rows)
+    elapsed = time.perf_counter() - started
+    conn.execute("DELETE FROM users")
+    conn.commit()
+    conn.close()
+    return elapsed, imported, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--candidates", type=int, default=1000)
+    parser.add_argument("--photo-size", type=int, nargs=2, default=(1600, 1200))
+    parser.add_argument("--chunk-rows", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = make_app(workdir)
+        with app.app_context():
+            database = app.config["DATABASE_PATH"]
+            csv_path, zip_path = _write_inputs(workdir, args.candidates, tuple(args.photo_size))
+            print(f"{args.candidates} candidates, ZIP {os.path.getsize(zip_path) / 1e6:.1f} MB, {os.cpu_count()} CPUs")
+
+            _empty_uploads(app.config["UPLOAD_FOLDER"])
+            elapsed = _sequential(database, csv_path, zip_path)
+            print(f"{'row at a time':18} {elapsed:7.1f}s  {args.candidates / elapsed:7.1f} candidates/s")
+
+            for workers in sorted({1, os.cpu_count() or 1}):
+                _empty_uploads(app.config["UPLOAD_FOLDER"])
+                elapsed, imported, failed = _bulk(
+                    database, os.path.join(workdir, "imports"), csv_path, zip_path, workers, args.chunk_rows
+                )
+                print(
+                    f"{f'bulk, {workers} worker(s)':18} {elapsed:7.1f}s  {imported / elapsed:7.1f} candidates/s"
+                    f"  ({failed} rejected)"
+                )
+            app.extensions["db_pool"].close_all()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"parent peak RSS {peak:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+import os
+import sqlite3
+
+from src.database import init_db
+
+
+def make_app(workdir, **overrides):
+    """
+    Build an app whose database and uploads live under workdir. Code
+    that calls the services directly runs inside app.app_context().
+    """
+    paths = {
+        "DATABASE_PATH": os.path.join(workdir, "attendance.db"),
+        "STATIC_FOLDER": workdir,
+        "UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+        "SPOOL_FOLDER": os.path.join(workdir, "spool"),
+    }
+
+    from src import create_app
+
+    return create_app({**paths, "TESTING": True, **overrides})
+
+
+def seed_users(path, count):
+    init_db(path)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (name, phone, image_path) VALUES (?, ?, ?)",
+        [(f"Candidate {i:05d}", f"9{i:09d}", "uploads/none.jpg") for i in range(count)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
@@ -0,0 +1,131 @@
+"""
+Compare per-request sqlite3.connect (rollback journal) with the pooled
+WAL connection layer under concurrent check-in and board traffic.
+
+    python -m benchmarks.db_pool_benchmark --threads 16 --ops 400
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from benchmarks.common import percentile, seed_users
+from src.database import ConnectionPool
+
+
+BOARD_QUERY = """
+    SELECT u.id, u.name, a.in_time, a.out_time
+    FROM users u
+    LEFT JOIN attendance a ON a.user_id = u.id AND a.date = ?
+    ORDER BY u.name COLLATE NOCASE
+"""
+
+
+def _legacy_connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _run_op(conn, user_count, write_ratio, day):
+    if random.random() < write_ratio:
+        user_id = random.randint(1, user_count)
+        conn.execute(
+            "INSERT OR IGNORE INTO attendance (user_id, date, in_time) VALUES (?, ?, ?)",
+            (user_id, day, "09:00:00"),
+        )
+        conn.commit()
+    else:
+        conn.execute(BOARD_QUERY, (day,)).fetchall()
+
+
+def _drive(acquire, release, threads, ops, user_count, write_ratio):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    day_counter = iter(range(10 ** 9))
+
+    def worker():
+        local = []
+        for _ in range(ops):
+            with lock:
+                day = (date(2020, 1, 1) + timedelta(days=next(day_counter) % 3650)).isoformat()
+            started = time.perf_counter()
+            conn = acquire()
+            try:
+                _run_op(conn, user_count, write_ratio, day)
+            except sqlite3.OperationalError as exc:
+                errors.append(str(exc))
+            finally:
+                release(conn)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "ops_per_sec": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=300, help="operations per thread")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        legacy_path = os.path.join(workdir, "legacy.db")
+        pooled_path = os.path.join(workdir, "pooled.db")
+        seed_users(legacy_path, args.users)
+        seed_users(pooled_path, args.users)
+
+        # init_db switches the file to WAL; put the legacy copy back on the
+        # default rollback journal so it matches the old behaviour.
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+
+        legacy = _drive(
+            lambda: _legacy_connect(legacy_path),
+            lambda conn: conn.close(),
+            args.threads, args.ops, args.users, args.write_ratio,
+        )
+
+        pool = ConnectionPool(pooled_path, max_size=args.threads)
+        pooled = _drive(
+            pool.acquire, pool.release,
+            args.threads, args.ops, args.users, args.write_ratio,
+        )
+        pool_stats = pool.stats()
+        pool.close_all()
+
+    print(f"{'mode':<10}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+    for name, result in (("connect", legacy), ("pooled", pooled)):
+        print(
+            f"{name:<10}{result['ops_per_sec']:>10.0f}{result['p50_ms']:>10.2f}"
+            f"{result['p95_ms']:>10.2f}{result['errors']:>8}"
+        )
+    print("pool stats:", pool_stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Stream a large attendance export and sample the process RSS as it goes.
+With a streaming body RSS should flatten out after the first batches
+instead of growing with the row count. Anonymous RSS is reported on its
+own because the file-backed part is just SQLite's mmap of the database
+(DB_MMAP_SIZE) filling up.
+
+    python -m benchmarks.export_benchmark --users 2740 --days 365 --fmt csv
+"""
+import argparse
+import tempfile
+import time
+
+from benchmarks.common import make_app, seed_users
+from src.database import get_db_connection
+
+
+def _rss_kb(field="VmRSS"):
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def _seed_attendance(path, days):
+    conn = get_db_connection(path)
+    conn.execute(
+        """
+        WITH RECURSIVE calendar(day) AS (
+            SELECT date('2024-01-01')
+            UNION ALL
+            SELECT date(day, '+1 day') FROM calendar WHERE day < date('2024-01-01', ?)
+        )
+        INSERT INTO attendance (user_id, date, in_time, out_time)
+        SELECT u.id, c.day, '09:00:00', '10:30:00' FROM users u CROSS JOIN calendar c
+        """,
+        (f"+{days - 1} days",),
+    )
+    conn.commit()
+    rows = conn.execute("SELECT COUNT(*) FROM attendance").fetchone()[0]
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2740)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--fmt", choices=("csv", "xlsx"), default="csv")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = make_app(workdir)
+        seed_users(app.config["DATABASE_PATH"], args.users)
+        started = time.perf_counter()
+        total = _seed_attendance(app.config["DATABASE_PATH"], args.days)
+        print(f"seeded {total} attendance rows in {time.perf_counter() - started:.1f}s")
+
+        client = app.test_client()
+        baseline = _rss_kb()
+        anon_baseline = _rss_kb("RssAnon")
+        response = client.get(f"/admin/export/attendance.{args.fmt}", buffered=False)
+
+        started = time.perf_counter()
+        size = 0
+        peak = baseline
+        anon_peak = anon_baseline
+        checkpoints = {total // 10 * step for step in (1, 2, 5, 10)}
+        rows_seen = 0
+        for chunk in response.response:
+            size += len(chunk)
+            rows_seen += 1000  # one chunk per batch of rows
+            peak = max(peak, _rss_kb())
+            anon_peak = max(anon_peak, _rss_kb("RssAnon"))
+            if any(rows_seen - 1000 < mark <= rows_seen for mark in checkpoints):
+                print(
+                    f"  ~{min(rows_seen, total):>9} rows  rss {_rss_kb() / 1024:7.1f} MB"
+                    f"  anon {_rss_kb('RssAnon') / 1024:7.1f} MB"
+                )
+        response.close()
+        elapsed = time.perf_counter() - started
+        app.extensions["db_pool"].close_all()
+
+    print(
+        f"{args.fmt}: {size / 1e6:.1f} MB in {elapsed:.1f}s ({total / elapsed:.0f} rows/s)  "
+        f"rss before {baseline / 1024:.1f} MB  peak {peak / 1024:.1f} MB  "
+        f"growth {(peak - baseline) / 1024:.1f} MB (anon {(anon_peak - anon_baseline) / 1024:.1f} MB)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Compare the old scan-the-database fingerprint match with the resident
+TemplateIndex, in exact mode and with the stand-in bit-similarity scorer.
+
+    python -m benchmarks.fingerprint_match_benchmark --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.common import seed_users
+from src.services.template_index import BitSimilarityScorer, TemplateIndex
+
+
+def _legacy_match(path, template_bytes):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    users = conn.execute("SELECT id, fingerprint_template FROM users").fetchall()
+    conn.close()
+    for user in users:
+        if user["fingerprint_template"] == template_bytes:
+            return user["id"]
+    return None
+
+
+def _noisy(template_bytes, flip_fraction, rng):
+    value = int.from_bytes(template_bytes, "big")
+    bits = 8 * len(template_bytes)
+    for position in rng.sample(range(bits), int(bits * flip_fraction)):
+        value ^= 1 << position
+    return value.to_bytes(len(template_bytes), "big")
+
+
+def _time_per_call(fn, probes):
+    started = time.perf_counter()
+    for probe in probes:
+        fn(probe)
+    return (time.perf_counter() - started) / len(probes) * 1000
+
+
+def run(size, template_size, queries, rng):
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "attendance.db")
+        seed_users(path, size)
+        templates = {user_id: rng.randbytes(template_size) for user_id in range(1, size + 1)}
+
+        conn = sqlite3.connect(path)
+        conn.executemany(
+            "UPDATE users SET fingerprint_template=? WHERE id=?",
+            [(template, user_id) for user_id, template in templates.items()],
+        )
+        conn.commit()
+
+        targets = rng.sample(sorted(templates), queries)
+        exact_probes = [templates[user_id] for user_id in targets]
+        noisy_probes = [_noisy(templates[user_id], 0.02, rng) for user_id in targets]
+        miss_probes = [rng.randbytes(template_size) for _ in range(queries)]
+
+        legacy_ms = _time_per_call(lambda probe: _legacy_match(path, probe), exact_probes[:3])
+
+        rows = conn.execute("SELECT id, fingerprint_template FROM users").fetchall()
+        conn.close()
+
+        exact = TemplateIndex()
+        started = time.perf_counter()
+        exact.load(rows)
+        exact_load_ms = (time.perf_counter() - started) * 1000
+        exact_ms = _time_per_call(exact.match, exact_probes)
+
+        scored = TemplateIndex(scorer=BitSimilarityScorer(), threshold=0.9)
+        started = time.perf_counter()
+        scored.load(rows)
+        scored_load_ms = (time.perf_counter() - started) * 1000
+        hit_ms = _time_per_call(scored.match, noisy_probes)
+        miss_ms = _time_per_call(scored.match, miss_probes[:3])
+
+        correct = sum(scored.match(probe)[0] == user_id for probe, user_id in zip(noisy_probes, targets))
+
+    return {
+        "size": size,
+        "legacy_ms": legacy_ms,
+        "exact_load_ms": exact_load_ms,
+        "exact_ms": exact_ms,
+        "scored_load_ms": scored_load_ms,
+        "scored_hit_ms": hit_ms,
+        "scored_miss_ms": miss_ms,
+        "scored_correct": f"{correct}/{len(targets)}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--template-size", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(1234)
+    columns = ("size", "legacy_ms", "exact_load_ms", "exact_ms",
+               "scored_load_ms", "scored_hit_ms", "scored_miss_ms", "scored_correct")
+    print("".join(f"{name:>16}" for name in columns))
+    for size in args.sizes:
+        result = run(size, args.template_size, args.queries, rng)
+        print("".join(
+            f"{result[name]:>16.3f}" if isinstance(result[name], float) else f"{result[name]:>16}"
+            for name in columns
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark image_service.process_image profiles against the previous
+full-decode implementation on a synthetic photo corpus.
+
+Each (implementation, image) pair runs in its own subprocess so that
+peak RSS is measured in isolation.
+
+    python -m benchmarks.image_benchmark --repeat 5
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+from src.config import Config
+
+
+CORPUS = {
+    # name: (size, format, EXIF orientation)
+    "phone_12mp.jpg": ((4032, 3024), "JPEG", 6),
+    "phone_8mp.jpg": ((3264, 2448), "JPEG", 1),
+    "webcam_2mp.jpg": ((1600, 1200), "JPEG", 1),
+    "scan_4mp.png": ((2000, 2000), "PNG", None),
+    "small_500.jpg": ((500, 500), "JPEG", 1),
+}
+
+IMPLEMENTATIONS = ("legacy", "fast", "balanced", "smallest")
+
+
+def _legacy(source, save_path):
+    image = Image.open(source)
+    image = image.convert("RGB")
+    image = image.resize(Config.IMAGE_SIZE)
+    image.save(save_path, format="JPEG", quality=Config.IMAGE_QUALITY, optimize=True)
+
+
+def build_corpus(directory):
+    paths = []
+    for name, (size, fmt, orientation) in CORPUS.items():
+        path = os.path.join(directory, name)
+        # Noise over a gradient compresses roughly like a real photo
+        image = Image.merge("RGB", [
+            Image.linear_gradient("L").resize(size),
+            Image.effect_noise(size, 40),
+            Image.radial_gradient("L").resize(size),
+        ])
+        if fmt == "JPEG":
+            exif = Image.Exif()
+            if orientation:
+                exif[0x0112] = orientation
+            image.save(path, format="JPEG", quality=92, exif=exif.tobytes())
+        else:
+            image.save(path, format="PNG")
+        paths.append(path)
+    return paths
+
+
+def _peak_rss_mb():
+    # ru_maxrss survives execve, so it would report the parent's peak;
+    # VmHWM belongs to this process image only.
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(implementation, source, repeat):
+    from src.services.image_service import process_image
+
+    with tempfile.TemporaryDirectory() as workdir:
+        save_path = os.path.join(workdir, "out.jpg")
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            if implementation == "legacy":
+                _legacy(source, save_path)
+            else:
+                process_image(source, save_path, implementation)
+            timings.append(time.perf_counter() - started)
+        output_bytes = os.path.getsize(save_path)
+
+    return {
+        "latency_ms": min(timings) * 1000,
+        "peak_rss_mb": _peak_rss_mb(),
+        "output_bytes": output_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--worker", nargs=2, metavar=("IMPLEMENTATION", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(_measure(args.worker[0], args.worker[1], args.repeat)))
+        return
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        paths = build_corpus(corpus_dir)
+        print(f"{'image':<18}{'impl':<10}{'latency ms':>12}{'peak RSS MB':>13}{'output KB':>11}")
+        for path in paths:
+            for implementation in IMPLEMENTATIONS:
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.image_benchmark",
+                     "--repeat", str(args.repeat), "--worker", implementation, path],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                result = json.loads(output)
+                print(
+                    f"{os.path.basename(path):<18}{implementation:<10}"
+                    f"{result['latency_ms']:>12.1f}{result['peak_rss_mb']:>13.1f}"
+                    f"{result['output_bytes'] / 1024:>11.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
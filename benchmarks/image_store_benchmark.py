@@ -0,0 +1,97 @@
+"""
+Measure what the content-addressed image store saves: processing a set
+of photos, then the same uploads again (answered from image_sources
+without decoding), and a garbage collection over a large upload folder
+with some unreferenced images and orphaned files.
+
+    python -m benchmarks.image_store_benchmark --photos 50 --stored 20000
+"""
+import argparse
+import io
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from werkzeug.datastructures import FileStorage
+
+from benchmarks.common import make_app
+from benchmarks.suite import synthetic_photos
+from src.services.image_service import collect_garbage, resize_and_compress
+
+
+def _upload_all(photos):
+    started = time.perf_counter()
+    paths = [
+        resize_and_compress(FileStorage(io.BytesIO(photo), filename=f"{number}.jpg"))
+        for number, photo in enumerate(photos)
+    ]
+    return time.perf_counter() - started, paths
+
+
+def _fill_store(database, upload_folder, count, unreferenced, orphans):
+    """
+    count stored images (a main file and two renditions each), every
+    unreferenced-th one without a user, plus orphan files nobody
+    registered. Everything is dated well past the grace period.
+    """
+    conn = sqlite3.connect(database)
+    users = []
+    for number in range(count + orphans):
+        name = f"{number:024x}"
+        for suffix in (".jpg", "_64.jpg", ".webp"):
+            path = os.path.join(upload_folder, name + suffix)
+            with open(path, "wb") as handle:
+                handle.write(b"\xff\xd8")
+            os.utime(path, (1, 1))
+        if number < count and number % unreferenced:
+            users.append((f"Candidate {number}", f"9{number:09d}", f"uploads/{name}.jpg"))
+        elif number < count:
+            conn.execute("INSERT INTO images (image_path, last_used) VALUES (?, '2000-01-01')", (f"uploads/{name}.jpg",))
+    conn.executemany("INSERT INTO users (name, phone, image_path) VALUES (?, ?, ?)", users)
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--photos", type=int, default=50)
+    parser.add_argument("--stored", type=int, default=20000)
+    parser.add_argument("--unreferenced-every", type=int, default=20)
+    parser.add_argument("--orphans", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = make_app(workdir)
+        with app.app_context():
+            upload_folder = app.config["UPLOAD_FOLDER"]
+            photos = synthetic_photos(args.photos, seed=22)
+
+            first, paths = _upload_all(photos)
+            again, repeat_paths = _upload_all(photos)
+            assert paths == repeat_paths
+            print(f"{'first upload':16} {first / args.photos * 1000:8.2f} ms/photo")
+            print(f"{'same source again':16} {again / args.photos * 1000:8.2f} ms/photo  ({first / again:.0f}x)")
+
+            _fill_store(app.config["DATABASE_PATH"], upload_folder, args.stored, args.unreferenced_every, args.orphans)
+            files = len(os.listdir(upload_folder))
+
+            tracemalloc.start()
+            started = time.perf_counter()
+            removed = collect_garbage(grace=60)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            left = len(os.listdir(upload_folder))
+            app.extensions["db_pool"].close_all()
+
+    print(
+        f"gc over {files} files: {elapsed:.2f}s, released {removed['released']} images,"
+        f" {removed['orphans']} orphaned files, {left} files left, peak Python memory {peak / 1024:.0f} KB"
+    )
+
+
+if __name__ == "__main__":
+    main()
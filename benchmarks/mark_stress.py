@@ -0,0 +1,68 @@
+"""
+Fire parallel taps at POST /attendance/mark and check that each side of
+a day's record is captured exactly once, while reporting tap latency.
+
+    python -m benchmarks.mark_stress --users 50 --taps-per-user 8 --threads 16
+"""
+import argparse
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import make_app, percentile, seed_users
+
+
+def _tap(app, user_id, action):
+    client = app.test_client()
+    started = time.perf_counter()
+    response = client.post("/attendance/mark", data={"user_id": str(user_id), "action": action})
+    return user_id, action, response.get_json(), time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--taps-per-user", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = make_app(workdir, DB_POOL_SIZE=args.threads)
+        seed_users(app.config["DATABASE_PATH"], args.users)
+
+        results = []
+        for action in ("in", "out"):
+            jobs = [
+                (user_id, action)
+                for user_id in range(1, args.users + 1)
+                for _ in range(args.taps_per_user)
+            ]
+            with ThreadPoolExecutor(max_workers=args.threads) as executor:
+                results.extend(executor.map(lambda job: _tap(app, *job), jobs))
+
+        app.extensions["db_pool"].close_all()
+
+    successes = {}
+    for user_id, action, payload, _ in results:
+        if payload["status"] == "success":
+            successes[(user_id, action)] = successes.get((user_id, action), 0) + 1
+            if action == "out" and payload["total_classes"] != 1:
+                raise SystemExit(f"user {user_id}: unexpected total {payload['total_classes']}")
+
+    duplicates = {key: count for key, count in successes.items() if count != 1}
+    missing = args.users * 2 - len(successes)
+    latencies = sorted(result[3] for result in results)
+
+    print(f"taps: {len(results)}  users: {args.users}  threads: {args.threads}")
+    print(
+        f"latency ms  p50 {percentile(latencies, 0.5) * 1000:.2f}"
+        f"  p95 {percentile(latencies, 0.95) * 1000:.2f}"
+        f"  p99 {percentile(latencies, 0.99) * 1000:.2f}"
+    )
+    if duplicates or missing:
+        raise SystemExit(f"FAILED: duplicates={duplicates} missing={missing}")
+    print("OK: every in/out captured exactly once")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Compare single-threaded TemplateIndex scoring with ParallelMatcher, using
+the stand-in bit-similarity scorer. Both read the templates from a
+template store in a temporary directory.
+
+    python -m benchmarks.parallel_match_benchmark --size 100000 --workers 4
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from src.services.parallel_matcher import ParallelMatcher
+from src.services.template_index import BitSimilarityScorer, TemplateIndex
+from src.services.template_store import TemplateStore
+
+
+def _noisy(template_bytes, flip_fraction, rng):
+    value = int.from_bytes(template_bytes, "big")
+    bits = 8 * len(template_bytes)
+    for position in rng.sample(range(bits), int(bits * flip_fraction)):
+        value ^= 1 << position
+    return value.to_bytes(len(template_bytes), "big")
+
+
+def _avg_ms(fn, probes):
+    started = time.perf_counter()
+    results = [fn(probe) for probe in probes]
+    return (time.perf_counter() - started) / len(probes) * 1000, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--template-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--queries", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    args = parser.parse_args()
+
+    rng = random.Random(99)
+    rows = [(user_id, rng.randbytes(args.template_size)) for user_id in range(1, args.size + 1)]
+    targets = rng.sample(range(args.size), args.queries)
+    hit_probes = [_noisy(rows[i][1], 0.02, rng) for i in targets]
+    miss_probes = [rng.randbytes(args.template_size) for _ in range(args.queries)]
+
+    workdir = tempfile.TemporaryDirectory()
+    store = TemplateStore(os.path.join(workdir.name, "fingerprints.tpl"), max(1024, args.template_size + 16))
+    store.put_many(rows)
+
+    scorer = BitSimilarityScorer()
+    single = TemplateIndex(scorer=scorer, threshold=args.threshold)
+    single.load(store.items())
+
+    parallel = ParallelMatcher(store, scorer, args.threshold, workers=args.workers, deadline_ms=60000)
+    parallel.load(store.items())
+    started = time.perf_counter()
+    parallel.warm_up()
+    warm_ms = (time.perf_counter() - started) * 1000
+
+    single_hit, _ = _avg_ms(single.match, hit_probes)
+    single_miss, _ = _avg_ms(single.match, miss_probes)
+    parallel_hit, hit_results = _avg_ms(parallel.search, hit_probes)
+    parallel_miss, miss_results = _avg_ms(parallel.search, miss_probes)
+    parallel.close()
+    workdir.cleanup()
+
+    correct = sum(
+        result["user_id"] == rows[i][0] for result, i in zip(hit_results, targets)
+    )
+    print(f"templates: {args.size}  workers: {args.workers}  pool warm-up: {warm_ms:.0f} ms")
+    print(f"{'':<10}{'hit ms':>12}{'miss ms':>12}")
+    print(f"{'single':<10}{single_hit:>12.2f}{single_miss:>12.2f}")
+    print(f"{'parallel':<10}{parallel_hit:>12.2f}{parallel_miss:>12.2f}")
+    print(f"parallel hits correct: {correct}/{len(targets)}")
+    print("last miss timings:", miss_results[-1]["timings_ms"])
+    print("last hit shards cancelled:", hit_results[-1]["shards_cancelled"], "of", hit_results[-1]["shards"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Time /attendance and /admin with the render cache off, warm, and right
+after a single check-in (one card re-rendered, the rest reused).
+
+    python -m benchmarks.render_cache_benchmark --users 2740 --requests 50
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import make_app, seed_users
+
+
+def _time_get(client, path, requests):
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.get(path)
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.status_code
+    return statistics.median(samples)
+
+
+def _after_write(client, path, requests):
+    samples = []
+    user_id = 1
+    for _ in range(requests):
+        # The first tap of the day for a new user changes exactly one card
+        client.post("/attendance/mark", data={"user_id": str(user_id), "action": "in"})
+        user_id += 1
+        started = time.perf_counter()
+        client.get(path)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def _run(users, requests, max_bytes):
+    with tempfile.TemporaryDirectory() as workdir:
+        app = make_app(workdir, RENDER_CACHE_MAX_BYTES=max_bytes)
+        seed_users(app.config["DATABASE_PATH"], users)
+        client = app.test_client()
+        client.get("/attendance")
+        client.get("/admin")
+        result = {
+            "attendance": _time_get(client, "/attendance", requests),
+            "admin": _time_get(client, "/admin", requests),
+            "attendance after check-in": _after_write(client, "/attendance", requests),
+        }
+        stats = app.extensions["render_cache"].stats()
+        app.extensions["db_pool"].close_all()
+    return result, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2740)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    uncached, _ = _run(args.users, args.requests, 0)
+    cached, stats = _run(args.users, args.requests, 32 * 1024 * 1024)
+    for name in uncached:
+        print(f"{name:28} uncached {uncached[name]:7.2f} ms  cached {cached[name]:7.2f} ms (median)")
+    print(f"cache: {stats['entries']} entries, {stats['bytes'] / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Check-in latency while admin reports run, with the reports reading the
+primary database versus its reporting replica (two files, one applier).
+
+A tapper process checks candidates in and out with attendance_model.mark
+at a steady rate against the primary. Reporter processes meanwhile
+stream whole-history exports (iter_user_summaries and iter_attendance)
+as fast as they can, from the primary in one phase and from the replica
+in the next, while an applier process follows the change log. Two idle
+phases first show what capturing the change log costs a check-in. The
+replica's staleness is sampled by the reporters.
+
+    python -m benchmarks.replica_benchmark --users 500 --days 365 --reporters 2
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+from benchmarks.common import make_app, percentile, seed_users
+from src.database import get_db_connection
+from src.models import attendance_model
+from src.services import replica
+
+
+def _seed_attendance(path, days):
+    conn = get_db_connection(path)
+    conn.execute(
+        """
+        WITH RECURSIVE calendar(day) AS (
+            SELECT date('2023-01-01')
+            UNION ALL
+            SELECT date(day, '+1 day') FROM calendar WHERE day < date('2023-01-01', ?)
+        )
+        INSERT INTO attendance (user_id, date, in_time, out_time)
+        SELECT u.id, c.day, '09:00:00', '10:30:00' FROM users u CROSS JOIN calendar c
+        """,
+        (f"+{days - 1} days",),
+    )
+    conn.commit()
+    rows = conn.execute("SELECT COUNT(*) FROM attendance").fetchone()[0]
+    conn.close()
+    return rows
+
+
+def _tapper(database, users, taps, rate, first_day, start_event, results):
+    conn = get_db_connection(database)
+    latencies = []
+    start_event.wait()
+    next_tap = time.perf_counter()
+    for tap in range(taps):
+        user_id = 1 + tap // 2 % users
+        day = (date(2030, 1, 1) + timedelta(days=first_day + tap // (2 * users))).isoformat()
+        action = "in" if tap % 2 == 0 else "out"
+        next_tap += 1.0 / rate
+        time.sleep(max(0.0, next_tap - time.perf_counter()))
+        started = time.perf_counter()
+        attendance_model.mark(conn, user_id, action, day, "09:00:00" if action == "in" else "10:00:00")
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+    results.put(("taps", latencies))
+
+
+def _reporter(database, from_replica, start_event, stop_event, results):
+    conn = replica.open_replica(database) if from_replica else get_db_connection(database)
+    reports = 0
+    staleness = []
+    start_event.wait()
+    while not stop_event.is_set():
+        for _ in attendance_model.iter_user_summaries(conn):
+            pass
+        for _ in attendance_model.iter_attendance(conn):
+            if stop_event.is_set():
+                break
+        reports += 1
+        if from_replica:
+            state = replica.replica_state(conn)
+            staleness.append(time.time() - state["fresh_as_of"])
+    conn.close()
+    results.put(("reports", (reports, staleness)))
+
+
+def _applier(database, interval, stop_event):
+    applier = replica.Applier(database, batch_rows=2000)
+    while not stop_event.is_set():
+        _, applied = applier.step()
+        if not applied:
+            time.sleep(interval)
+    applier.close()
+
+
+def run_phase(context, database, reporters, from_replica, args, first_day):
+    start_event, stop_event = context.Event(), context.Event()
+    results = context.Queue()
+    tapper = context.Process(
+        target=_tapper,
+        args=(database, args.users, args.taps, args.rate, first_day, start_event, results),
+    )
+    workers = [
+        context.Process(
+            target=_reporter,
+            args=(replica.replica_path(database) if from_replica else database, from_replica,
+                  start_event, stop_event, results),
+        )
+        for _ in range(reporters)
+    ]
+    for process in [tapper] + workers:
+        process.start()
+    time.sleep(1.0)  # let every process open its connection
+    start_event.set()
+
+    latencies, reports, staleness = [], 0, []
+    for _ in range(1 + reporters):
+        kind, payload = results.get()
+        if kind == "taps":
+            latencies = sorted(payload)
+            stop_event.set()
+        else:
+            reports += payload[0]
+            staleness += payload[1]
+    for process in [tapper] + workers:
+        process.join()
+    return latencies, reports, max(staleness, default=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--days", type=int, default=365, help="Days of history per candidate.")
+    parser.add_argument("--reporters", type=int, default=2, help="Processes running reports.")
+    parser.add_argument("--taps", type=int, default=1000, help="Check-ins per phase.")
+    parser.add_argument("--rate", type=float, default=50.0, help="Check-ins per second.")
+    parser.add_argument("--interval", type=float, default=0.2, help="Applier poll interval, seconds.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = make_app(workdir, START_BACKGROUND_WORKERS=False)
+        database = app.config["DATABASE_PATH"]
+        seed_users(database, args.users)
+        rows = _seed_attendance(database, args.days)
+        print(
+            f"{rows} attendance rows, {args.reporters} reporter process(es), {args.taps} check-ins"
+            f" at {args.rate:.0f}/s per phase, {os.cpu_count()} CPUs"
+        )
+
+        context = multiprocessing.get_context("spawn")
+        # Each phase taps on its own future days; 2 taps per candidate per day
+        days_per_phase = -(-args.taps // (2 * args.users))
+        phases = [
+            ("idle, no change capture", 0, False, False),
+            ("idle, change capture on", 0, False, True),
+            ("reports on the primary", args.reporters, False, True),
+            ("reports on the replica", args.reporters, True, True),
+        ]
+        stop_applier, applier = None, None
+        for number, (label, reporters, from_replica, capture) in enumerate(phases):
+            if capture and applier is None:
+                # Snapshot before the applier starts following
+                conn = get_db_connection(database)
+                target = get_db_connection(replica.replica_path(database))
+                replica.rebuild(conn, target)
+                conn.close()
+                target.close()
+                stop_applier = context.Event()
+                applier = context.Process(target=_applier, args=(database, args.interval, stop_applier))
+                applier.start()
+
+            latencies, reports, staleness = run_phase(
+                context, database, reporters, from_replica, args, number * days_per_phase
+            )
+            line = (
+                f"{label:26}  p50 {percentile(latencies, 0.5) * 1000:6.2f} ms"
+                f"  p99 {percentile(latencies, 0.99) * 1000:7.2f} ms"
+                f"  max {latencies[-1] * 1000:7.2f} ms"
+            )
+            if reporters:
+                line += f"  {reports} reports"
+            if staleness is not None:
+                line += f"  replica staleness <= {staleness:.2f}s"
+            print(line)
+
+        stop_applier.set()
+        applier.join()
+        status = replica.status(database)
+        print(f"replica {status['behind']} changes behind at the end")
+        app.extensions["db_pool"].close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Compare the development server (app.py: werkzeug, debugger and reloader
+on) with the production setup (gunicorn -c gunicorn.conf.py wsgi:app) on
+the same seeded database: time from launch to the first successful
+request, then throughput and latency for a read-heavy mix of board loads,
+listing pages and check-ins from concurrent keep-alive clients.
+
+    python -m benchmarks.serving_benchmark --users 2740 --clients 16 --seconds 10
+"""
+import argparse
+import http.client
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import percentile, seed_users
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (method, path) mix per client loop: mostly reads, one check-in in seven
+_MIX = [("GET", "/api/users?limit=50")] * 4 + [("GET", "/attendance")] * 2 + [("POST", "/attendance/mark")]
+
+
+def _patch_config(workdir):
+    from src.config import Config
+
+    Config.DATABASE_PATH = os.path.join(workdir, "attendance.db")
+    Config.STATIC_FOLDER = workdir
+    Config.UPLOAD_FOLDER = os.path.join(workdir, "uploads")
+    Config.SPOOL_FOLDER = os.path.join(workdir, "spool")
+
+
+def bench_app():
+    """
+    wsgi.py's app against the benchmark database, for
+    `gunicorn benchmarks.serving_benchmark:bench_app()`.
+    """
+    _patch_config(os.environ["BENCH_WORKDIR"])
+    from src import create_app
+
+    return create_app({"INIT_DB_ON_START": False, "START_BACKGROUND_WORKERS": False})
+
+
+def _serve_dev(port):
+    _patch_config(os.environ["BENCH_WORKDIR"])
+    from src import create_app
+
+    create_app().run(port=port, debug=True)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _launch(mode, port, workdir):
+    env = dict(os.environ, BENCH_WORKDIR=workdir, PYTHONPATH=ROOT)
+    if mode == "dev":
+        command = [sys.executable, "-m", "benchmarks.serving_benchmark", "--serve-dev", str(port)]
+    else:
+        command = [
+            sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"),
+            "--bind", f"127.0.0.1:{port}", "--log-level", "warning",
+            "benchmarks.serving_benchmark:bench_app()",
+        ]
+    # New session so the reloader's child is stopped along with its parent
+    return subprocess.Popen(
+        command, cwd=ROOT, env=env, start_new_session=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def _wait_ready(port, timeout=60):
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/api/users?limit=1")
+            if conn.getresponse().status == 200:
+                return time.perf_counter() - started
+        except OSError:
+            pass
+        time.sleep(0.02)
+    raise RuntimeError(f"server on port {port} did not come up")
+
+
+def _client(port, users, deadline, latencies, errors):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    rng = random.Random()
+    while time.perf_counter() < deadline:
+        for method, path in _MIX:
+            body, headers = None, {}
+            if method == "POST":
+                body = f"user_id={rng.randint(1, users)}&action=in"
+                headers = {"Content-Type": "application/x-www-form-urlencoded"}
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 500:
+                    errors.append(response.status)
+            except OSError:
+                errors.append("connection")
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                continue
+            latencies.append(time.perf_counter() - started)
+    conn.close()
+
+
+def _measure(mode, workdir, users, clients, seconds):
+    port = _free_port()
+    process = _launch(mode, port, workdir)
+    try:
+        startup = _wait_ready(port)
+        latencies, errors = [], []
+        deadline = time.perf_counter() + seconds
+        threads = [
+            threading.Thread(target=_client, args=(port, users, deadline, latencies, errors))
+            for _ in range(clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - (deadline - seconds)
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    latencies.sort()
+    return {
+        "startup_s": startup,
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2740)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--serve-dev", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_dev:
+        _serve_dev(args.serve_dev)
+        return
+
+    for mode in ("dev", "gunicorn"):
+        with tempfile.TemporaryDirectory() as workdir:
+            _patch_config(workdir)
+            seed_users(os.path.join(workdir, "attendance.db"), args.users)
+            os.makedirs(os.path.join(workdir, "uploads"), exist_ok=True)
+            result = _measure(mode, workdir, args.users, args.clients, args.seconds)
+        print(
+            f"{mode:9} startup {result['startup_s']:5.2f}s  {result['rps']:7.1f} req/s  "
+            f"p50 {result['p50_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  "
+            f"({result['requests']} requests, {result['errors']} errors)"
+        )
+
+
+if __name__ == "__main__":
+    main()
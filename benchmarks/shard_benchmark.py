@@ -0,0 +1,111 @@
+"""
+Write throughput against one database versus the same load spread over
+per-branch shards. Writer processes (standing in for server workers)
+each tap their own candidates in and out with attendance_model.mark, one
+transaction per tap; writer i writes to branch i % shards. With a single
+shard every writer queues on the same SQLite write lock (busy waits back
+off in sleeps); with more shards fewer writers share each lock.
+--synchronous FULL makes every commit wait for fsync while holding the
+lock, as a deployment that cannot lose a tap would.
+
+    python -m benchmarks.shard_benchmark --shards 1 2 4 --writers 8 --taps 400
+    python -m benchmarks.shard_benchmark --synchronous FULL
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.common import make_app, percentile, seed_users
+from src import shards
+from src.database import get_db_connection
+from src.models import attendance_model
+
+
+def _writer(database, synchronous, first_user, users, taps, start_event, results):
+    conn = get_db_connection(database)
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    latencies = []
+    start_event.wait()
+    started = time.perf_counter()
+    for tap in range(taps):
+        user_id = first_user + tap // 2 % users
+        day = f"2025-{1 + tap // (2 * users) // 28 % 12:02d}-{1 + tap // (2 * users) % 28:02d}"
+        action = "in" if tap % 2 == 0 else "out"
+        tap_started = time.perf_counter()
+        attendance_model.mark(conn, user_id, action, day, "09:00:00" if action == "in" else "10:00:00")
+        latencies.append(time.perf_counter() - tap_started)
+    conn.close()
+    results.put(latencies)
+
+
+def run(shard_count, writers, taps, users_per_writer, synchronous):
+    with tempfile.TemporaryDirectory() as workdir:
+        branches = tuple(f"branch{number}" for number in range(shard_count))
+        app = make_app(
+            workdir,
+            BRANCHES=branches,
+            SHARD_FOLDER=os.path.join(workdir, "shards"),
+            START_BACKGROUND_WORKERS=False,
+        )
+        targets = shards.all_shards(app)
+        for shard in targets:
+            writers_here = len(range(targets.index(shard), writers, shard_count))
+            seed_users(shard.database, writers_here * users_per_writer)
+
+        context = multiprocessing.get_context("spawn")
+        start_event = context.Event()
+        results = context.Queue()
+        processes = []
+        for number in range(writers):
+            shard = targets[number % shard_count]
+            # Writers on the same shard take disjoint candidates
+            first_user = 1 + number // shard_count * users_per_writer
+            process = context.Process(
+                target=_writer,
+                args=(shard.database, synchronous, first_user, users_per_writer, taps, start_event, results),
+            )
+            process.start()
+            processes.append(process)
+
+        time.sleep(1.0)  # let every writer open its connection
+        started = time.perf_counter()
+        start_event.set()
+        outcomes = [results.get() for _ in processes]
+        elapsed = time.perf_counter() - started
+        for process in processes:
+            process.join()
+        app.extensions["db_pool"].close_all()
+
+    latencies = sorted(latency for samples in outcomes for latency in samples)
+    return writers * taps / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--taps", type=int, default=400, help="Taps per writer.")
+    parser.add_argument("--users-per-writer", type=int, default=20)
+    parser.add_argument("--synchronous", choices=["NORMAL", "FULL"], default="NORMAL")
+    args = parser.parse_args()
+
+    baseline = None
+    print(
+        f"{args.writers} writer processes, {args.taps} taps each, synchronous={args.synchronous},"
+        f" {os.cpu_count()} CPUs"
+    )
+    for shard_count in args.shards:
+        throughput, p50, p99 = run(
+            shard_count, args.writers, args.taps, args.users_per_writer, args.synchronous
+        )
+        baseline = baseline or throughput
+        print(
+            f"{shard_count:2} shard(s): {throughput:8.0f} taps/s ({throughput / baseline:4.2f}x)"
+            f"  p50 {p50 * 1000:6.2f} ms  p99 {p99 * 1000:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
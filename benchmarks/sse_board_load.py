@@ -0,0 +1,172 @@
+"""
+Hold N live attendance boards open on /attendance/stream while a stream of
+taps hits POST /attendance/mark, and report how long each change takes to
+reach every board.
+
+Boards are plain sockets multiplexed in one client thread; the server is a
+threaded werkzeug server on a random local port.
+
+    python -m benchmarks.sse_board_load --boards 200 --users 100 --tap-rate 20
+"""
+import argparse
+import json
+import logging
+import selectors
+import socket
+import tempfile
+import threading
+import time
+import http.client
+from urllib.parse import urlencode
+
+from werkzeug.serving import make_server
+
+from benchmarks.common import make_app, percentile, seed_users
+
+
+def _open_board(port):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall(
+        b"GET /attendance/stream HTTP/1.1\r\nHost: localhost\r\n"
+        b"Accept: text/event-stream\r\n\r\n"
+    )
+    sock.setblocking(False)
+    return sock
+
+
+def _parse_events(buffer):
+    """
+    Split complete SSE events off the buffer. Returns (events, rest).
+    """
+    events = []
+    while b"\n\n" in buffer:
+        raw, buffer = buffer.split(b"\n\n", 1)
+        name, data = None, None
+        for line in raw.split(b"\n"):
+            if line.startswith(b"event: "):
+                name = line[7:].decode()
+            elif line.startswith(b"data: "):
+                data = line[6:]
+        if name == "attendance":
+            events.append(json.loads(data))
+    return events, buffer
+
+
+def _read_boards(socks, expected, sent_at, latencies, done):
+    selector = selectors.DefaultSelector()
+    buffers = {}
+    received = {}
+    for sock in socks:
+        selector.register(sock, selectors.EVENT_READ)
+        buffers[sock] = b""
+        received[sock] = 0
+
+    while not done.is_set():
+        for key, _ in selector.select(timeout=0.2):
+            chunk = key.fileobj.recv(65536)
+            if not chunk:
+                selector.unregister(key.fileobj)
+                continue
+            now = time.perf_counter()
+            events, buffers[key.fileobj] = _parse_events(buffers[key.fileobj] + chunk)
+            for event in events:
+                action = "out" if event["out_time"] else "in"
+                latencies.append(now - sent_at[(event["user_id"], action)])
+            received[key.fileobj] += len(events)
+        if all(count >= expected for count in received.values()):
+            break
+    return received
+
+
+def _tap(port, user_id, action):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    conn.request(
+        "POST",
+        "/attendance/mark",
+        body=urlencode({"user_id": user_id, "action": action}),
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    payload = json.loads(conn.getresponse().read())
+    conn.close()
+    return payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--boards", type=int, default=200)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--tap-rate", type=float, default=20.0, help="taps per second")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = make_app(workdir, EVENT_MAX_SUBSCRIBERS=args.boards, EVENT_KEEPALIVE=5)
+        seed_users(app.config["DATABASE_PATH"], args.users)
+
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        port = server.server_port
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        started = time.perf_counter()
+        socks = [_open_board(port) for _ in range(args.boards)]
+        bus = app.extensions["event_bus"]
+        while bus.stats()["subscribers"] < args.boards:
+            time.sleep(0.01)
+        connect_seconds = time.perf_counter() - started
+        idle_threads = threading.active_count()
+
+        taps = [(user_id, action) for action in ("in", "out") for user_id in range(1, args.users + 1)]
+        sent_at = {}
+        latencies = []
+        done = threading.Event()
+        reader_result = {}
+        reader = threading.Thread(
+            target=lambda: reader_result.update(
+                _read_boards(socks, len(taps), sent_at, latencies, done)
+            )
+        )
+        reader.start()
+
+        interval = 1.0 / args.tap_rate
+        tap_latencies = []
+        for user_id, action in taps:
+            sent_at[(user_id, action)] = time.perf_counter()
+            payload = _tap(port, user_id, action)
+            tap_latencies.append(time.perf_counter() - sent_at[(user_id, action)])
+            if payload["status"] != "success":
+                raise SystemExit(f"tap {user_id}/{action} failed: {payload}")
+            time.sleep(max(0.0, interval - tap_latencies[-1]))
+
+        reader.join(timeout=30)
+        done.set()
+        reader.join()
+        stats = bus.stats()
+
+        bus.close()
+        for sock in socks:
+            sock.close()
+        server.shutdown()
+        app.extensions["db_pool"].close_all()
+
+    missed = sum(len(taps) - count for count in reader_result.values())
+    latencies.sort()
+    tap_latencies.sort()
+
+    print(f"boards: {args.boards}  taps: {len(taps)}  rate: {args.tap_rate}/s")
+    print(f"boards connected in {connect_seconds:.2f}s  threads while idle: {idle_threads}")
+    print(
+        f"tap latency ms       p50 {percentile(tap_latencies, 0.5) * 1000:.2f}"
+        f"  p95 {percentile(tap_latencies, 0.95) * 1000:.2f}"
+    )
+    print(
+        f"board delivery ms    p50 {percentile(latencies, 0.5) * 1000:.2f}"
+        f"  p95 {percentile(latencies, 0.95) * 1000:.2f}"
+        f"  p99 {percentile(latencies, 0.99) * 1000:.2f}"
+    )
+    print(f"deliveries: {len(latencies)}  missed: {missed}  bus: {stats}")
+    if missed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
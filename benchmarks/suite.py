@@ -0,0 +1,461 @@
+"""
+Whole-app load and benchmark harness.
+
+Seeds a synthetic database through init_db() at a named scale, generates
+synthetic upload photos, then drives the app through realistic traffic
+mixes and writes p50/p95/p99 latency, throughput and peak memory as JSON.
+Runs are reproducible for a given --seed.
+
+    python -m benchmarks.suite run --scale small --output small.json
+    python -m benchmarks.suite run --scale medium --server --scenarios checkin_burst mixed
+    python -m benchmarks.suite compare baseline.json small.json
+
+Scales: small (100 users, 10k rows), medium (5k users, 500k rows),
+large (50k users, 5M rows). --driver client uses the Flask test client
+in-process; --server starts a threaded werkzeug server and goes over HTTP.
+"""
+import argparse
+import http.client
+import io
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+from PIL import Image, ImageDraw
+
+from benchmarks.common import make_app, percentile
+from src.database import get_db_connection, init_db
+
+
+SCALES = {
+    # name: (users, attendance days per user)
+    "small": (100, 100),
+    "medium": (5000, 100),
+    "large": (50000, 100),
+}
+
+
+def _peak_rss_mb():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def seed_database(path, users, days, seed):
+    """
+    Users plus `days` completed classes each, ending yesterday, so today's
+    check-ins are all free. Times are derived from the seed, not random().
+    """
+    init_db(path)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (name, phone, image_path) VALUES (?, ?, ?)",
+        ((f"Candidate {i:06d}", f"9{i:09d}", "uploads/none.jpg") for i in range(users)),
+    )
+    conn.commit()
+
+    end = date.today() - timedelta(days=1)
+    start = end - timedelta(days=days - 1)
+    conn.execute(
+        """
+        WITH RECURSIVE calendar(day, n) AS (
+            SELECT ?, 0
+            UNION ALL
+            SELECT date(day, '+1 day'), n + 1 FROM calendar WHERE day < ?
+        )
+        INSERT INTO attendance (user_id, date, in_time, out_time)
+        SELECT u.id, c.day,
+               printf('%02d:%02d:00', 8 + (u.id * 7 + c.n + ?) % 8, (u.id * 13 + c.n) % 60),
+               printf('%02d:%02d:00', 9 + (u.id * 7 + c.n + ?) % 8, (u.id * 13 + c.n) % 60)
+        FROM users u CROSS JOIN calendar c
+        """,
+        (start.isoformat(), end.isoformat(), seed, seed),
+    )
+    conn.commit()
+    rows = conn.execute("SELECT COUNT(*) FROM attendance").fetchone()[0]
+    conn.close()
+    return rows
+
+
+def synthetic_photos(count, seed, size=(1600, 1200)):
+    """
+    JPEG bytes with gradients and shapes, so they compress like photos
+    rather than flat colour.
+    """
+    rng = random.Random(seed)
+    photos = []
+    for _ in range(count):
+        image = Image.linear_gradient("L").resize(size).convert("RGB")
+        draw = ImageDraw.Draw(image)
+        for _ in range(12):
+            x, y = rng.randrange(size[0]), rng.randrange(size[1])
+            radius = rng.randrange(40, 300)
+            colour = tuple(rng.randrange(256) for _ in range(3))
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=colour)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=90)
+        photos.append(buffer.getvalue())
+    return photos
+
+
+class ClientDriver:
+    """
+    Requests through the Flask test client, one client per thread.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def request(self, method, path, form=None, files=None):
+        data = dict(form or {})
+        for name, (filename, payload) in (files or {}).items():
+            data[name] = (io.BytesIO(payload), filename)
+        response = self._client().open(path, method=method, data=data or None)
+        body = response.get_data()
+        return response.status_code, body
+
+
+class HttpDriver:
+    """
+    Requests over HTTP to a threaded werkzeug server, one connection per
+    thread.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self._local = threading.local()
+
+    def _conn(self):
+        if not hasattr(self._local, "conn"):
+            self._local.conn = http.client.HTTPConnection("127.0.0.1", self.port)
+        return self._local.conn
+
+    def request(self, method, path, form=None, files=None):
+        headers = {}
+        body = None
+        if files:
+            boundary = uuid.uuid4().hex
+            body = _multipart(boundary, form or {}, files)
+            headers["Content-Type"] = f"multipart/form-data; boundary={boundary}"
+        elif form:
+            body = urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        conn = self._conn()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            del self._local.conn
+            raise
+
+
+def _multipart(boundary, form, files):
+    parts = []
+    for name, value in form.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, (filename, payload) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: image/jpeg\r\n\r\n".encode() + payload + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts)
+
+
+class Context:
+    """
+    Shared state for scenarios: user ids still free to check in today,
+    the photo corpus and a seeded RNG per thread.
+    """
+
+    def __init__(self, users, photos, seed):
+        self.users = users
+        self.photos = photos
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._unmarked = list(range(1, users + 1))
+        random.Random(seed).shuffle(self._unmarked)
+        self._local = threading.local()
+
+    def rng(self):
+        if not hasattr(self._local, "rng"):
+            self._local.rng = random.Random(f"{self.seed}-{threading.get_ident()}")
+        return self._local.rng
+
+    def next_unmarked(self):
+        with self._lock:
+            return self._unmarked.pop() if self._unmarked else None
+
+
+# Each operation returns True on success
+def op_check_in(driver, ctx):
+    user_id = ctx.next_unmarked()
+    if user_id is None:
+        user_id = ctx.rng().randint(1, ctx.users)
+    ok = True
+    for action in ("in", "out"):
+        status, body = driver.request("POST", "/attendance/mark", {"user_id": user_id, "action": action})
+        ok = ok and status == 200 and b'"status"' in body
+    return ok
+
+
+def op_board(driver, ctx):
+    status, _ = driver.request("GET", "/attendance")
+    return status == 200
+
+
+def op_admin_dashboard(driver, ctx):
+    rng = ctx.rng()
+    roll = rng.random()
+    if roll < 0.6:
+        path = "/admin"
+    elif roll < 0.8:
+        path = f"/admin?q=Candidate%20{rng.randrange(10):d}"
+    else:
+        path = f"/api/users?limit=50&q={rng.randrange(90, 99)}"
+    status, _ = driver.request("GET", path)
+    return status == 200
+
+
+def op_backfill(driver, ctx):
+    rng = ctx.rng()
+    end = date.today() - timedelta(days=rng.randrange(120, 400))
+    form = {
+        "user_id": rng.randint(1, ctx.users),
+        "start_date": (end - timedelta(days=60)).isoformat(),
+        "end_date": end.isoformat(),
+        "time_start": "09:00",
+        "time_end": "17:00",
+        "total_classes": 20,
+        "class_duration_hours": 1.5,
+    }
+    status, _ = driver.request("POST", "/admin/generate-attendance", form)
+    return status in (200, 302)
+
+
+def op_enroll(driver, ctx):
+    rng = ctx.rng()
+    photo = ctx.photos[rng.randrange(len(ctx.photos))]
+    form = {"name": f"Enrollee {rng.randrange(10**6):06d}", "phone": f"8{rng.randrange(10**9):09d}"}
+    status, _ = driver.request("POST", "/users/add", form, {"image": ("photo.jpg", photo)})
+    # 503 is the queue shedding load, which is a valid answer under a burst
+    return status in (302, 503)
+
+
+SCENARIOS = {
+    # name: (weighted operations, default operation count)
+    "checkin_burst": ([(op_check_in, 1)], 400),
+    "board_refresh": ([(op_board, 1)], 60),
+    "admin_dashboard": ([(op_admin_dashboard, 1)], 200),
+    "backfill": ([(op_backfill, 1)], 40),
+    "enrollment": ([(op_enroll, 1)], 40),
+    "mixed": (
+        [(op_check_in, 60), (op_board, 10), (op_admin_dashboard, 20), (op_backfill, 5), (op_enroll, 5)],
+        400,
+    ),
+}
+
+
+def run_scenario(name, driver, ctx, app, threads, operations):
+    weighted, default_ops = SCENARIOS[name]
+    operations = operations or default_ops
+    ops, weights = zip(*weighted)
+    plan = random.Random(f"{ctx.seed}-{name}").choices(ops, weights, k=operations)
+
+    def timed(op):
+        started = time.perf_counter()
+        try:
+            ok = op(driver, ctx)
+        except Exception:
+            ok = False
+        return op.__name__, time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(timed, plan))
+    elapsed = time.perf_counter() - started
+
+    queue = app.extensions["image_queue"]
+    queue.wait_idle(120)
+    drained = time.perf_counter() - started
+
+    report = {
+        "operations": len(results),
+        "errors": sum(1 for _, _, ok in results if not ok),
+        "threads": threads,
+        "seconds": round(elapsed, 3),
+        "throughput_ops": round(len(results) / elapsed, 1),
+        "latency_ms": _latency([seconds for _, seconds, _ in results]),
+        "by_operation": {},
+    }
+    for op in ops:
+        samples = [seconds for op_name, seconds, _ in results if op_name == op.__name__]
+        if samples:
+            report["by_operation"][op.__name__.removeprefix("op_")] = {
+                "count": len(samples),
+                "latency_ms": _latency(samples),
+            }
+    if any(op is op_enroll for op in ops):
+        report["image_queue_drained_seconds"] = round(drained, 3)
+    return report
+
+
+def _latency(samples):
+    samples = sorted(samples)
+    return {
+        "p50": round(percentile(samples, 0.50) * 1000, 2),
+        "p95": round(percentile(samples, 0.95) * 1000, 2),
+        "p99": round(percentile(samples, 0.99) * 1000, 2),
+        "max": round(samples[-1] * 1000, 2) if samples else 0.0,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    users, days = SCALES[args.scale]
+    users = args.users or users
+    days = args.days or days
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "attendance.db")
+        started = time.perf_counter()
+        rows = seed_database(db_path, users, days, args.seed)
+        seed_seconds = time.perf_counter() - started
+        photos = synthetic_photos(args.photos, args.seed)
+
+        app = make_app(workdir, DB_POOL_SIZE=max(8, args.threads))
+        conn = get_db_connection(db_path)
+        db_bytes = conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+        conn.close()
+
+        server = None
+        if args.server:
+            from werkzeug.serving import make_server
+
+            logging.getLogger("werkzeug").setLevel(logging.WARNING)
+            server = make_server("127.0.0.1", 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            driver = HttpDriver(server.server_port)
+        else:
+            driver = ClientDriver(app)
+
+        ctx = Context(users, photos, args.seed)
+        report = {
+            "meta": {
+                "scale": args.scale,
+                "users": users,
+                "attendance_rows": rows,
+                "database_mb": round(db_bytes / 1e6, 1),
+                "seed": args.seed,
+                "seed_seconds": round(seed_seconds, 2),
+                "driver": "http" if args.server else "client",
+                "revision": _git_revision(),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "scenarios": {},
+        }
+        for name in args.scenarios:
+            print(f"running {name} ...", file=sys.stderr)
+            report["scenarios"][name] = run_scenario(name, driver, ctx, app, args.threads, args.operations)
+
+        report["meta"]["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+        report["meta"]["db_pool"] = app.extensions["db_pool"].stats()
+
+        if server is not None:
+            server.shutdown()
+        app.extensions["event_bus"].close()
+        app.extensions["db_pool"].close_all()
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output + "\n")
+    print(output)
+
+
+def compare(args):
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    with open(args.candidate) as handle:
+        candidate = json.load(handle)
+
+    print(f"{'scenario':<18}{'metric':<10}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for name, new in candidate["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if old is None:
+            continue
+        rows = [("ops/s", old["throughput_ops"], new["throughput_ops"])]
+        rows += [(key, old["latency_ms"][key], new["latency_ms"][key]) for key in ("p50", "p95", "p99")]
+        for metric, before, after in rows:
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+            print(f"{name:<18}{metric:<10}{before:>12}{after:>12}{change:>10}")
+    print(
+        f"{'peak rss MB':<28}{baseline['meta']['peak_rss_mb']:>12}"
+        f"{candidate['meta']['peak_rss_mb']:>12}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="seed a database and run scenarios")
+    run_parser.add_argument("--scale", choices=SCALES, default="small")
+    run_parser.add_argument("--users", type=int, help="override the scale's user count")
+    run_parser.add_argument("--days", type=int, help="override attendance days per user")
+    run_parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    run_parser.add_argument("--operations", type=int, help="operations per scenario (default per scenario)")
+    run_parser.add_argument("--threads", type=int, default=8)
+    run_parser.add_argument("--photos", type=int, default=4)
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--server", action="store_true", help="go over HTTP to a threaded werkzeug server")
+    run_parser.add_argument("--output", help="also write the JSON report here")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="diff two JSON reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
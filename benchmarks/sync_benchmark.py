@@ -0,0 +1,82 @@
+"""
+Compare applying kiosk taps one POST /attendance/mark at a time with
+POST /attendance/sync batches of different sizes. Every run starts from a
+fresh database and applies the same in/out events.
+
+    python -m benchmarks.sync_benchmark --users 5000 --batches 1 100 10000
+"""
+import argparse
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.common import make_app, seed_users
+
+
+def _events(users):
+    stamp = datetime.now().replace(microsecond=0)
+    return [
+        {
+            "user_id": user_id,
+            "action": action,
+            "client_timestamp": stamp.isoformat(),
+            "idempotency_key": f"kiosk-1:{user_id}:{action}",
+        }
+        for action in ("in", "out")
+        for user_id in range(1, users + 1)
+    ]
+
+
+def _run_single(client, events):
+    for event in events:
+        payload = client.post(
+            "/attendance/mark",
+            data={"user_id": str(event["user_id"]), "action": event["action"]},
+        ).get_json()
+        assert payload["status"] == "success", payload
+
+
+def _run_batched(client, events, size):
+    for start in range(0, len(events), size):
+        payload = client.post("/attendance/sync", json={"events": events[start:start + size]}).get_json()
+        statuses = {result["status"] for result in payload["results"]}
+        assert statuses == {"applied"}, statuses
+
+
+def _measure(users, runner):
+    with tempfile.TemporaryDirectory() as workdir:
+        app = make_app(workdir)
+        seed_users(app.config["DATABASE_PATH"], users)
+        client = app.test_client()
+        events = _events(users)
+
+        started = time.perf_counter()
+        runner(client, events)
+        elapsed = time.perf_counter() - started
+
+        pool_stats = app.extensions["db_pool"].stats()
+        app.extensions["db_pool"].close_all()
+    return len(events), elapsed, pool_stats["write_transactions"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--batches", type=int, nargs="+", default=[1, 100, 10000])
+    args = parser.parse_args()
+
+    runs = [("single /attendance/mark", _run_single)]
+    for size in args.batches:
+        runs.append((f"sync batch {size}", lambda client, events, size=size: _run_batched(client, events, size)))
+
+    print(f"{'mode':<26}{'events':>8}{'seconds':>10}{'events/s':>12}{'commits':>9}")
+    baseline = None
+    for label, runner in runs:
+        count, elapsed, commits = _measure(args.users, runner)
+        rate = count / elapsed
+        baseline = baseline or rate
+        print(f"{label:<26}{count:>8}{elapsed:>10.2f}{rate:>12.0f}{commits:>9}  x{rate / baseline:.1f}")
+
+
+if __name__ == "__main__":
+    main()
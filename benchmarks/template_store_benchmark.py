@@ -0,0 +1,114 @@
+"""
+Compare loading and scanning fingerprint templates from the users table
+with the memory-mapped template store: cold-start load time, Python heap
+held by the loaded index, and heap allocated by one full scan (a probe
+that matches nobody, with the bit-similarity scorer).
+
+    python -m benchmarks.template_store_benchmark --sizes 1000 10000 50000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import seed_users
+from src.services.template_index import BitSimilarityScorer, TemplateIndex
+from src.services.template_store import TemplateStore
+
+
+def _measure(fn):
+    """
+    (result, seconds, heap held afterwards, heap peak). Timed in a plain
+    run, since tracemalloc slows allocation-heavy code unevenly, then
+    run again under tracemalloc.
+    """
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    result = fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, current, peak
+
+
+def _load_sqlite(path):
+    conn = sqlite3.connect(path)
+    rows = conn.execute(
+        "SELECT id, fingerprint_template FROM users WHERE fingerprint_template IS NOT NULL"
+    ).fetchall()
+    conn.close()
+    index = TemplateIndex(BitSimilarityScorer(), threshold=0.9)
+    index.load((user_id, bytes(template)) for user_id, template in rows)
+    return index
+
+
+def _load_store(path):
+    index = TemplateIndex(BitSimilarityScorer(), threshold=0.9)
+    index.load(TemplateStore(path).items())
+    return index
+
+
+def _legacy_scan(path, probe):
+    # The original match_fingerprint: every blob through sqlite3 rows per match
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT id, fingerprint_template FROM users").fetchall()
+    conn.close()
+    scorer = BitSimilarityScorer()
+    return max((scorer(probe, template or b""), user_id) for user_id, template in rows)
+
+
+def run(size, template_size, rng):
+    with tempfile.TemporaryDirectory() as workdir:
+        database = os.path.join(workdir, "attendance.db")
+        store_path = os.path.join(workdir, "fingerprints.tpl")
+        seed_users(database, size)
+        templates = [(user_id, rng.randbytes(template_size)) for user_id in range(1, size + 1)]
+
+        conn = sqlite3.connect(database)
+        conn.executemany(
+            "UPDATE users SET fingerprint_template=? WHERE id=?",
+            [(template, user_id) for user_id, template in templates],
+        )
+        conn.commit()
+        conn.close()
+        TemplateStore(store_path).put_many(templates)
+
+        # Random bits score about 0.5 against everyone, and popcounts of
+        # random templates are too close for the feature bound to prune
+        probe = rng.randbytes(template_size)
+        results = {}
+        for label, load in (("sqlite", lambda: _load_sqlite(database)), ("store", lambda: _load_store(store_path))):
+            index, load_seconds, held, _ = _measure(load)
+            _, scan_seconds, _, scan_peak = _measure(lambda: index.match(probe))
+            results[label] = (load_seconds, held, scan_seconds, scan_peak)
+            del index
+
+        _, legacy_seconds, _, legacy_peak = _measure(lambda: _legacy_scan(database, probe))
+
+    print(f"{size} templates of {template_size} bytes")
+    for label, (load_seconds, held, scan_seconds, scan_peak) in results.items():
+        print(
+            f"  {label:7} load {load_seconds * 1000:8.1f} ms  index heap {held / 1e6:7.2f} MB"
+            f"  scan {scan_seconds * 1000:7.1f} ms  scan heap peak {scan_peak / 1e3:8.1f} KB"
+        )
+    print(f"  {'db scan':7} per match {legacy_seconds * 1000:8.1f} ms  heap peak {legacy_peak / 1e6:7.2f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--template-size", type=int, default=512)
+    args = parser.parse_args()
+
+    rng = random.Random(23)
+    for size in args.sizes:
+        run(size, args.template_size, rng)
+
+
+if __name__ == "__main__":
+    main()
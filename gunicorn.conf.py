@@ -0,0 +1,74 @@
+"""
+gunicorn settings for wsgi:app. Override any of them with the
+environment variables below or on the command line.
+
+Sizing follows from SQLite's concurrency model:
+
+- One writer at a time across every process, readers never blocked (WAL).
+  A check-in holds the write lock for well under a millisecond, so more
+  processes add read and render capacity but no write throughput; writers
+  beyond the lock queue on busy_timeout (DB_BUSY_TIMEOUT_MS).
+- Python runs one thread at a time per process, so CPU-bound work
+  (rendering, JSON, image resizing) scales with processes, up to the
+  number of cores: WEB_CONCURRENCY defaults to the core count, capped at 8
+  because each process keeps its own render cache, template index and
+  SQLite page cache.
+- Each process has a pool of DB_POOL_SIZE connections, and a request holds
+  one for its whole duration. Workers are gthread: GUNICORN_THREADS
+  defaults to DB_POOL_SIZE request threads plus GUNICORN_BOARD_THREADS
+  (default 32) for live boards, and each process caps its open boards at
+  GUNICORN_BOARD_THREADS, so boards can never take the threads requests
+  need. A board holds its thread but no connection; taps reach it from
+  every process through the live_events table, so boards may land on any
+  worker and the board capacity is workers x GUNICORN_BOARD_THREADS.
+- gevent (GUNICORN_WORKER_CLASS=gevent, needs the gevent package) makes a
+  board an idle greenlet instead, but SQLite busy waits and image
+  resizing then pause every other request in that worker, and the
+  cross-branch fan-out runs one branch at a time. It is patched in before
+  the app is preloaded, so the app's locks are cooperative in the workers.
+
+The app is preloaded: imported once in the master and forked, which
+shares its memory copy-on-write and makes worker restarts cheap. The
+master refuses to start if `flask --app wsgi init-db` has not been run.
+"""
+import os
+
+if os.environ.get("GUNICORN_WORKER_CLASS", "gthread") == "gevent":
+    from gevent import monkey
+
+    monkey.patch_all()
+
+import multiprocessing
+
+from src.config import Config
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count(), 8)))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+board_threads = int(os.environ.get("GUNICORN_BOARD_THREADS", 32))
+threads = int(os.environ.get("GUNICORN_THREADS", Config.DB_POOL_SIZE + board_threads))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", Config.EVENT_MAX_SUBSCRIBERS))
+preload_app = True
+
+# Live boards and exports stream for a long time; keep the worker
+# heartbeat timeout separate from request length (gthread and gevent
+# heartbeat from the main loop, not from request threads).
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    from src.database import check_schema
+    from src.shards import databases
+
+    for database in databases(server.app.wsgi()):
+        check_schema(database)
+
+
+def post_fork(server, worker):
+    # Keep DB_POOL_SIZE threads free for requests however many boards open
+    if worker_class == "gthread":
+        from src.services.event_bus import limit_boards
+
+        limit_boards(server.app.wsgi(), board_threads)
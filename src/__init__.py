@@ -1,21 +1,48 @@
-from flask import Flask, url_for
+from flask import Flask, request
 from src.config import Config
-from src.database import init_db
-import os
+from src import database, instrumentation, migrations, shards
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(
         __name__,
         static_folder=Config.STATIC_FOLDER,
         static_url_path="/static",
     )
     app.config.from_object(Config)
+    if test_config:
+        app.config.update(test_config)
+    # Served from where image_service stores and looks for uploads
+    app.static_folder = app.config["STATIC_FOLDER"]
 
-    # Ensure upload folder exists
-    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+    instrumentation.init_app(app)
+    shards.init_app(app)
 
-    # Initialize database
-    init_db()
+    if app.config["INIT_DB_ON_START"]:
+        database.init_databases(app)
+    database.init_app(app)
+
+    if app.config["CHECK_QUERY_PLANS"]:
+        conn = database.get_db_connection(app.config["DATABASE_PATH"])
+        migrations.log_query_plans(conn, app.logger)
+        conn.close()
+
+    from src.services import biometric_service, bulk_import, event_bus, image_queue, image_service, render_cache, replica
+    biometric_service.init_app(app)
+    bulk_import.init_app(app)
+    event_bus.init_app(app)
+    image_queue.init_app(app)
+    image_service.init_app(app)
+    render_cache.init_app(app)
+    replica.init_app(app)
+
+    if app.config["START_BACKGROUND_WORKERS"]:
+        image_queue.start_workers(app)
+    else:
+        # Preloaded apps fork after create_app, so each server process
+        # starts its own threads when it takes its first request
+        @app.before_request
+        def start_background_workers():
+            image_queue.start_workers(app)
 
     # Blueprints will be registered here later
     from src.routes.user_routes import user_bp
@@ -28,23 +55,23 @@ def create_app():
 
     @app.context_processor
     def utility_processor():
-        def image_url(path):
-            if not path:
-                return ""
-
-            normalized = str(path).replace("\\", "/")
-
-            if normalized.startswith("http://") or normalized.startswith("https://"):
-                return normalized
-
-            for marker in ("/static/", "static/"):
-                if marker in normalized:
-                    normalized = normalized.split(marker, 1)[1]
-                    break
-
-            return url_for("static", filename=normalized)
+        return dict(image_url=image_service.image_url)
 
-        return dict(image_url=image_url)
+    @app.after_request
+    def cache_uploads(response):
+        # Upload names change whenever their content does. Errors are left
+        # uncached; a 304 refreshes the stored 200 and carries the same headers
+        filename = (request.view_args or {}).get("filename", "")
+        if (
+            response.status_code in (200, 304)
+            and request.endpoint == "static"
+            and filename.startswith("uploads/")
+        ):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = app.config["UPLOAD_CACHE_MAX_AGE"]
+            response.cache_control.immutable = True
+        return response
 
 
 
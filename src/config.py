@@ -8,11 +8,100 @@ class Config:
     # Database
     DATABASE_PATH = os.path.join(BASE_DIR, "attendance.db")
 
+    # Branches, each with its own database under SHARD_FOLDER/<branch> and
+    # uploads under UPLOAD_FOLDER/<branch>; see src/shards.py. Requests
+    # that name no branch use DATABASE_PATH.
+    BRANCHES = ()  # e.g. ("central", "northside")
+    SHARD_FOLDER = os.path.join(BASE_DIR, "shards")
+    SHARD_FANOUT_WORKERS = 8  # threads for the cross-branch summary
+
+    # Startup. wsgi.py turns both off: migrations run once per deploy with
+    # `flask --app wsgi init-db`, and each forked server process starts its
+    # image workers on its first request.
+    INIT_DB_ON_START = True
+    START_BACKGROUND_WORKERS = True
+    # Log EXPLAIN QUERY PLAN for the hot queries at startup, with a warning
+    # for any table scan. app.py turns it on; `flask check-query-plans`
+    # runs the same check on demand.
+    CHECK_QUERY_PLANS = False
+
     # Uploads
     STATIC_FOLDER = os.path.join(BASE_DIR, "static")
     UPLOAD_FOLDER = os.path.join(STATIC_FOLDER, "uploads")
     MAX_CONTENT_LENGTH = 5 * 1024 * 1024  # 5 MB max upload
 
+    # Background image processing
+    SPOOL_FOLDER = os.path.join(BASE_DIR, "spool")
+    SPOOL_MAX_AGE = 3600  # seconds before an unreferenced spool file is removed
+    IMAGE_WORKERS = 2
+    IMAGE_QUEUE_SIZE = 32
+    IMAGE_JOB_RETRIES = 3
+    IMAGE_JOB_STALE_SECONDS = 120  # a claimed job whose owner has not checked in for this long is requeued
+
     # Image settings
     IMAGE_SIZE = (600, 600)
     IMAGE_QUALITY = 75
+    IMAGE_PROFILE = "balanced"  # fast | balanced | smallest
+    IMAGE_RENDITIONS = (64, 160)  # avatar widths written next to the full image
+    UPLOAD_CACHE_MAX_AGE = 365 * 24 * 3600  # uploads are never rewritten in place
+    IMAGE_GC_GRACE = 3600  # seconds an unused upload is kept after it was last produced or reused
+
+    # Listings
+    PAGE_SIZE = 50
+    PAGE_SIZE_MAX = 200  # cap on ?limit= for /api/users
+
+    # Live attendance board (server-sent events)
+    EVENT_BUFFER_SIZE = 1024  # events a reconnecting board can catch up on
+    EVENT_MAX_SUBSCRIBERS = 500
+    EVENT_KEEPALIVE = 15  # seconds between comment pings on an idle stream
+    EVENT_POLL_INTERVAL = 0.25  # seconds between polls for other processes' events
+
+    # Rendered board and listing fragments, keyed on the data version
+    RENDER_CACHE_MAX_BYTES = 32 * 1024 * 1024  # 0 disables the cache
+
+    # Reporting replica: `flask replicate` replays each database's change log
+    # into <database>-reporting.db, and admin reports read it while it is at
+    # most REPLICA_MAX_STALENESS seconds behind (?max_staleness= per request)
+    REPORTING_REPLICA = False
+    REPLICA_MAX_STALENESS = 30
+    REPLICA_POLL_INTERVAL = 1.0  # seconds between polls of an idle log
+    REPLICA_BATCH_ROWS = 2000  # changes per replica transaction
+
+    # Attendance archive: closed years move to one SQLite file per year
+    ARCHIVE_FOLDER = os.path.join(BASE_DIR, "archive")
+    ARCHIVE_GRACE_DAYS = 31  # a year is archivable this long after it ends (late kiosk syncs)
+    ARCHIVE_CHUNK_ROWS = 5000  # rows per write transaction while archiving
+
+    # Bulk enrollment from a CSV plus a ZIP of photos
+    IMPORT_FOLDER = os.path.join(BASE_DIR, "imports")
+    IMPORT_WORKERS = 0  # photo-processing processes; 0 = one per CPU
+    IMPORT_CHUNK_ROWS = 200  # candidates per write transaction
+    IMPORT_MAX_BYTES = 512 * 1024 * 1024  # upload cap for the import form only
+
+    # Kiosk batch sync
+    SYNC_MAX_BATCH = 10000
+    SYNC_KEY_RETENTION_DAYS = 30  # prune-sync-keys forgets idempotency keys older than this
+
+    # Instrumentation: Server-Timing headers, /metrics and the slow-query log
+    INSTRUMENTATION = False
+    SLOW_QUERY_MS = 100  # None disables the slow-query log
+    SLOW_QUERY_LOG = None  # file path; None logs through the "src.slow_query" logger only
+
+    # Connection pool
+    DB_POOL_SIZE = 8
+    DB_POOL_TIMEOUT = 10  # seconds to wait for a free connection
+    DB_BUSY_TIMEOUT_MS = 5000
+    DB_CACHE_SIZE_KB = 8192
+    DB_MMAP_SIZE = 64 * 1024 * 1024
+    DB_STATEMENT_CACHE_SIZE = 128
+
+    # Fingerprint matching. FINGERPRINT_SCORER=None means exact matching;
+    # otherwise an SDK scorer object (see services/template_index.py).
+    FINGERPRINT_SCORER = None
+    FINGERPRINT_MATCH_THRESHOLD = 0.9
+    FINGERPRINT_BATCH_SIZE = 256
+    FINGERPRINT_WORKERS = 0  # > 0 scores across a process pool (needs a scorer)
+    FINGERPRINT_DEADLINE_MS = 2000
+    # Templates live in an append-only file of fixed-size records
+    FINGERPRINT_STORE_PATH = os.path.join(BASE_DIR, "fingerprints.tpl")
+    FINGERPRINT_RECORD_BYTES = 1024  # record head included; larger templates are rejected
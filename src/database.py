@@ -1,41 +1,494 @@
+import os
 import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+import click
+from flask import current_app, g
+from flask.cli import with_appcontext
 from src.config import Config
+from src import instrumentation, migrations, shards
+from src.models import archive_model, attendance_model, rollup_model, user_model, version_model
+
+
+_WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
 
-def get_db_connection():
-    conn = sqlite3.connect(Config.DATABASE_PATH)
+def _apply_pragmas(conn, busy_timeout_ms, cache_size_kb, mmap_size):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+    conn.execute(f"PRAGMA cache_size=-{int(cache_size_kb)}")
+    conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+def _connect(database, factory=sqlite3.Connection):
+    conn = sqlite3.connect(
+        database,
+        timeout=Config.DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=Config.DB_STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+        factory=factory,
+    )
     conn.row_factory = sqlite3.Row
+    _apply_pragmas(
+        conn,
+        Config.DB_BUSY_TIMEOUT_MS,
+        Config.DB_CACHE_SIZE_KB,
+        Config.DB_MMAP_SIZE,
+    )
     return conn
 
 
-def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def get_db_connection(database=None):
+    """
+    Open a standalone connection outside of a request, to the active
+    branch's database unless one is given.
+    Callers own the connection and must close it.
+    """
+    factory = TracingConnection if instrumentation.enabled() else sqlite3.Connection
+    return _connect(database or shards.database_path(), factory=factory)
 
-    # Users table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        phone TEXT NOT NULL,
-        image_path TEXT NOT NULL,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
 
+class PooledConnection(sqlite3.Connection):
+    """
+    Connection handed out by ConnectionPool.
+    Times the first write of each transaction, which is where SQLite
+    waits for the database write lock.
+    """
+
+    pool = None
+    owner = None
+
+    def execute(self, sql, parameters=()):
+        if self.in_transaction or not sql.lstrip().upper().startswith(_WRITE_PREFIXES):
+            return super().execute(sql, parameters)
+
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.OperationalError as exc:
+            if "locked" in str(exc) and self.pool is not None:
+                self.pool._record_busy()
+            raise
+        finally:
+            if self.pool is not None:
+                self.pool._record_lock_wait(time.perf_counter() - started)
+
+
+class TracingConnection(PooledConnection):
+    """
+    Connection used while instrumentation is on. Statements are timed from
+    execute through the last fetch and reported to src.instrumentation.
+    Works standalone as well as pooled.
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        cursor = super().execute(sql, parameters)
+        return instrumentation.trace_statement(self, sql, parameters, cursor, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        cursor = super().executemany(sql, seq_of_parameters)
+        return instrumentation.trace_statement(self, sql, (), cursor, time.perf_counter() - started)
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections.
+    A thread gets back the connection it used last whenever it is idle,
+    so its statement cache and page cache stay warm.
+    """
+
+    def __init__(self, database, max_size=8, wait_timeout=10.0):
+        self.database = database
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._stats = {
+            "created": 0,
+            "acquired": 0,
+            "reused_same_thread": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "timeouts": 0,
+            "write_transactions": 0,
+            "lock_wait_seconds": 0.0,
+            "lock_wait_max_seconds": 0.0,
+            "busy_errors": 0,
+        }
+
+    def acquire(self):
+        ident = threading.get_ident()
+        with self._cond:
+            waited_since = None
+            while True:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+
+                if self._idle:
+                    conn = self._take_idle(ident)
+                    break
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
 
+                if waited_since is None:
+                    waited_since = time.perf_counter()
+                    self._stats["waits"] += 1
 
-    # Attendance table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS attendance (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        date DATE NOT NULL,
-        in_time TIME,
-        out_time TIME,
-        UNIQUE(user_id, date),
-        FOREIGN KEY(user_id) REFERENCES users(id)
+                remaining = self.wait_timeout - (time.perf_counter() - waited_since)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise TimeoutError("Timed out waiting for a database connection")
+                self._cond.wait(remaining)
+
+            if waited_since is not None:
+                self._stats["wait_seconds"] += time.perf_counter() - waited_since
+            self._stats["acquired"] += 1
+
+        if conn is None:
+            try:
+                factory = TracingConnection if instrumentation.enabled() else PooledConnection
+                conn = _connect(self.database, factory=factory)
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            conn.pool = self
+            with self._cond:
+                self._stats["created"] += 1
+
+        conn.owner = ident
+        return conn
+
+    def _take_idle(self, ident):
+        for index in range(len(self._idle) - 1, -1, -1):
+            if self._idle[index].owner == ident:
+                self._stats["reused_same_thread"] += 1
+                return self._idle.pop(index)
+        return self._idle.pop()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                conn.close()
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._idle.pop().close()
+                self._size -= 1
+            self._cond.notify_all()
+
+    def _record_lock_wait(self, seconds):
+        with self._cond:
+            self._stats["write_transactions"] += 1
+            self._stats["lock_wait_seconds"] += seconds
+            if seconds > self._stats["lock_wait_max_seconds"]:
+                self._stats["lock_wait_max_seconds"] = seconds
+
+    def _record_busy(self):
+        with self._cond:
+            self._stats["busy_errors"] += 1
+
+    def stats(self):
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                max_size=self.max_size,
+            )
+        return snapshot
+
+
+def current_pool():
+    """
+    The connection pool for the active branch's database.
+    """
+    shard = shards.current()
+    if shard is None:
+        return current_app.extensions["db_pool"]
+    return current_app.extensions["shard_pools"][shard.name]
+
+
+def get_db():
+    """
+    Return the pooled connection bound to the current app context.
+    It goes back to the pool when the context tears down.
+    """
+    if "db" not in g:
+        g.db = current_pool().acquire()
+    return g.db
+
+
+def close_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        conn.pool.release(conn)
+
+
+def _pool(app, database):
+    return ConnectionPool(
+        database,
+        max_size=app.config["DB_POOL_SIZE"],
+        wait_timeout=app.config["DB_POOL_TIMEOUT"],
     )
-    """)
 
+
+def init_app(app):
+    app.extensions["db_pool"] = _pool(app, app.config["DATABASE_PATH"])
+    app.extensions["shard_pools"] = {
+        shard.name: _pool(app, shard.database) for shard in shards.all_shards(app)
+    }
+    app.teardown_appcontext(close_db)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(rebuild_stats_command)
+    app.cli.add_command(check_stats_command)
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(check_rollups_command)
+    app.cli.add_command(check_query_plans_command)
+    app.cli.add_command(prune_sync_keys_command)
+    app.cli.add_command(backfill_attendance_command)
+    app.cli.add_command(archive_attendance_command)
+
+
+def _all_attendance(conn):
+    # Live table plus every archived year, for the length of a with block
+    return archive_model.attendance_source(conn, shards.archive_folder())
+
+
+@click.command("rebuild-stats")
+@with_appcontext
+@shards.branch_option
+def rebuild_stats_command():
+    """Recompute user_stats from the attendance table."""
+    conn = get_db_connection()
+    with _all_attendance(conn) as source:
+        user_model.rebuild_user_stats(conn, source)
+        version_model.bump_data_version(conn)
+        conn.commit()
+    conn.close()
+    click.echo("user_stats rebuilt.")
+
+
+@click.command("check-stats")
+@with_appcontext
+@shards.branch_option
+def check_stats_command():
+    """Compare user_stats against a full recount of attendance."""
+    conn = get_db_connection()
+    with _all_attendance(conn) as source:
+        mismatches = user_model.check_user_stats(conn, source)
+    conn.close()
+
+    for user_id, stored, actual in mismatches:
+        click.echo(f"user {user_id}: stored {stored} != actual {actual}")
+    if mismatches:
+        raise SystemExit(1)
+    click.echo("user_stats is consistent.")
+
+
+@click.command("rebuild-rollups")
+@with_appcontext
+@shards.branch_option
+def rebuild_rollups_command():
+    """Recompute the daily and monthly rollups from the attendance table."""
+    conn = get_db_connection()
+    with _all_attendance(conn) as source:
+        rollup_model.rebuild_rollups(conn, source)
+        conn.commit()
+    conn.close()
+    click.echo("Rollups rebuilt.")
+
+
+@click.command("check-rollups")
+@with_appcontext
+@shards.branch_option
+def check_rollups_command():
+    """Compare the rollup tables against a full recount of attendance."""
+    conn = get_db_connection()
+    with _all_attendance(conn) as source:
+        mismatches = rollup_model.check_rollups(conn, source)
+    conn.close()
+
+    for table, key, stored, actual in mismatches:
+        click.echo(f"{table} {key}: stored {stored} != actual {actual}")
+    if mismatches:
+        raise SystemExit(1)
+    click.echo("Rollups are consistent.")
+
+
+@click.command("check-query-plans")
+@with_appcontext
+@shards.branch_option
+def check_query_plans_command():
+    """Print EXPLAIN QUERY PLAN for the hot route queries."""
+    conn = get_db_connection()
+    report = migrations.explain_hot_queries(conn)
+    conn.close()
+
+    for name, plan, scans in report:
+        click.echo(f"{name}:")
+        for detail in plan:
+            marker = "!!" if detail in scans else "  "
+            click.echo(f"  {marker} {detail}")
+    if any(scans for _, _, scans in report):
+        raise SystemExit(1)
+
+
+@click.command("prune-sync-keys")
+@click.option("--days", type=int, default=None, help="Keep keys newer than this many days.")
+@with_appcontext
+@shards.branch_option
+def prune_sync_keys_command(days):
+    """Forget kiosk idempotency keys past the retention window."""
+    days = current_app.config["SYNC_KEY_RETENTION_DAYS"] if days is None else days
+    conn = get_db_connection()
+    removed = conn.execute(
+        "DELETE FROM sync_keys WHERE created_at < datetime('now', ?)",
+        (f"-{days} days",),
+    ).rowcount
     conn.commit()
     conn.close()
+    click.echo(f"Removed {removed} sync keys older than {days} days.")
+
+
+def _minutes(raw):
+    parsed = time.strptime(raw, "%H:%M")
+    return parsed.tm_hour * 60 + parsed.tm_min
+
+
+@click.command("backfill-attendance")
+@click.option("--user", "user_ids", type=int, multiple=True, help="Candidate id; repeat for several. Default: everyone.")
+@click.option("--start", "start_date", type=click.DateTime(["%Y-%m-%d"]), required=True)
+@click.option("--end", "end_date", type=click.DateTime(["%Y-%m-%d"]), required=True)
+@click.option("--slot", default="09:00-17:00", show_default=True, help="Earliest start and latest end, HH:MM-HH:MM.")
+@click.option("--classes", type=int, required=True, help="Classes to create per candidate.")
+@click.option("--duration-hours", type=float, default=1.0, show_default=True)
+@click.option("--dry-run", is_flag=True, help="Count what would be created without writing.")
+@with_appcontext
+@shards.branch_option
+def backfill_attendance_command(user_ids, start_date, end_date, slot, classes, duration_hours, dry_run):
+    """Generate past attendance for many candidates at once."""
+    try:
+        slot_start, slot_end = (_minutes(part.strip()) for part in slot.split("-"))
+    except ValueError:
+        raise click.BadParameter("expected HH:MM-HH:MM", param_hint="--slot")
+    duration = int(round(duration_hours * 60))
+    if start_date > end_date or classes <= 0 or duration <= 0 or slot_start + duration > slot_end:
+        raise click.UsageError("Check the date range, class count, slot and duration.")
+
+    conn = get_db_connection()
+    archived_through = archive_model.archived_through(conn)
+    if archived_through and start_date.date().isoformat() <= archived_through:
+        conn.close()
+        raise click.UsageError(f"Attendance up to {archived_through} is archived; choose a later --start.")
+    result = attendance_model.backfill(
+        conn,
+        list(user_ids) or None,
+        start_date.date(),
+        end_date.date(),
+        slot_start,
+        slot_end,
+        duration,
+        classes,
+        dry_run=dry_run,
+    )
+    conn.close()
+
+    verb = "would create" if dry_run else "created"
+    click.echo(
+        f"{result['users']} candidates: {verb} {result['rows']} of {result['requested']} requested rows"
+        f" in {result['seconds']:.2f}s ({result['rows_per_second']:.0f} rows/s)."
+    )
+
+
+@click.command("archive-attendance")
+@click.option("--before-year", type=int, default=None,
+              help="Archive years before this one. Defaults to every year closed for ARCHIVE_GRACE_DAYS.")
+@click.option("--chunk-rows", type=int, default=None, help="Rows moved per write transaction.")
+@click.option("--pause", type=float, default=0.0, help="Seconds to sleep between chunks.")
+@with_appcontext
+@shards.branch_option
+def archive_attendance_command(before_year, chunk_rows, pause):
+    """Move closed years of attendance into per-year archive databases."""
+    if before_year is None:
+        before_year = (date.today() - timedelta(days=current_app.config["ARCHIVE_GRACE_DAYS"])).year
+    chunk_rows = chunk_rows or current_app.config["ARCHIVE_CHUNK_ROWS"]
+    folder = shards.archive_folder()
+
+    conn = get_db_connection()
+    years = archive_model.archivable_years(conn, before_year)
+    if not years:
+        click.echo(f"Nothing to archive before {before_year}.")
+    for year in years:
+        started = time.perf_counter()
+        moved = archive_model.archive_year(conn, folder, year, chunk_rows=chunk_rows, pause=pause)
+        click.echo(f"{year}: moved {moved} rows in {time.perf_counter() - started:.1f}s.")
+    conn.close()
+
+
+def init_db(database=None):
+    conn = get_db_connection(database)
+    version = migrations.migrate(conn)
+    conn.close()
+    return version
+
+
+def init_databases(app):
+    """
+    Migrate the unsharded database and every branch's shard, creating
+    their upload folders. Returns {branch or None: schema version}.
+    """
+    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+    versions = {None: init_db(app.config["DATABASE_PATH"])}
+    for shard in shards.all_shards(app):
+        os.makedirs(os.path.dirname(shard.database), exist_ok=True)
+        os.makedirs(shard.upload_folder, exist_ok=True)
+        versions[shard.name] = init_db(shard.database)
+    return versions
+
+
+def check_schema(database=None):
+    """
+    Raise if the database is behind the code. Servers that leave
+    migrations to the init-db deploy step call this before forking.
+    """
+    conn = get_db_connection(database)
+    version = migrations.schema_version(conn)
+    conn.close()
+    if version < len(migrations.MIGRATIONS):
+        raise RuntimeError(
+            f"Database schema is at version {version} of {len(migrations.MIGRATIONS)}; "
+            "run `flask --app wsgi init-db` before starting the server."
+        )
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db_command():
+    """Apply pending migrations to every shard and create the upload folders. Run once per deploy."""
+    for branch, version in init_databases(current_app).items():
+        label = f"Branch {branch}" if branch else "Database"
+        click.echo(f"{label} is at schema version {version}.")
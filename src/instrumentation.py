@@ -0,0 +1,329 @@
+"""
+Opt-in request instrumentation, enabled with INSTRUMENTATION = True.
+
+Database connections are opened as TracingConnection (see database.py),
+which reports each statement's execute and fetch time here. Per request
+the totals for SQL, template rendering and image work go out as a
+Server-Timing header. Process-wide counters and histograms are served
+in Prometheus text format at /metrics. Statements slower than
+SLOW_QUERY_MS are logged with their parameters and EXPLAIN QUERY PLAN.
+
+Metrics are per process; with several workers each one reports its own.
+"""
+import bisect
+import collections
+import functools
+import logging
+import sqlite3
+import threading
+import time
+
+from flask import Response, g, has_app_context, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+
+
+slow_query_logger = logging.getLogger("src.slow_query")
+
+_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+# Set by init_app; while False the hooks below return immediately
+_enabled = False
+_slow_seconds = None
+
+
+class Metrics:
+    """
+    Counters, gauges and fixed-bucket histograms keyed by name and labels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(float)
+        self._histograms = {}
+        self._gauge_sources = []
+        self._help = {}
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[name, tuple(sorted(labels.items()))] += value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(_BUCKETS) + 1), 0.0]
+            histogram[0][bisect.bisect_left(_BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+
+    def add_gauges(self, source):
+        """
+        Register a callable returning (name, labels dict, value) tuples,
+        sampled on every scrape.
+        """
+        self._gauge_sources.append(source)
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(value[0]), value[1]) for key, value in self._histograms.items()}
+
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+
+        for (name, labels), (buckets, total) in sorted(histograms.items()):
+            header(name, "histogram")
+            running = 0
+            for bound, count in zip(_BUCKETS + (float("inf"),), buckets):
+                running += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {running}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {running}")
+
+        for source in self._gauge_sources:
+            for name, labels, value in source():
+                header(name, "gauge")
+                lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    body = ",".join(
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in labels
+    )
+    return "{" + body + "}"
+
+
+METRICS = Metrics()
+
+
+def enabled():
+    return _enabled
+
+
+def _endpoint():
+    if has_request_context():
+        return request.endpoint or "unmatched"
+    return "background"
+
+
+def _request_timings():
+    if has_app_context():
+        return g.get("perf")
+    return None
+
+
+def record_stage(stage, seconds):
+    """
+    Add time spent in a named stage (sql, template, image) to the current
+    request, if any.
+    """
+    timings = _request_timings()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def timed(metric, stage):
+    """
+    Decorator recording the call's duration into histogram `metric` and
+    the current request's `stage` total.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                METRICS.observe(metric, elapsed)
+                record_stage(stage, elapsed)
+        return wrapper
+    return decorator
+
+
+class TracedCursor:
+    """
+    Cursor proxy that charges fetch time to the statement, so lazily
+    stepped SELECTs are measured too.
+    """
+
+    def __init__(self, conn, cursor, sql, parameters, seconds):
+        self._conn = conn
+        self._cursor = cursor
+        self._sql = sql
+        self._parameters = parameters
+        self._seconds = 0.0
+        self._logged = False
+        self._charge(seconds)
+
+    def _charge(self, seconds):
+        self._seconds += seconds
+        record_stage("sql", seconds)
+        METRICS.inc("sqlite_statement_seconds_total", seconds, endpoint=_endpoint())
+        if not self._logged and _slow_seconds is not None and self._seconds >= _slow_seconds:
+            self._logged = True
+            log_slow_query(self._conn, self._sql, self._parameters, self._seconds)
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._charge(time.perf_counter() - started)
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._timed(self._cursor.__next__)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def trace_statement(conn, sql, parameters, cursor, seconds):
+    """
+    Called by TracingConnection after each execute. Returns the cursor to
+    hand back to the caller.
+    """
+    METRICS.inc("sqlite_statements_total", endpoint=_endpoint())
+    timings = _request_timings()
+    if timings is not None:
+        timings["sql_count"] = timings.get("sql_count", 0) + 1
+    return TracedCursor(conn, cursor, sql, parameters, seconds)
+
+
+def log_slow_query(conn, sql, parameters, seconds):
+    METRICS.inc("sqlite_slow_statements_total", endpoint=_endpoint())
+    statement = " ".join(sql.split())
+    plan = []
+    if statement.upper().startswith(_EXPLAINABLE):
+        try:
+            # Base class execute, so the plan query is not traced itself
+            rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", parameters)
+            plan = [row[3] for row in rows]
+        except Exception as exc:  # the plan is best effort
+            plan = [f"(no plan: {exc})"]
+    slow_query_logger.warning(
+        "slow query %.1f ms [%s]: %s params=%r plan=%s",
+        seconds * 1000, _endpoint(), statement, parameters, " | ".join(plan),
+    )
+
+
+def _before_request():
+    g.perf = {"started": time.perf_counter()}
+
+
+def _before_render(sender, template, context, **extra):
+    timings = _request_timings()
+    if timings is not None:
+        timings.setdefault("template_stack", []).append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    timings = _request_timings()
+    if timings is not None and timings.get("template_stack"):
+        elapsed = time.perf_counter() - timings["template_stack"].pop()
+        timings["template"] = timings.get("template", 0.0) + elapsed
+        METRICS.observe("template_render_seconds", elapsed, template=template.name or "string")
+
+
+def _after_request(response):
+    timings = g.get("perf")
+    if timings is None:
+        return response
+
+    total = time.perf_counter() - timings["started"]
+    endpoint = _endpoint()
+    METRICS.observe("http_request_duration_seconds", total, endpoint=endpoint, method=request.method)
+    METRICS.inc("http_requests_total", endpoint=endpoint, status=response.status_code)
+
+    parts = [f'db;dur={timings.get("sql", 0.0) * 1000:.2f};desc="{timings.get("sql_count", 0)} queries"']
+    if "template" in timings:
+        parts.append(f'tpl;dur={timings["template"] * 1000:.2f}')
+    if "image" in timings:
+        parts.append(f'img;dur={timings["image"] * 1000:.2f}')
+    parts.append(f"total;dur={total * 1000:.2f}")
+    response.headers["Server-Timing"] = ", ".join(parts)
+    return response
+
+
+def _metrics_view():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
+def _extension_gauges(app):
+    def sample():
+        pool = app.extensions["db_pool"].stats()
+        gauges = [(f"db_pool_{key}", {}, pool[key]) for key in ("size", "idle", "in_use")]
+        for branch, shard_pool in app.extensions.get("shard_pools", {}).items():
+            stats = shard_pool.stats()
+            gauges += [(f"db_pool_{key}", {"branch": branch}, stats[key]) for key in ("size", "idle", "in_use")]
+        queue = app.extensions.get("image_queue")
+        if queue is not None:
+            gauges.append(("image_queue_pending", {}, queue.stats()["pending"]))
+        bus = app.extensions.get("event_bus")
+        if bus is not None:
+            gauges.append(("live_board_subscribers", {}, bus.stats()["subscribers"]))
+        for branch, branch_bus in app.extensions.get("branch_event_buses", {}).items():
+            gauges.append(("live_board_subscribers", {"branch": branch}, branch_bus.stats()["subscribers"]))
+        return gauges
+    return sample
+
+
+def init_app(app):
+    global _enabled, _slow_seconds
+
+    if not app.config["INSTRUMENTATION"]:
+        return
+
+    _enabled = True
+    slow_ms = app.config["SLOW_QUERY_MS"]
+    _slow_seconds = slow_ms / 1000 if slow_ms is not None else None
+    if app.config["SLOW_QUERY_LOG"]:
+        handler = logging.FileHandler(app.config["SLOW_QUERY_LOG"])
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_query_logger.addHandler(handler)
+
+    METRICS.describe("http_request_duration_seconds", "Wall time per request.")
+    METRICS.describe("sqlite_statement_seconds_total", "Execute plus fetch time of SQL statements.")
+    METRICS.describe("sqlite_slow_statements_total", "Statements slower than SLOW_QUERY_MS.")
+    METRICS.add_gauges(_extension_gauges(app))
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.add_url_rule("/metrics", "metrics", _metrics_view)
@@ -0,0 +1,634 @@
+"""
+Versioned schema migrations, tracked in PRAGMA user_version.
+Each migration runs in its own transaction together with the version bump.
+"""
+from src.models import change_model, image_model, rollup_model, user_model
+
+
+# Trigger bodies keeping user_stats in step with attendance. Only rows with
+# an in_time count as classes, matching the totals shown in the UI.
+# OR IGNORE is avoided because the mark upsert's conflict policy would
+# override it inside the trigger.
+_STATS_ADD_NEW = """
+        INSERT INTO user_stats (user_id)
+        SELECT NEW.user_id
+        WHERE NOT EXISTS (SELECT 1 FROM user_stats WHERE user_id = NEW.user_id);
+        UPDATE user_stats SET
+            total_classes = total_classes + (NEW.in_time IS NOT NULL),
+            first_date = CASE
+                WHEN NEW.in_time IS NOT NULL AND (first_date IS NULL OR NEW.date < first_date)
+                THEN NEW.date ELSE first_date END,
+            last_date = CASE
+                WHEN NEW.in_time IS NOT NULL AND (last_date IS NULL OR NEW.date > last_date)
+                THEN NEW.date ELSE last_date END,
+            open_sessions = open_sessions + (NEW.in_time IS NOT NULL AND NEW.out_time IS NULL)
+        WHERE user_id = NEW.user_id;
+"""
+
+_STATS_REMOVE_OLD = """
+        UPDATE user_stats SET
+            total_classes = total_classes - (OLD.in_time IS NOT NULL),
+            first_date = CASE
+                WHEN OLD.in_time IS NOT NULL AND OLD.date = first_date
+                THEN (SELECT MIN(date) FROM attendance
+                      WHERE user_id = OLD.user_id AND in_time IS NOT NULL)
+                ELSE first_date END,
+            last_date = CASE
+                WHEN OLD.in_time IS NOT NULL AND OLD.date = last_date
+                THEN (SELECT MAX(date) FROM attendance
+                      WHERE user_id = OLD.user_id AND in_time IS NOT NULL)
+                ELSE last_date END,
+            open_sessions = open_sessions - (OLD.in_time IS NOT NULL AND OLD.out_time IS NULL)
+        WHERE user_id = OLD.user_id;
+"""
+
+
+def _create_base_tables(conn):
+    # Users table
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        image_path TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # Attendance table
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS attendance (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        in_time TIME,
+        out_time TIME,
+        UNIQUE(user_id, date),
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    """)
+
+
+def _rollup_delta(row, sign):
+    minutes = rollup_model.SESSION_MINUTES_SQL.format(row=row)
+    return f"""
+        UPDATE daily_rollup SET
+            checked_in = checked_in {sign} ({row}.in_time IS NOT NULL),
+            completed = completed {sign} ({row}.in_time IS NOT NULL AND {row}.out_time IS NOT NULL),
+            open_sessions = open_sessions {sign} ({row}.in_time IS NOT NULL AND {row}.out_time IS NULL),
+            session_minutes = session_minutes {sign} ({minutes})
+        WHERE date = {row}.date;
+        UPDATE monthly_rollup SET
+            classes = classes {sign} ({row}.in_time IS NOT NULL),
+            completed = completed {sign} ({row}.in_time IS NOT NULL AND {row}.out_time IS NOT NULL),
+            session_minutes = session_minutes {sign} ({minutes})
+        WHERE user_id = {row}.user_id AND month = substr({row}.date, 1, 7);
+"""
+
+
+# Same shape as the user_stats triggers: make sure the rollup rows exist,
+# then add NEW's contribution and subtract OLD's.
+_ROLLUP_ADD_NEW = """
+        INSERT INTO daily_rollup (date)
+        SELECT NEW.date
+        WHERE NOT EXISTS (SELECT 1 FROM daily_rollup WHERE date = NEW.date);
+        INSERT INTO monthly_rollup (user_id, month)
+        SELECT NEW.user_id, substr(NEW.date, 1, 7)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM monthly_rollup
+            WHERE user_id = NEW.user_id AND month = substr(NEW.date, 1, 7)
+        );
+""" + _rollup_delta("NEW", "+")
+
+_ROLLUP_REMOVE_OLD = _rollup_delta("OLD", "-")
+
+
+def _create_user_stats(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id INTEGER PRIMARY KEY,
+        total_classes INTEGER NOT NULL DEFAULT 0,
+        first_date DATE,
+        last_date DATE,
+        open_sessions INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_stats_insert AFTER INSERT ON users
+    BEGIN
+        INSERT INTO user_stats (user_id)
+        SELECT NEW.id
+        WHERE NOT EXISTS (SELECT 1 FROM user_stats WHERE user_id = NEW.id);
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_stats_delete AFTER DELETE ON users
+    BEGIN
+        DELETE FROM user_stats WHERE user_id = OLD.id;
+    END
+    """)
+
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS attendance_stats_insert AFTER INSERT ON attendance
+    BEGIN
+        {_STATS_ADD_NEW}
+    END
+    """)
+
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS attendance_stats_delete AFTER DELETE ON attendance
+    BEGIN
+        {_STATS_REMOVE_OLD}
+    END
+    """)
+
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS attendance_stats_update
+    AFTER UPDATE OF user_id, date, in_time, out_time ON attendance
+    BEGIN
+        {_STATS_REMOVE_OLD}
+        {_STATS_ADD_NEW}
+    END
+    """)
+
+    user_model.rebuild_user_stats(conn)
+
+
+def _add_hot_path_indexes(conn):
+    # Today's board: filter by date, read the rest from the index
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_attendance_date_cover
+    ON attendance (date, user_id, in_time, out_time)
+    """)
+
+    # Per-user recounts (stats triggers, rebuild-stats)
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_attendance_user_in_time
+    ON attendance (user_id, in_time)
+    """)
+
+    # Candidate lists ordered by name
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_users_name_nocase
+    ON users (name COLLATE NOCASE)
+    """)
+
+
+def _add_biometric_columns(conn):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    if "fingerprint_template" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN fingerprint_template BLOB")
+    if "fingerprint_updated_at" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN fingerprint_updated_at DATETIME")
+
+
+def _add_pending_image_column(conn):
+    # Spool file name of an upload still being processed in the background
+    conn.execute("ALTER TABLE users ADD COLUMN pending_image TEXT")
+
+
+def _add_image_path_index(conn):
+    # Reference checks before deleting a shared, content-addressed image
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_image_path ON users (image_path)")
+
+
+def _add_phone_index(conn):
+    # Phone-prefix search on the paginated user listings
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_phone ON users (phone)")
+
+
+def _create_sync_keys(conn):
+    # Idempotency keys of kiosk sync events, with the result first returned
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sync_keys (
+        idempotency_key TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        status TEXT NOT NULL,
+        in_time TIME,
+        out_time TIME,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sync_keys_created ON sync_keys (created_at)")
+
+
+def _create_rollups(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS daily_rollup (
+        date DATE PRIMARY KEY,
+        checked_in INTEGER NOT NULL DEFAULT 0,
+        completed INTEGER NOT NULL DEFAULT 0,
+        open_sessions INTEGER NOT NULL DEFAULT 0,
+        session_minutes INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS monthly_rollup (
+        user_id INTEGER NOT NULL,
+        month TEXT NOT NULL,
+        classes INTEGER NOT NULL DEFAULT 0,
+        completed INTEGER NOT NULL DEFAULT 0,
+        session_minutes INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, month)
+    ) WITHOUT ROWID
+    """)
+    # School-wide monthly charts read this instead of every user's rows
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_monthly_rollup_month
+    ON monthly_rollup (month, classes, completed, session_minutes)
+    """)
+
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS attendance_rollup_insert AFTER INSERT ON attendance
+    BEGIN
+        {_ROLLUP_ADD_NEW}
+    END
+    """)
+
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS attendance_rollup_delete AFTER DELETE ON attendance
+    BEGIN
+        {_ROLLUP_REMOVE_OLD}
+    END
+    """)
+
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS attendance_rollup_update
+    AFTER UPDATE OF user_id, date, in_time, out_time ON attendance
+    BEGIN
+        {_ROLLUP_REMOVE_OLD}
+        {_ROLLUP_ADD_NEW}
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_rollup_delete AFTER DELETE ON users
+    BEGIN
+        DELETE FROM monthly_rollup WHERE user_id = OLD.id;
+    END
+    """)
+
+    rollup_model.rebuild_rollups(conn)
+
+
+def _create_data_version(conn):
+    # One-row counter for render caches; see models/version_model.py
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    conn.execute("INSERT INTO data_version (id) SELECT 1 WHERE NOT EXISTS (SELECT 1 FROM data_version)")
+
+
+def _create_attendance_archives(conn):
+    # Registry of per-year archive files; see models/archive_model.py
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS attendance_archives (
+        year INTEGER PRIMARY KEY,
+        rows INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL,
+        archived_at DATETIME
+    )
+    """)
+
+    # Holds a row only inside an archive job's delete transaction, so the
+    # moved rows keep counting in user_stats and the rollups. Other
+    # connections never see it: the row is gone again before the commit.
+    conn.execute("CREATE TABLE IF NOT EXISTS archive_guard (active INTEGER PRIMARY KEY)")
+    conn.execute("DROP TRIGGER IF EXISTS attendance_stats_delete")
+    conn.execute(f"""
+    CREATE TRIGGER attendance_stats_delete AFTER DELETE ON attendance
+    WHEN NOT EXISTS (SELECT 1 FROM archive_guard)
+    BEGIN
+        {_STATS_REMOVE_OLD}
+    END
+    """)
+    conn.execute("DROP TRIGGER IF EXISTS attendance_rollup_delete")
+    conn.execute(f"""
+    CREATE TRIGGER attendance_rollup_delete AFTER DELETE ON attendance
+    WHEN NOT EXISTS (SELECT 1 FROM archive_guard)
+    BEGIN
+        {_ROLLUP_REMOVE_OLD}
+    END
+    """)
+
+
+def _create_import_jobs(conn):
+    # Bulk enrollment progress; see services/bulk_import.py. next_row is
+    # the CSV line an interrupted job resumes from.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS import_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT NOT NULL,
+        total_rows INTEGER NOT NULL DEFAULT 0,
+        next_row INTEGER NOT NULL DEFAULT 0,
+        imported INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS import_errors (
+        job_id INTEGER NOT NULL REFERENCES import_jobs (id),
+        line INTEGER NOT NULL,
+        message TEXT NOT NULL,
+        PRIMARY KEY (job_id, line)
+    ) WITHOUT ROWID
+    """)
+
+
+# Users pointing at a stored image; see models/image_model.py
+_IMAGE_REF_NEW = """
+        INSERT INTO images (image_path)
+        SELECT NEW.image_path
+        WHERE NEW.image_path != ''
+          AND NOT EXISTS (SELECT 1 FROM images WHERE image_path = NEW.image_path);
+        UPDATE images SET refs = refs + 1 WHERE image_path = NEW.image_path;
+"""
+
+_IMAGE_REF_OLD = """
+        UPDATE images SET refs = refs - 1 WHERE image_path = OLD.image_path;
+"""
+
+
+def _create_image_store(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS images (
+        image_path TEXT PRIMARY KEY,
+        refs INTEGER NOT NULL DEFAULT 0,
+        last_used DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+    """)
+    # Garbage collection pages through images nobody uses
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_images_unreferenced ON images (image_path) WHERE refs = 0")
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS image_sources (
+        source_key TEXT PRIMARY KEY,
+        image_path TEXT NOT NULL
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_sources_image ON image_sources (image_path)")
+
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS users_image_insert AFTER INSERT ON users
+    BEGIN
+        {_IMAGE_REF_NEW}
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS users_image_delete AFTER DELETE ON users
+    BEGIN
+        {_IMAGE_REF_OLD}
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS users_image_update AFTER UPDATE OF image_path ON users
+    WHEN OLD.image_path IS NOT NEW.image_path
+    BEGIN
+        {_IMAGE_REF_OLD}
+        {_IMAGE_REF_NEW}
+    END
+    """)
+
+    # Existing uploads count as long unused, so releasing one deletes it
+    # straight away instead of waiting out the grace period
+    image_model.rebuild_image_refs(conn)
+    conn.execute("UPDATE images SET last_used = '1970-01-01 00:00:00'")
+
+
+def _capture_row(table, columns, row, op):
+    values = ", ".join(f"'{column}', {row}.{column}" for column in columns)
+    return f"SELECT '{table}', '{op}', json_object({values})"
+
+
+def _create_change_log(conn):
+    # Row changes for the reporting replica; see models/change_model.py.
+    # changed_at is Unix time, as the replica's freshness checks use it.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        op TEXT NOT NULL CHECK (op IN ('upsert', 'delete')),
+        row_data TEXT NOT NULL,
+        changed_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+    )
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS change_log_append_only BEFORE UPDATE ON change_log
+    BEGIN
+        SELECT RAISE(ABORT, 'change_log is append-only');
+    END
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS change_consumers (
+        name TEXT PRIMARY KEY,
+        applied_seq INTEGER NOT NULL DEFAULT 0,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+    """)
+
+    log = "INSERT INTO change_log (table_name, op, row_data)"
+    logging = "WHEN EXISTS (SELECT 1 FROM change_consumers)"
+    for table, (key, columns) in change_model.CAPTURED.items():
+        on_insert, on_update, on_delete = change_model.capture_triggers(table)
+        rekeyed = " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in key)
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {on_insert} AFTER INSERT ON {table} {logging}
+        BEGIN
+            {log} {_capture_row(table, columns, "NEW", "upsert")};
+        END
+        """)
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {on_update} AFTER UPDATE ON {table} {logging}
+        BEGIN
+            {log} {_capture_row(table, key, "OLD", "delete")} WHERE {rekeyed};
+            {log} {_capture_row(table, columns, "NEW", "upsert")};
+        END
+        """)
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {on_delete} AFTER DELETE ON {table} {logging}
+        BEGIN
+            {log} {_capture_row(table, key, "OLD", "delete")};
+        END
+        """)
+
+
+def _create_live_events(conn):
+    # Live-board events shared across server processes; see
+    # models/live_event_model.py
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS live_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event TEXT NOT NULL,
+        data TEXT NOT NULL
+    )
+    """)
+
+
+def _create_image_job_claims(conn):
+    # Which server process is working on each pending photo; see
+    # services/image_queue.py. claimed_at is the owner's last heartbeat.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS image_job_claims (
+        spool_name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        claimed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_job_claims_owner ON image_job_claims (owner)")
+
+
+MIGRATIONS = [
+    _create_base_tables,
+    _create_user_stats,
+    _add_hot_path_indexes,
+    _add_biometric_columns,
+    _add_pending_image_column,
+    _add_image_path_index,
+    _add_phone_index,
+    _create_sync_keys,
+    _create_rollups,
+    _create_data_version,
+    _create_attendance_archives,
+    _create_import_jobs,
+    _create_image_store,
+    _create_change_log,
+    _create_live_events,
+    _create_image_job_claims,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Apply every migration newer than the database's user_version.
+    Returns the resulting version.
+    """
+    version = schema_version(conn)
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version={target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = target
+    return version
+
+
+# Representative copies of the route queries, with sample parameters.
+HOT_QUERIES = {
+    "attendance_page": (
+        """
+        SELECT u.id, u.name, u.phone, u.image_path,
+               todays.in_time, todays.out_time,
+               COALESCE(stats.total_classes, 0)
+        FROM users u
+        LEFT JOIN (
+            SELECT user_id, in_time, out_time FROM attendance WHERE date = ?
+        ) AS todays ON todays.user_id = u.id
+        LEFT JOIN user_stats stats ON stats.user_id = u.id
+        ORDER BY u.name COLLATE NOCASE
+        """,
+        ("2024-01-01",),
+    ),
+    "total_classes": (
+        "SELECT total_classes FROM user_stats WHERE user_id=?",
+        (1,),
+    ),
+    "admin_dashboard": (
+        """
+        SELECT u.id, u.name, u.phone, u.image_path, u.created_at,
+               COALESCE(stats.total_classes, 0)
+        FROM users u
+        LEFT JOIN user_stats stats ON stats.user_id = u.id
+        WHERE u.name >= ? COLLATE NOCASE AND (u.name COLLATE NOCASE, u.id) > (?, ?)
+        ORDER BY u.name COLLATE NOCASE, u.id
+        LIMIT 51
+        """,
+        ("m", "m", 1),
+    ),
+    "users_phone_search": (
+        """
+        SELECT u.id, u.name, u.phone, u.image_path, u.created_at
+        FROM users u
+        WHERE u.phone >= ? AND u.phone < ?
+        ORDER BY u.name COLLATE NOCASE, u.id
+        LIMIT 51
+        """,
+        ("98", "98\U0010ffff"),
+    ),
+    "admin_user_detail": (
+        "SELECT * FROM attendance WHERE user_id=? ORDER BY date DESC",
+        (1,),
+    ),
+    "analytics_daily": (
+        "SELECT * FROM daily_rollup WHERE date BETWEEN ? AND ? ORDER BY date",
+        ("2024-01-01", "2024-01-31"),
+    ),
+    "analytics_monthly": (
+        """
+        SELECT month, SUM(classes), SUM(completed), SUM(session_minutes), COUNT(*)
+        FROM monthly_rollup
+        WHERE month BETWEEN ? AND ? AND classes > 0
+        GROUP BY month
+        """,
+        ("2024-01", "2024-12"),
+    ),
+    "generate_attendance": (
+        # Free-day probe run per (user, calendar day) inside the backfill
+        "SELECT 1 FROM attendance a WHERE a.user_id = ? AND a.date = ?",
+        (1, "2024-01-01"),
+    ),
+}
+
+# Full passes that are inherent to a page, by query name. The listings are
+# keyset-paginated, so none are expected at the moment.
+_EXPECTED_SCANS = {}
+
+
+def _is_table_scan(detail):
+    return (
+        detail.startswith("SCAN ")
+        and "USING INDEX" not in detail
+        and "USING COVERING INDEX" not in detail
+        and "USING INTEGER PRIMARY KEY" not in detail
+    )
+
+
+def explain_hot_queries(conn):
+    """
+    Run EXPLAIN QUERY PLAN for each hot query.
+    Returns (name, plan lines, unexpected table scans).
+    """
+    report = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        allowed = _EXPECTED_SCANS.get(name, ())
+        scans = [
+            detail for detail in plan
+            if _is_table_scan(detail) and detail.split()[1] not in allowed
+        ]
+        report.append((name, plan, scans))
+    return report
+
+
+def log_query_plans(conn, logger):
+    for name, plan, scans in explain_hot_queries(conn):
+        logger.info("Query plan for %s: %s", name, " | ".join(plan))
+        for detail in scans:
+            logger.warning("Query %s falls back to a table scan: %s", name, detail)
@@ -0,0 +1,329 @@
+"""
+Closed years of attendance moved out to one SQLite file per year, kept
+under ARCHIVE_FOLDER and registered in attendance_archives.
+
+user_stats and the rollups keep counting archived rows, so the board,
+dashboard and analytics never read the archives. Queries over raw rows
+that may reach into an archived year run inside attendance_source(),
+which attaches the archives the date range needs, unions them with the
+live table and detaches them again; ranges within unarchived years read
+the live table alone.
+
+Each connection can attach at most 10 databases (SQLITE_MAX_ATTACHED).
+Up to MAX_ATTACHED years are attached side by side; a range over more is
+copied into a temporary table a batch of years at a time. Every archive
+is detached as soon as it is done with, since connections are pooled.
+"""
+import contextlib
+import os
+import time
+
+_COLUMNS = "id, user_id, date, in_time, out_time"
+
+# Archives attached at once, leaving one of SQLite's ten slots spare
+MAX_ATTACHED = 9
+
+
+def _schema(year):
+    return f"archive_{int(year)}"
+
+
+def _path(folder, year):
+    return os.path.join(folder, f"attendance_{int(year)}.db")
+
+
+def archived_years(conn, start=None, end=None):
+    """
+    Registered archive years overlapping [start, end] (ISO dates, None
+    meaning unbounded), oldest first.
+    """
+    return [
+        row[0] for row in conn.execute(
+            """
+            SELECT year FROM attendance_archives
+            WHERE (:start IS NULL OR year >= CAST(substr(:start, 1, 4) AS INTEGER))
+              AND (:end IS NULL OR year <= CAST(substr(:end, 1, 4) AS INTEGER))
+            ORDER BY year
+            """,
+            {"start": start, "end": end},
+        )
+    ]
+
+
+def archived_through(conn):
+    """
+    Last date covered by an archive, or None. New rows should not be
+    generated on or before it.
+    """
+    row = conn.execute("SELECT MAX(year) FROM attendance_archives").fetchone()
+    return f"{row[0]}-12-31" if row[0] is not None else None
+
+
+@contextlib.contextmanager
+def _attached(conn, folder, years):
+    """
+    Attach the given years' archives for the block, and detach them after
+    it. Must be entered and left outside a transaction.
+    """
+    schemas = []
+    try:
+        for year in years:
+            schema = _schema(year)
+            conn.execute("ATTACH DATABASE ? AS " + schema, (_path(folder, year),))
+            schemas.append(schema)
+        yield schemas
+    finally:
+        for schema in schemas:
+            conn.execute("DETACH DATABASE " + schema)
+
+
+def _archived_rows(schema, user_filter=""):
+    # A row still in the live table (copied but not yet removed by a running
+    # archive job) hides its archived copy
+    return f"""
+        SELECT {_COLUMNS} FROM {schema}.attendance x
+        WHERE NOT EXISTS (
+            SELECT 1 FROM main.attendance m WHERE m.user_id = x.user_id AND m.date = x.date
+        ) {user_filter}
+    """
+
+
+@contextlib.contextmanager
+def attendance_source(conn, folder, start=None, end=None, user_id=None):
+    """
+    Context giving FROM-clause SQL for attendance rows between start and
+    end, live and archived. The archives stay attached until the block
+    ends, so the caller finishes its cursors and commits inside it.
+
+    With more than MAX_ATTACHED years, the archived rows (only user_id's,
+    if given) are copied into a temporary table MAX_ATTACHED years at a
+    time, and the table is dropped afterwards.
+    """
+    years = archived_years(conn, start, end)
+    if not years:
+        yield "attendance"
+        return
+
+    if len(years) <= MAX_ATTACHED:
+        with _attached(conn, folder, years) as schemas:
+            parts = [f"SELECT {_COLUMNS} FROM main.attendance"]
+            parts += [_archived_rows(schema) for schema in schemas]
+            yield "(" + " UNION ALL ".join(parts) + ")"
+        return
+
+    user_filter = "AND x.user_id = :user_id" if user_id is not None else ""
+    with _temp_writable(conn):
+        conn.execute(
+            "CREATE TEMP TABLE archived_attendance AS "
+            f"SELECT {_COLUMNS} FROM main.attendance WHERE 0"
+        )
+        conn.commit()
+    try:
+        for first in range(0, len(years), MAX_ATTACHED):
+            with _attached(conn, folder, years[first:first + MAX_ATTACHED]) as schemas:
+                with _temp_writable(conn):
+                    for schema in schemas:
+                        conn.execute(
+                            f"INSERT INTO temp.archived_attendance {_archived_rows(schema, user_filter)}",
+                            {"user_id": user_id},
+                        )
+                    conn.commit()
+        yield (
+            f"(SELECT {_COLUMNS} FROM main.attendance "
+            f"UNION ALL SELECT {_COLUMNS} FROM temp.archived_attendance)"
+        )
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        with _temp_writable(conn):
+            conn.execute("DROP TABLE IF EXISTS temp.archived_attendance")
+            conn.commit()
+
+
+@contextlib.contextmanager
+def _temp_writable(conn):
+    # Replica connections are query_only, which also refuses temp tables
+    query_only = conn.execute("PRAGMA query_only").fetchone()[0]
+    if query_only:
+        conn.execute("PRAGMA query_only=OFF")
+    try:
+        yield
+    finally:
+        if query_only:
+            conn.execute("PRAGMA query_only=ON")
+
+
+def delete_user(conn, folder, user_id):
+    """
+    Remove a user's rows from every archive, one year per transaction.
+    Raises on the first year that fails; years already done stay done, so
+    the caller can report it and simply run this again. Call it before
+    deleting the user's live rows, so a failure leaves the user in place
+    to retry the delete from.
+    """
+    for year in archived_years(conn):
+        with _attached(conn, folder, [year]) as (schema,):
+            try:
+                conn.execute(f"DELETE FROM {schema}.attendance WHERE user_id = ?", (user_id,))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+
+def _create_archive(conn, schema, year):
+    # schema is the year's archive, attached by the caller
+    conn.execute(f"PRAGMA {schema}.journal_mode=WAL")
+    # Clustered by user, the way per-user history reads it
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {schema}.attendance (
+            id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            date DATE NOT NULL,
+            in_time TIME,
+            out_time TIME,
+            PRIMARY KEY (user_id, date)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_attendance_date ON attendance (date)")
+    conn.execute(
+        """
+        INSERT INTO attendance_archives (year, status)
+        SELECT ?, 'moving'
+        WHERE NOT EXISTS (SELECT 1 FROM attendance_archives WHERE year = ?)
+        """,
+        (year, year),
+    )
+    conn.commit()
+
+
+def _move_chunk(conn, schema, start, end, after_id, chunk_rows):
+    """
+    Move the next chunk of rows in [start, end] with id > after_id.
+    Returns (last id moved, rows moved), or None when the range is empty.
+    """
+    last = conn.execute(
+        """
+        SELECT MAX(id), COUNT(*) FROM (
+            SELECT id FROM attendance
+            WHERE date BETWEEN ? AND ? AND id > ?
+            ORDER BY id LIMIT ?
+        )
+        """,
+        (start, end, after_id, chunk_rows),
+    ).fetchone()
+    if last[0] is None:
+        return None
+    chunk = {"start": start, "end": end, "after": after_id, "last": last[0]}
+    in_chunk = "date BETWEEN :start AND :end AND id > :after AND id <= :last"
+
+    # Copy first and commit the archive on its own: WAL databases are not
+    # committed atomically together, so a crash between the two steps
+    # leaves a duplicate (hidden by attendance_source) rather than a loss.
+    conn.execute(
+        f"INSERT OR REPLACE INTO {schema}.attendance ({_COLUMNS}) "
+        f"SELECT {_COLUMNS} FROM main.attendance WHERE {in_chunk}",
+        chunk,
+    )
+    conn.commit()
+
+    # user_stats and the rollups keep counting archived rows, so the
+    # delete triggers are held off by archive_guard for this transaction
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("INSERT INTO archive_guard (active) VALUES (1)")
+        # Only rows whose archived copy is identical, in case one changed
+        # between the two transactions
+        moved = conn.execute(
+            f"""
+            DELETE FROM main.attendance
+            WHERE {in_chunk}
+              AND EXISTS (
+                  SELECT 1 FROM {schema}.attendance x
+                  WHERE x.user_id = attendance.user_id AND x.date = attendance.date
+                    AND x.in_time IS attendance.in_time AND x.out_time IS attendance.out_time
+              )
+            """,
+            chunk,
+        ).rowcount
+        conn.execute("DELETE FROM archive_guard")
+        conn.execute(
+            "UPDATE attendance_archives SET rows = rows + ? WHERE year = CAST(substr(?, 1, 4) AS INTEGER)",
+            (moved, start),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return last[0], moved
+
+
+def archive_year(conn, folder, year, chunk_rows=5000, pause=0.0, progress=None):
+    """
+    Move every attendance row dated in `year` into its archive file, one
+    short chunk per write transaction so check-ins keep going in between.
+    Safe to re-run: rows written into the year later are swept up too.
+    Returns the number of rows moved.
+
+    A row changed between its chunk's copy and delete stays behind, so the
+    year is passed over again until a pass moves nothing, and only marked
+    done once no rows remain in it; otherwise the next run picks it up.
+    """
+    start, end = f"{int(year)}-01-01", f"{int(year)}-12-31"
+    os.makedirs(folder, exist_ok=True)
+
+    total = 0
+    with _attached(conn, folder, [year]) as (schema,):
+        _create_archive(conn, schema, year)
+        while True:
+            after_id = 0
+            moved_in_pass = 0
+            while True:
+                result = _move_chunk(conn, schema, start, end, after_id, chunk_rows)
+                if result is None:
+                    break
+                after_id, moved = result
+                moved_in_pass += moved
+                total += moved
+                if progress is not None:
+                    progress(year, total)
+                if pause:
+                    time.sleep(pause)
+            if not moved_in_pass or not _has_rows(conn, start, end):
+                break
+
+    conn.execute(
+        """
+        UPDATE attendance_archives SET status = 'done', archived_at = CURRENT_TIMESTAMP
+        WHERE year = ? AND NOT EXISTS (SELECT 1 FROM main.attendance WHERE date BETWEEN ? AND ?)
+        """,
+        (year, start, end),
+    )
+    conn.commit()
+    return total
+
+
+def _has_rows(conn, start, end):
+    return conn.execute(
+        "SELECT 1 FROM main.attendance WHERE date BETWEEN ? AND ? LIMIT 1", (start, end)
+    ).fetchone() is not None
+
+
+def archivable_years(conn, before_year):
+    """
+    Years before `before_year` that still have rows in the live table,
+    found with one index probe per year rather than a scan.
+    """
+    years = []
+    floor = ""
+    while True:
+        first = conn.execute(
+            "SELECT MIN(date) FROM attendance WHERE date > ? AND date < ?",
+            (floor, f"{int(before_year):04d}-01-01"),
+        ).fetchone()[0]
+        if first is None:
+            return years
+        years.append(int(first[:4]))
+        floor = f"{first[:4]}-12-31"
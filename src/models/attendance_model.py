@@ -0,0 +1,309 @@
+import json
+import time
+
+from src.models import user_model, version_model
+
+
+_MARK_SQL = {
+    action: f"""
+    INSERT INTO attendance (user_id, date, {column}) VALUES (?, ?, ?)
+    ON CONFLICT(user_id, date) DO UPDATE SET {column}=excluded.{column}
+    WHERE attendance.{column} IS NULL
+    RETURNING in_time, out_time
+    """
+    for action, column in (("in", "in_time"), ("out", "out_time"))
+}
+
+
+def mark(conn, user_id, action, day, now_time):
+    """
+    Record an in/out tap as a single upsert on UNIQUE(user_id, date).
+    Returns (record, total_classes), or (None, None) when that side of
+    the day's record was already marked.
+    """
+    sql = _MARK_SQL["in" if action == "in" else "out"]
+
+    try:
+        record = conn.execute(sql, (user_id, day, now_time)).fetchone()
+        if record is None:
+            conn.rollback()
+            return None, None
+
+        total_classes = user_model.total_classes(conn, user_id)
+        version_model.bump_data_version(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return record, total_classes
+
+
+def mark_batch(conn, events):
+    """
+    Apply kiosk events in order, in one transaction, with the same rules
+    as mark(). Each event is a dict with key, user_id, action, day and time.
+
+    An idempotency key that was seen before, in this batch or an earlier
+    one, is not applied again; its first result comes back with status
+    "duplicate". Returns (results, total_classes by user id, applied events).
+    """
+    keys = json.dumps([event["key"] for event in events])
+    user_ids = json.dumps(sorted({event["user_id"] for event in events}))
+
+    seen = {
+        row["idempotency_key"]: row
+        for row in conn.execute(
+            """
+            SELECT idempotency_key, status, in_time, out_time FROM sync_keys
+            WHERE idempotency_key IN (SELECT value FROM json_each(?))
+            """,
+            (keys,),
+        )
+    }
+    known_users = {
+        row[0] for row in conn.execute("SELECT id FROM users WHERE id IN (SELECT value FROM json_each(?))", (user_ids,))
+    }
+
+    results = []
+    applied = []
+    new_keys = []
+    try:
+        for event in events:
+            key = event["key"]
+            if key in seen:
+                first = seen[key]
+                results.append(
+                    {
+                        "idempotency_key": key,
+                        "status": "duplicate",
+                        "first_status": first["status"],
+                        "in_time": first["in_time"],
+                        "out_time": first["out_time"],
+                    }
+                )
+                continue
+
+            if event["user_id"] not in known_users:
+                # Not remembered, so a replay after the user exists can apply
+                results.append({"idempotency_key": key, "status": "error", "message": "Unknown user"})
+                continue
+
+            sql = _MARK_SQL["in" if event["action"] == "in" else "out"]
+            record = conn.execute(sql, (event["user_id"], event["day"], event["time"])).fetchone()
+            result = {
+                "idempotency_key": key,
+                "status": "applied" if record else "already_marked",
+                "in_time": record["in_time"] if record else None,
+                "out_time": record["out_time"] if record else None,
+            }
+            if record:
+                applied.append({**event, "in_time": result["in_time"], "out_time": result["out_time"]})
+
+            seen[key] = {"status": result["status"], "in_time": result["in_time"], "out_time": result["out_time"]}
+            new_keys.append((key, event["user_id"], event["action"], result["status"], result["in_time"], result["out_time"]))
+            results.append(result)
+
+        if applied:
+            version_model.bump_data_version(conn)
+        conn.executemany(
+            """
+            INSERT INTO sync_keys (idempotency_key, user_id, action, status, in_time, out_time)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            new_keys,
+        )
+        totals = dict(
+            conn.execute(
+                "SELECT user_id, total_classes FROM user_stats WHERE user_id IN (SELECT value FROM json_each(?))",
+                (user_ids,),
+            ).fetchall()
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return results, totals, applied
+
+
+# Random free days per user from a generated calendar, and a random start
+# inside the slot for each. chosen is MATERIALIZED so random() is drawn once
+# per row, not once per reference. "WHERE true" keeps the upsert clause
+# from being parsed as a join constraint.
+_BACKFILL_SELECT = """
+    WITH RECURSIVE calendar(day) AS (
+        SELECT date(:start)
+        UNION ALL
+        SELECT date(day, '+1 day') FROM calendar WHERE day < date(:end)
+    ),
+    targets AS (
+        SELECT id AS user_id FROM users
+        WHERE :all_users OR id IN (SELECT value FROM json_each(:user_ids))
+    ),
+    free AS (
+        SELECT t.user_id, c.day,
+               ROW_NUMBER() OVER (PARTITION BY t.user_id ORDER BY random()) AS pick
+        FROM targets t CROSS JOIN calendar c
+        WHERE NOT EXISTS (
+            SELECT 1 FROM attendance a WHERE a.user_id = t.user_id AND a.date = c.day
+        )
+    ),
+    chosen AS MATERIALIZED (
+        SELECT user_id, day,
+               :slot_start + abs(random()) % (:slot_end - :duration - :slot_start + 1) AS in_minutes
+        FROM free
+        WHERE pick <= :classes
+    )
+"""
+
+_BACKFILL_INSERT = _BACKFILL_SELECT + """
+    INSERT INTO attendance (user_id, date, in_time, out_time)
+    SELECT user_id, day,
+           printf('%02d:%02d:00', in_minutes / 60, in_minutes % 60),
+           printf('%02d:%02d:00', (in_minutes + :duration) / 60 % 24, (in_minutes + :duration) % 60)
+    FROM chosen
+    WHERE true
+    ON CONFLICT(user_id, date) DO NOTHING
+"""
+
+_BACKFILL_PREVIEW = _BACKFILL_SELECT + """
+    SELECT (SELECT COUNT(*) FROM targets), COUNT(*) FROM chosen
+"""
+
+
+def backfill(conn, user_ids, start_date, end_date, slot_start, slot_end,
+             duration_minutes, classes_per_user, dry_run=False):
+    """
+    Generate up to classes_per_user past classes for each user on random
+    free days in [start_date, end_date], as one INSERT ... SELECT. Days that
+    already have attendance are skipped. user_ids=None targets every user.
+    Slot bounds and duration are minutes after midnight.
+
+    Returns a dict with users, rows (created, or that would be created on
+    a dry run), requested, seconds and rows_per_second.
+    """
+    params = {
+        "start": start_date.isoformat(),
+        "end": end_date.isoformat(),
+        "all_users": user_ids is None,
+        "user_ids": json.dumps(list(user_ids or [])),
+        "slot_start": slot_start,
+        "slot_end": slot_end,
+        "duration": duration_minutes,
+        "classes": classes_per_user,
+    }
+
+    started = time.perf_counter()
+    if dry_run:
+        users, rows = conn.execute(_BACKFILL_PREVIEW, params).fetchone()
+    else:
+        try:
+            conn.execute(_BACKFILL_INSERT, params)
+            # rowcount is -1 for a WITH-prefixed INSERT; changes() skips trigger writes
+            rows = conn.execute("SELECT changes()").fetchone()[0]
+            if rows:
+                version_model.bump_data_version(conn)
+            users = conn.execute(
+                "SELECT COUNT(*) FROM users WHERE :all_users OR id IN (SELECT value FROM json_each(:user_ids))",
+                params,
+            ).fetchone()[0]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    seconds = time.perf_counter() - started
+
+    return {
+        "users": users,
+        "rows": rows,
+        "requested": users * classes_per_user,
+        "dry_run": dry_run,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds else 0.0,
+    }
+
+
+# Hours between in and out; NULL for an open session
+_HOURS_SQL = "ROUND((julianday(a.out_time) - julianday(a.in_time)) * 24, 2)"
+
+ATTENDANCE_REPORT_COLUMNS = ("user_id", "name", "phone", "date", "in_time", "out_time", "hours")
+SUMMARY_REPORT_COLUMNS = (
+    "user_id", "name", "phone", "total_classes", "total_hours", "first_date", "last_date",
+)
+
+
+def _report_where(user_id, start, end):
+    where = []
+    params = []
+    if user_id is not None:
+        where.append("a.user_id = ?")
+        params.append(user_id)
+    if start is not None:
+        where.append("a.date >= ?")
+        params.append(start.isoformat())
+    if end is not None:
+        where.append("a.date <= ?")
+        params.append(end.isoformat())
+    return ("WHERE " + " AND ".join(where)) if where else "", params
+
+
+def iter_attendance(conn, user_id=None, start=None, end=None, source="attendance"):
+    """
+    Cursor over attendance rows with the user's name and phone, ordered by
+    date. SQLite steps the query as the caller iterates, so nothing is
+    buffered here. `source` replaces the attendance table, e.g. with
+    archive_model.attendance_source() for ranges reaching archived years.
+    """
+    where, params = _report_where(user_id, start, end)
+    order = "a.date, a.user_id" if user_id is None else "a.user_id, a.date"
+    return conn.execute(
+        f"""
+        SELECT a.user_id, u.name, u.phone, a.date, a.in_time, a.out_time,
+               {_HOURS_SQL} AS hours
+        FROM {source} a
+        JOIN users u ON u.id = a.user_id
+        {where}
+        ORDER BY {order}
+        """,
+        params,
+    )
+
+
+def iter_user_summaries(conn, user_id=None, start=None, end=None, source="attendance"):
+    """
+    One row per user with attendance in the range: completed classes,
+    hours, and first and last date, all aggregated in SQL.
+    """
+    where, params = _report_where(user_id, start, end)
+    return conn.execute(
+        f"""
+        SELECT a.user_id, u.name, u.phone,
+               SUM(a.in_time IS NOT NULL) AS total_classes,
+               ROUND(COALESCE(SUM({_HOURS_SQL}), 0), 2) AS total_hours,
+               MIN(a.date) AS first_date,
+               MAX(a.date) AS last_date
+        FROM {source} a
+        JOIN users u ON u.id = a.user_id
+        {where}
+        GROUP BY a.user_id
+        ORDER BY u.name COLLATE NOCASE, a.user_id
+        """,
+        params,
+    )
+
+
+def day_counters(conn, day):
+    """
+    (active, completed) session counts for one day, as the board shows them.
+    """
+    row = conn.execute(
+        """
+        SELECT COALESCE(SUM(in_time IS NOT NULL AND out_time IS NULL), 0),
+               COALESCE(SUM(out_time IS NOT NULL), 0)
+        FROM attendance
+        WHERE date = ?
+        """,
+        (day,),
+    ).fetchone()
+    return row[0], row[1]
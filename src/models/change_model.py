@@ -0,0 +1,123 @@
+"""
+Change log of the tables the reporting replica mirrors.
+
+Triggers on each table in CAPTURED append one change_log row per row
+written: op 'upsert' with the row's new values, or 'delete' with its key,
+as a JSON object. They fire for every write path (routes, services and
+maintenance commands alike) and only while change_consumers has a row,
+so a database nobody replicates logs nothing. seq is AUTOINCREMENT and
+SQLite has one writer at a time, so seq order is commit order.
+
+Only base tables are captured. user_stats, the rollups and images are
+maintained on the replica by the same triggers that maintain them here;
+archive_guard is captured so an archive job's deletes skip them there
+too. Rows are never updated once logged and are pruned once every
+consumer has applied them.
+"""
+
+# table -> (key columns, captured columns). users leaves out the fingerprint
+# template: reports never read it, and JSON cannot carry a blob.
+CAPTURED = {
+    "users": (
+        ("id",),
+        ("id", "name", "phone", "image_path", "pending_image", "created_at", "fingerprint_updated_at"),
+    ),
+    "attendance": (("id",), ("id", "user_id", "date", "in_time", "out_time")),
+    "attendance_archives": (("year",), ("year", "rows", "status", "archived_at")),
+    "archive_guard": (("active",), ("active",)),
+}
+
+TRIGGER_SUFFIXES = ("capture_insert", "capture_update", "capture_delete")
+
+
+def capture_triggers(table):
+    return [f"{table}_{suffix}" for suffix in TRIGGER_SUFFIXES]
+
+
+def head(conn):
+    """
+    Highest seq ever logged, pruned or not.
+    """
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+
+def register_consumer(conn, name):
+    """
+    Start logging for consumer `name` (again) from the current head, and
+    commit, so that a snapshot taken afterwards plus the log entries
+    after its own head leave nothing out.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        applied = head(conn)
+        conn.execute(
+            """
+            INSERT INTO change_consumers (name, applied_seq) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET applied_seq = excluded.applied_seq, updated_at = CURRENT_TIMESTAMP
+            """,
+            (name, applied),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return applied
+
+
+def consumer_position(conn, name):
+    """
+    The seq `name` has applied through, or None if it is not registered.
+    """
+    row = conn.execute("SELECT applied_seq FROM change_consumers WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def changes_after(conn, seq, limit):
+    return conn.execute(
+        """
+        SELECT seq, table_name, op, row_data, changed_at FROM change_log
+        WHERE seq > ? ORDER BY seq LIMIT ?
+        """,
+        (seq, limit),
+    ).fetchall()
+
+
+def acknowledge(conn, name, seq):
+    """
+    Record that `name` has applied everything through seq, and drop the
+    log entries every consumer has applied. Commits.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "UPDATE change_consumers SET applied_seq = ?, updated_at = CURRENT_TIMESTAMP WHERE name = ?",
+            (seq, name),
+        )
+        pruned = conn.execute(
+            "DELETE FROM change_log WHERE seq <= (SELECT MIN(applied_seq) FROM change_consumers)"
+        ).rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return pruned
+
+
+def unregister_consumer(conn, name):
+    """
+    Stop logging for `name`; with no consumers left the log is emptied.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM change_consumers WHERE name = ?", (name,))
+        conn.execute(
+            """
+            DELETE FROM change_log
+            WHERE seq <= COALESCE((SELECT MIN(applied_seq) FROM change_consumers), seq)
+            """
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
@@ -0,0 +1,113 @@
+"""
+Bookkeeping for the content-addressed upload store.
+
+images has one row per stored full-size image (the path users.image_path
+holds) with the number of users pointing at it. Triggers on users keep
+refs current; see migrations._create_image_store. last_used moves
+whenever processing produces or reuses the image, so the garbage
+collector can leave images alone while an upload that needs them is
+still being committed.
+
+image_sources maps a hash of the original upload, together with the
+processing settings, to the image it produced, so an identical photo is
+not decoded and encoded again.
+"""
+
+
+def source_image(conn, source_key):
+    row = conn.execute(
+        "SELECT image_path FROM image_sources WHERE source_key = ?", (source_key,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def register(conn, image_path, source_key=None):
+    """
+    Record a stored image (and the source that produced it) and mark it
+    as just used, in the caller's transaction.
+    """
+    conn.execute(
+        """
+        INSERT INTO images (image_path) VALUES (?)
+        ON CONFLICT(image_path) DO UPDATE SET last_used = CURRENT_TIMESTAMP
+        """,
+        (image_path,),
+    )
+    if source_key is not None:
+        conn.execute(
+            "INSERT OR REPLACE INTO image_sources (source_key, image_path) VALUES (?, ?)",
+            (source_key, image_path),
+        )
+
+
+def references(conn, image_path):
+    row = conn.execute("SELECT refs FROM images WHERE image_path = ?", (image_path,)).fetchone()
+    return row[0] if row else 0
+
+
+def releasable(conn, image_path, grace_seconds):
+    """
+    True when no user points at image_path and it has not been used for
+    grace_seconds.
+    """
+    row = conn.execute(
+        "SELECT refs, last_used < datetime('now', ?) FROM images WHERE image_path = ?",
+        (f"-{grace_seconds} seconds", image_path),
+    ).fetchone()
+    if row is None:
+        # Not registered: only users can still be pointing at it
+        return not conn.execute(
+            "SELECT 1 FROM users WHERE image_path = ? LIMIT 1", (image_path,)
+        ).fetchone()
+    return row[0] == 0 and bool(row[1])
+
+
+def unreferenced(conn, grace_seconds, after="", limit=500):
+    """
+    Next page of images nobody uses and nothing has used for
+    grace_seconds, ordered by path and starting after `after`.
+    """
+    return [
+        row[0] for row in conn.execute(
+            """
+            SELECT image_path FROM images
+            WHERE image_path > ? AND refs = 0 AND last_used < datetime('now', ?)
+            ORDER BY image_path
+            LIMIT ?
+            """,
+            (after, f"-{grace_seconds} seconds", limit),
+        )
+    ]
+
+
+def is_registered(conn, image_path):
+    return conn.execute("SELECT 1 FROM images WHERE image_path = ?", (image_path,)).fetchone() is not None
+
+
+def forget(conn, image_path):
+    """
+    Drop an unreferenced image's rows, in the caller's transaction.
+    Returns False if a user started pointing at it in the meantime.
+    """
+    deleted = conn.execute(
+        "DELETE FROM images WHERE image_path = ? AND refs = 0", (image_path,)
+    ).rowcount
+    if deleted:
+        conn.execute("DELETE FROM image_sources WHERE image_path = ?", (image_path,))
+    return bool(deleted)
+
+
+def rebuild_image_refs(conn):
+    """
+    Recount images.refs from users, registering any image that is
+    referenced but missing. Runs in the caller's transaction.
+    """
+    conn.execute("""
+    INSERT INTO images (image_path, refs)
+    SELECT image_path, 0 FROM users
+    WHERE image_path != '' AND image_path NOT IN (SELECT image_path FROM images)
+    GROUP BY image_path
+    """)
+    conn.execute("""
+    UPDATE images SET refs = (SELECT COUNT(*) FROM users u WHERE u.image_path = images.image_path)
+    """)
@@ -0,0 +1,49 @@
+"""
+Events for the live attendance boards, shared by every server process.
+
+Each process keeps its own event bus and its own board streams, so a tap
+handled by one process has to reach boards held open by the others: it
+is appended here, and every process that has boards polls for rows past
+the last one it has seen. id is AUTOINCREMENT and SQLite has one writer
+at a time, so ids are gap-free, in commit order and the same in every
+process; they double as the SSE event ids. Only the newest rows are kept,
+enough for a reconnecting board to catch up.
+"""
+import json
+
+
+def append(conn, event, payloads, keep):
+    """
+    Append one event per payload and drop all but the newest `keep` rows,
+    in one transaction. Commits. Returns the last id appended.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        last_id = None
+        for data in payloads:
+            last_id = conn.execute(
+                "INSERT INTO live_events (event, data) VALUES (?, ?)",
+                (event, json.dumps(data, separators=(",", ":"))),
+            ).lastrowid
+        if last_id is not None:
+            conn.execute("DELETE FROM live_events WHERE id <= ?", (last_id - keep,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return last_id
+
+
+def head(conn):
+    """
+    Highest id ever appended, pruned or not.
+    """
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'live_events'").fetchone()
+    return row[0] if row else 0
+
+
+def events_after(conn, last_id, limit):
+    return conn.execute(
+        "SELECT id, event, data FROM live_events WHERE id > ? ORDER BY id LIMIT ?",
+        (last_id, limit),
+    ).fetchall()
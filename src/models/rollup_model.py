@@ -0,0 +1,184 @@
+"""
+Daily and per-user monthly attendance rollups, kept current by triggers
+(see migrations._create_rollups) so analytics never read raw attendance.
+"""
+
+# Whole minutes between in and out for a finished session, else 0
+SESSION_MINUTES_SQL = (
+    "CASE WHEN {row}.in_time IS NOT NULL AND {row}.out_time IS NOT NULL "
+    "THEN CAST(ROUND((julianday({row}.out_time) - julianday({row}.in_time)) * 1440) AS INTEGER) "
+    "ELSE 0 END"
+)
+
+# {source} is the attendance table or an archive_model.attendance_source()
+_ACTUAL_DAILY_SQL = f"""
+    SELECT date,
+           SUM(in_time IS NOT NULL) AS checked_in,
+           SUM(in_time IS NOT NULL AND out_time IS NOT NULL) AS completed,
+           SUM(in_time IS NOT NULL AND out_time IS NULL) AS open_sessions,
+           SUM({SESSION_MINUTES_SQL.format(row="a")}) AS session_minutes
+    FROM {{source}} a
+    GROUP BY date
+"""
+
+_ACTUAL_MONTHLY_SQL = f"""
+    SELECT user_id,
+           substr(date, 1, 7) AS month,
+           SUM(in_time IS NOT NULL) AS classes,
+           SUM(in_time IS NOT NULL AND out_time IS NOT NULL) AS completed,
+           SUM({SESSION_MINUTES_SQL.format(row="a")}) AS session_minutes
+    FROM {{source}} a
+    GROUP BY user_id, month
+"""
+
+_DAILY_COLUMNS = ("checked_in", "completed", "open_sessions", "session_minutes")
+_MONTHLY_COLUMNS = ("classes", "completed", "session_minutes")
+
+
+def rebuild_rollups(conn, source="attendance"):
+    """
+    Recompute both rollup tables from attendance. The caller commits.
+    """
+    conn.execute("DELETE FROM daily_rollup")
+    conn.execute("DELETE FROM monthly_rollup")
+    conn.execute(
+        f"""
+        INSERT INTO daily_rollup (date, checked_in, completed, open_sessions, session_minutes)
+        {_ACTUAL_DAILY_SQL.format(source=source)}
+        """
+    )
+    conn.execute(
+        f"""
+        INSERT INTO monthly_rollup (user_id, month, classes, completed, session_minutes)
+        {_ACTUAL_MONTHLY_SQL.format(source=source)}
+        """
+    )
+
+
+def _compare(actual_rows, stored_rows, key_columns, columns):
+    def keyed(rows):
+        return {
+            tuple(row[column] for column in key_columns): tuple(row[column] for column in columns)
+            for row in rows
+        }
+
+    actual = keyed(actual_rows)
+    stored = keyed(stored_rows)
+    empty = (0,) * len(columns)
+    mismatches = []
+    for key in sorted(actual.keys() | stored.keys()):
+        expected = actual.get(key, empty)
+        current = stored.get(key, empty)
+        if expected != current:
+            mismatches.append((key, current, expected))
+    return mismatches
+
+
+def check_rollups(conn, source="attendance"):
+    """
+    Return (table, key, stored, actual) for every rollup row that disagrees
+    with a full recount of attendance. Missing rows count as all zeros.
+    """
+    daily = _compare(
+        conn.execute(_ACTUAL_DAILY_SQL.format(source=source)),
+        conn.execute("SELECT * FROM daily_rollup"),
+        ("date",),
+        _DAILY_COLUMNS,
+    )
+    monthly = _compare(
+        conn.execute(_ACTUAL_MONTHLY_SQL.format(source=source)),
+        conn.execute("SELECT * FROM monthly_rollup"),
+        ("user_id", "month"),
+        _MONTHLY_COLUMNS,
+    )
+    return [("daily_rollup",) + item for item in daily] + [("monthly_rollup",) + item for item in monthly]
+
+
+def _average(minutes, sessions):
+    return round(minutes / sessions, 1) if sessions else None
+
+
+def daily_totals(conn, start, end):
+    """
+    daily_rollup rows in [start, end] (ISO dates) as dicts, oldest first.
+    Sums, so several databases' days can be added before averaging.
+    """
+    rows = conn.execute(
+        """
+        SELECT date, checked_in, completed, open_sessions, session_minutes
+        FROM daily_rollup
+        WHERE date BETWEEN ? AND ?
+        ORDER BY date
+        """,
+        (start, end),
+    )
+    return [dict(row) for row in rows]
+
+
+def daily_points(totals):
+    return [
+        {
+            "date": day["date"],
+            "checked_in": day["checked_in"],
+            "completed": day["completed"],
+            "open_sessions": day["open_sessions"],
+            "avg_session_minutes": _average(day["session_minutes"], day["completed"]),
+        }
+        for day in totals
+    ]
+
+
+def merge_daily_totals(totals_lists):
+    """
+    Add up daily_totals() results from several databases, by date.
+    """
+    merged = {}
+    for totals in totals_lists:
+        for day in totals:
+            sums = merged.setdefault(day["date"], dict.fromkeys(_DAILY_COLUMNS, 0))
+            for column in _DAILY_COLUMNS:
+                sums[column] += day[column]
+    return [{"date": day, **merged[day]} for day in sorted(merged)]
+
+
+def daily_series(conn, start, end):
+    """
+    Occupancy per day in [start, end] (ISO dates), oldest first.
+    """
+    return daily_points(daily_totals(conn, start, end))
+
+
+def monthly_series(conn, start_month, end_month, user_id=None):
+    """
+    Classes and session length per month ('YYYY-MM' bounds), for one user
+    or summed over everyone.
+    """
+    if user_id is None:
+        sql = """
+            SELECT month, SUM(classes) AS classes, SUM(completed) AS completed,
+                   SUM(session_minutes) AS session_minutes, COUNT(*) AS users
+            FROM monthly_rollup
+            WHERE month BETWEEN ? AND ? AND classes > 0
+            GROUP BY month
+            ORDER BY month
+        """
+        params = (start_month, end_month)
+    else:
+        sql = """
+            SELECT month, classes, completed, session_minutes, 1 AS users
+            FROM monthly_rollup
+            WHERE user_id = ? AND month BETWEEN ? AND ?
+            ORDER BY month
+        """
+        params = (user_id, start_month, end_month)
+
+    return [
+        {
+            "month": row["month"],
+            "classes": row["classes"],
+            "completed": row["completed"],
+            "active_users": row["users"],
+            "avg_session_minutes": _average(row["session_minutes"], row["completed"]),
+        }
+        for row in conn.execute(sql, params)
+    ]
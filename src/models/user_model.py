@@ -0,0 +1,151 @@
+import base64
+import json
+
+
+_ACTUAL_STATS_SQL = """
+    SELECT user_id,
+           SUM(in_time IS NOT NULL) AS total_classes,
+           MIN(CASE WHEN in_time IS NOT NULL THEN date END) AS first_date,
+           MAX(CASE WHEN in_time IS NOT NULL THEN date END) AS last_date,
+           SUM(in_time IS NOT NULL AND out_time IS NULL) AS open_sessions
+    FROM {source}
+    GROUP BY user_id
+"""
+
+_STATS_COLUMNS = ("total_classes", "first_date", "last_date", "open_sessions")
+
+# A candidate's row without the biometric columns, for pages that show or
+# edit one candidate
+PROFILE_COLUMNS = "id, name, phone, image_path, pending_image, created_at"
+
+
+def total_classes(conn, user_id):
+    row = conn.execute(
+        "SELECT total_classes FROM user_stats WHERE user_id=?", (user_id,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def rebuild_user_stats(conn, source="attendance"):
+    """
+    Recompute user_stats from scratch. The caller commits. `source` can
+    be archive_model.attendance_source() to count archived years too.
+    """
+    conn.execute("DELETE FROM user_stats")
+    conn.execute(
+        f"""
+        INSERT INTO user_stats (user_id, total_classes, first_date, last_date, open_sessions)
+        {_ACTUAL_STATS_SQL.format(source=source)}
+        """
+    )
+    conn.execute("INSERT OR IGNORE INTO user_stats (user_id) SELECT id FROM users")
+
+
+def check_user_stats(conn, source="attendance"):
+    """
+    Return (user_id, stored, actual) for every user_stats row that
+    disagrees with a full recount of the attendance table.
+    """
+    actual = {
+        row["user_id"]: tuple(row[column] for column in _STATS_COLUMNS)
+        for row in conn.execute(_ACTUAL_STATS_SQL.format(source=source))
+    }
+    stored = {
+        row["user_id"]: tuple(row[column] for column in _STATS_COLUMNS)
+        for row in conn.execute(
+            "SELECT user_id, total_classes, first_date, last_date, open_sessions FROM user_stats"
+        )
+    }
+
+    empty = (0, None, None, 0)
+    mismatches = []
+    for user_id in sorted(actual.keys() | stored.keys()):
+        expected = actual.get(user_id, empty)
+        current = stored.get(user_id, empty)
+        if expected != current:
+            mismatches.append((user_id, current, expected))
+    return mismatches
+
+
+_PAGE_COLUMNS = "u.id, u.name, u.phone, u.image_path, u.created_at"
+_PREFIX_END = "\U0010ffff"
+
+
+def encode_cursor(row):
+    raw = json.dumps([row["name"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Returns (name, id). Raises ValueError for a malformed cursor.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        name, user_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (TypeError, ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("Invalid page cursor") from exc
+    if not isinstance(name, str) or not isinstance(user_id, int):
+        raise ValueError("Invalid page cursor")
+    return name, user_id
+
+
+def page_users(conn, search=None, after=None, before=None, limit=50, with_totals=False):
+    """
+    One page of users ordered by name, using the (name NOCASE, id) keyset.
+    after/before are cursors from a previous page. A search made only of
+    digits matches a phone prefix, anything else a name prefix.
+    Returns (rows, next_cursor, prev_cursor).
+    """
+    columns = _PAGE_COLUMNS
+    joins = ""
+    if with_totals:
+        columns += ", COALESCE(stats.total_classes, 0) AS total_classes"
+        joins = "LEFT JOIN user_stats stats ON stats.user_id = u.id"
+
+    where = []
+    params = []
+
+    search = (search or "").strip()
+    if search:
+        column = "u.phone" if search.isdigit() else "u.name COLLATE NOCASE"
+        where.append(f"{column} >= ? AND {column} < ?")
+        params += [search, search + _PREFIX_END]
+
+    backwards = before is not None and after is None
+    cursor = decode_cursor(before if backwards else after) if (after or before) else None
+    if cursor:
+        # The plain range on name lets SQLite seek the index; the row value
+        # then breaks ties between equal names.
+        if backwards:
+            where.append("u.name <= ? COLLATE NOCASE AND (u.name COLLATE NOCASE, u.id) < (?, ?)")
+        else:
+            where.append("u.name >= ? COLLATE NOCASE AND (u.name COLLATE NOCASE, u.id) > (?, ?)")
+        params += [cursor[0], cursor[0], cursor[1]]
+
+    direction = "DESC" if backwards else "ASC"
+    sql = f"""
+        SELECT {columns}
+        FROM users u
+        {joins}
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY u.name COLLATE NOCASE {direction}, u.id {direction}
+        LIMIT ?
+    """
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    if not rows:
+        return rows, None, None
+
+    if backwards:
+        next_cursor = encode_cursor(rows[-1])
+        prev_cursor = encode_cursor(rows[0]) if has_more else None
+    else:
+        next_cursor = encode_cursor(rows[-1]) if has_more else None
+        prev_cursor = encode_cursor(rows[0]) if cursor else None
+    return rows, next_cursor, prev_cursor
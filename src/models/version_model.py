@@ -0,0 +1,18 @@
+"""
+Single database-wide data version, bumped inside every write transaction
+that changes what the attendance board or the listings show. Render
+caches key on it, so all workers see a write at their next lookup.
+Scripts that write to users or attendance directly must bump it too.
+"""
+
+
+def bump_data_version(conn):
+    """
+    Increment the version as part of the caller's transaction.
+    """
+    conn.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+
+
+def data_version(conn):
+    row = conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()
+    return row[0] if row else 0
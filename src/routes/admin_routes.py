@@ -1,8 +1,16 @@
-import random
-from datetime import datetime, timedelta, date
-
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from src.database import get_db_connection
+from datetime import datetime, date, timedelta
+
+from flask import Blueprint, Response, render_template, request, redirect, url_for, flash, jsonify, current_app, abort
+from src import shards
+from src.database import current_pool, get_db
+from markupsafe import Markup
+from src.models import archive_model, attendance_model, rollup_model, user_model, version_model
+from src.routes.user_routes import page_args, page_users
+from src.services import branch_summary, bulk_import, replica
+from src.services.event_bus import get_event_bus
+from src.services.export_service import EXPORT_FORMATS
+from src.services.image_service import image_url
+from src.services.render_cache import get_render_cache, render_fragment
 
 admin_bp = Blueprint("admin_bp", __name__)
 
@@ -22,55 +30,174 @@ def _parse_time_to_minutes(raw_time: str) -> int:
     raise ValueError(f"Invalid time format: {raw_time}")
 
 
-def _minutes_to_time_str(total_minutes: int) -> str:
-    hours = (total_minutes // 60) % 24
-    minutes = total_minutes % 60
-    return f"{hours:02d}:{minutes:02d}:00"
+def _optional_arg(name, parse):
+    raw = request.args.get(name, "").strip()
+    if not raw:
+        return None
+    try:
+        return parse(raw)
+    except ValueError:
+        abort(400, description=f"Invalid {name}: {raw}")
+
+
+def _parse_month(raw):
+    return datetime.strptime(raw, "%Y-%m").strftime("%Y-%m")
 
 
 @admin_bp.route("/admin")
 def admin_dashboard():
-    conn = get_db_connection()
+    args = page_args()
+    conn = get_db()
+    key = (version_model.data_version(conn),) + tuple(sorted(args.items()))
+    rows, next_cursor, prev_cursor = get_render_cache().fetch(
+        "admin", key, lambda: _render_summary(conn, args)
+    )
 
-    users = conn.execute("SELECT * FROM users").fetchall()
+    return render_template(
+        "admin_dashboard.html",
+        rows=rows,
+        search=args["search"],
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+        page="admin",
+    )
 
-    summary = []
-    for user in users:
-        total_classes = conn.execute(
-            "SELECT COUNT(*) FROM attendance WHERE user_id=? AND in_time IS NOT NULL",
-            (user["id"],)
-        ).fetchone()[0]
 
-        summary.append({
+def _render_summary(conn, args):
+    users, next_cursor, prev_cursor = page_users(conn, args, with_totals=True)
+
+    rows = []
+    for user in users:
+        row = {
             "id": user["id"],
             "name": user["name"],
             "phone": user["phone"],
             "image": user["image_path"],
             "created_at": user["created_at"],
-            "total_classes": total_classes,
-        })
+            "total_classes": user["total_classes"],
+        }
+        rows.append(render_fragment(
+            "admin_row", tuple(row.values()), "partials/admin_row.html",
+            row=row, image_url=image_url,
+        ))
+    return Markup("\n").join(rows), next_cursor, prev_cursor
+
+
+@admin_bp.route("/admin/db-stats")
+def db_stats():
+    return jsonify(current_pool().stats())
+
+
+@admin_bp.route("/admin/image-queue")
+def image_queue_status():
+    return jsonify(current_app.extensions["image_queue"].stats())
 
-    conn.close()
+
+@admin_bp.route("/admin/render-cache")
+def render_cache_status():
+    return jsonify(get_render_cache().stats())
+
+
+@admin_bp.route("/admin/live-boards")
+def live_boards_status():
+    return jsonify(get_event_bus().stats())
+
+
+@admin_bp.route("/admin/replica")
+def replica_status():
+    return jsonify(
+        {
+            "enabled": current_app.config["REPORTING_REPLICA"],
+            "max_staleness": current_app.config["REPLICA_MAX_STALENESS"],
+            **replica.status(shards.database_path()),
+        }
+    )
+
+
+@admin_bp.route("/admin/analytics/daily")
+def analytics_daily():
+    """
+    Per-day occupancy for charts, from daily_rollup only. Defaults to the
+    last 30 days. Reads the reporting replica when it is fresh enough.
+    """
+    end = _optional_arg("end", date.fromisoformat) or date.today()
+    start = _optional_arg("start", date.fromisoformat) or end - timedelta(days=29)
+    return jsonify(
+        {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "days": rollup_model.daily_series(replica.get_report_db(), start.isoformat(), end.isoformat()),
+        }
+    )
+
+
+@admin_bp.route("/admin/analytics/monthly")
+def analytics_monthly():
+    """
+    Classes and average session length per month, for ?user_id= or the
+    whole school, from monthly_rollup only. Defaults to the last 12 months.
+    Reads the reporting replica when it is fresh enough.
+    """
+    end = _optional_arg("end", _parse_month) or date.today().strftime("%Y-%m")
+    start = _optional_arg("start", _parse_month)
+    if start is None:
+        year, month = divmod(int(end[:4]) * 12 + int(end[5:]) - 12, 12)
+        start = f"{year:04d}-{month + 1:02d}"
+    user_id = _optional_arg("user_id", int)
+    return jsonify(
+        {
+            "start": start,
+            "end": end,
+            "user_id": user_id,
+            "months": rollup_model.monthly_series(replica.get_report_db(), start, end, user_id),
+        }
+    )
+
+
+@admin_bp.route("/admin/branches")
+def branches_summary():
+    """
+    Every branch side by side, with school-wide totals and daily
+    occupancy. The shards are queried in parallel. Defaults to the last
+    30 days; ?format=json returns the numbers.
+    """
+    branches = shards.all_shards()
+    if not branches:
+        abort(404)
+    end = _optional_arg("end", date.fromisoformat) or date.today()
+    start = _optional_arg("start", date.fromisoformat) or end - timedelta(days=29)
+    summary = branch_summary.summarize(
+        branches,
+        date.today().isoformat(),
+        start.isoformat(),
+        end.isoformat(),
+        workers=current_app.config["SHARD_FANOUT_WORKERS"],
+        max_staleness=replica.max_staleness(),
+    )
+    if request.args.get("format") == "json":
+        return jsonify({"start": start.isoformat(), "end": end.isoformat(), **summary})
     return render_template(
-        "admin_dashboard.html",
+        "admin_branches.html",
         summary=summary,
+        start=start.isoformat(),
+        end=end.isoformat(),
+        branch_url=shards.branch_url,
         page="admin",
     )
 
 
 @admin_bp.route("/admin/user/<int:user_id>")
 def admin_user_detail(user_id):
-    conn = get_db_connection()
-
-    user = conn.execute("SELECT * FROM users WHERE id=?", (user_id,)).fetchone()
-    attendance = conn.execute(
-        "SELECT * FROM attendance WHERE user_id=? ORDER BY date DESC",
-        (user_id,)
-    ).fetchall()
+    conn = get_db()
 
-    conn.close()
+    user = conn.execute(f"SELECT {user_model.PROFILE_COLUMNS} FROM users WHERE id=?", (user_id,)).fetchone()
+    with archive_model.attendance_source(conn, shards.archive_folder(), user_id=user_id) as source:
+        attendance = conn.execute(
+            f"SELECT * FROM {source} WHERE user_id=? ORDER BY date DESC",
+            (user_id,)
+        ).fetchall()
 
-    total_classes = sum(1 for row in attendance if row["in_time"])
+    total_classes = user_model.total_classes(conn, user_id)
 
     return render_template(
         "admin_user_detail.html",
@@ -82,11 +209,119 @@ def admin_user_detail(user_id):
     )
 
 
+_EXPORTS = {
+    "attendance": (attendance_model.ATTENDANCE_REPORT_COLUMNS, attendance_model.iter_attendance),
+    "summary": (attendance_model.SUMMARY_REPORT_COLUMNS, attendance_model.iter_user_summaries),
+}
+
+
+@admin_bp.route("/admin/export/<report>.<fmt>")
+def export_report(report, fmt):
+    """
+    Stream attendance rows or per-user totals as CSV or XLSX, optionally
+    narrowed by ?user_id= and a ?start=/?end= date range. Read from the
+    reporting replica when it is fresh enough.
+    """
+    if report not in _EXPORTS or fmt not in EXPORT_FORMATS:
+        abort(404)
+
+    user_id = _optional_arg("user_id", int)
+    start = _optional_arg("start", date.fromisoformat)
+    end = _optional_arg("end", date.fromisoformat)
+
+    header, query = _EXPORTS[report]
+    mimetype, writer = EXPORT_FORMATS[fmt]
+    pool = current_pool()
+    archive_folder = shards.archive_folder()
+    replica_database = replica.choose_report_database()
+
+    def generate():
+        # The connection is held only while the body is being sent
+        conn = replica.open_replica(replica_database) if replica_database else pool.acquire()
+        try:
+            with archive_model.attendance_source(
+                conn,
+                archive_folder,
+                start.isoformat() if start else None,
+                end.isoformat() if end else None,
+                user_id,
+            ) as source:
+                cursor = query(conn, user_id, start, end, source=source)
+                try:
+                    yield from writer(header, cursor)
+                finally:
+                    # Before the archives are detached
+                    cursor.close()
+        finally:
+            if replica_database:
+                conn.close()
+            else:
+                pool.release(conn)
+
+    parts = [report]
+    if user_id is not None:
+        parts.append(f"user{user_id}")
+    parts += [str(value) for value in (start, end) if value is not None]
+    filename = "-".join(parts) + "." + fmt
+
+    return Response(
+        generate(),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@admin_bp.route("/admin/import", methods=["GET", "POST"])
+def import_candidates():
+    if request.method == "POST":
+        # Photo archives are far larger than a single enrollment upload
+        request.max_content_length = current_app.config["IMPORT_MAX_BYTES"]
+        csv_file = request.files.get("csv")
+        zip_file = request.files.get("photos")
+        if not csv_file or not zip_file:
+            flash("Choose both the candidates CSV and the photos ZIP.")
+            return redirect(url_for("admin_bp.import_candidates"))
+
+        runner = bulk_import.get_import_runner()
+        try:
+            job_id = bulk_import.create_job(get_db(), runner.job_folder, csv_file, zip_file)
+        except ValueError as exc:
+            flash(str(exc))
+            return redirect(url_for("admin_bp.import_candidates"))
+        runner.start(job_id)
+        return redirect(url_for("admin_bp.import_status", job_id=job_id))
+
+    jobs = get_db().execute("SELECT * FROM import_jobs ORDER BY id DESC LIMIT 20").fetchall()
+    return render_template("admin_import.html", jobs=jobs, job=None, page="admin")
+
+
+@admin_bp.route("/admin/import/<int:job_id>")
+def import_status(job_id):
+    job = bulk_import.job_status(get_db(), job_id)
+    if job is None:
+        abort(404)
+    if request.args.get("format") == "json":
+        return jsonify(job)
+    return render_template("admin_import.html", jobs=None, job=job, page="admin")
+
+
+@admin_bp.route("/admin/import/<int:job_id>/resume", methods=["POST"])
+def resume_import(job_id):
+    if not bulk_import.get_import_runner().start(job_id):
+        flash("That import is finished or still running.")
+    return redirect(url_for("admin_bp.import_status", job_id=job_id))
+
+
 @admin_bp.route("/admin/generate-attendance", methods=["POST"])
 def generate_attendance() -> str:
+    # One candidate from their detail page, several via repeated user_id,
+    # or everyone with all_users=1.
+    all_users = request.form.get("all_users") == "1"
     try:
-        user_id = int(request.form.get("user_id", ""))
+        user_ids = None if all_users else [int(raw) for raw in request.form.getlist("user_id")]
     except ValueError:
+        user_ids = []
+    if user_ids == []:
         flash("Select a valid candidate before generating attendance.")
         return redirect(url_for("admin_bp.admin_dashboard"))
 
@@ -96,6 +331,7 @@ def generate_attendance() -> str:
     end_time_raw = request.form.get("time_end", "")
     total_classes_raw = request.form.get("total_classes", "")
     duration_raw = request.form.get("class_duration_hours", "")
+    dry_run = request.form.get("dry_run") == "1"
 
     try:
         start_date = datetime.strptime(start_date_raw, "%Y-%m-%d").date()
@@ -144,61 +380,50 @@ def generate_attendance() -> str:
         flash("Class duration does not fit within the selected time window.")
         return redirect(url_for("admin_bp.admin_dashboard"))
 
-    conn = get_db_connection()
-    user = conn.execute("SELECT id FROM users WHERE id=?", (user_id,)).fetchone()
-    if not user:
-        conn.close()
-        flash("Selected candidate does not exist.")
+    archived_through = archive_model.archived_through(get_db())
+    if archived_through and start_date.isoformat() <= archived_through:
+        flash(f"Attendance up to {archived_through} is archived. Choose a later start date.")
         return redirect(url_for("admin_bp.admin_dashboard"))
 
-    days_range = []
-    cursor_day = start_date
-    while cursor_day <= end_date:
-        days_range.append(cursor_day)
-        cursor_day += timedelta(days=1)
-
-    existing_rows = conn.execute(
-        "SELECT date FROM attendance WHERE user_id=? AND date BETWEEN ? AND ?",
-        (user_id, start_date.isoformat(), end_date.isoformat()),
-    ).fetchall()
-    taken_dates = {row["date"] for row in existing_rows}
-
-    available_dates = [d for d in days_range if d.isoformat() not in taken_dates]
-    if not available_dates:
-        conn.close()
-        flash("No free dates available in the selected window for this candidate.")
-        return redirect(url_for("admin_bp.admin_dashboard"))
-
-    classes_to_create = min(total_classes, len(available_dates))
-    chosen_dates = random.sample(available_dates, classes_to_create)
+    result = attendance_model.backfill(
+        get_db(),
+        user_ids,
+        start_date,
+        end_date,
+        slot_start,
+        slot_end,
+        duration_minutes,
+        total_classes,
+        dry_run=dry_run,
+    )
 
-    created = 0
-    for class_date in chosen_dates:
-        in_minutes = random.randint(slot_start, slot_end - duration_minutes)
-        out_minutes = in_minutes + duration_minutes
+    if not result["users"]:
+        flash("Selected candidate does not exist.")
+        return redirect(url_for("admin_bp.admin_dashboard"))
 
-        conn.execute(
-            "INSERT INTO attendance (user_id, date, in_time, out_time) VALUES (?, ?, ?, ?)",
-            (
-                user_id,
-                class_date.isoformat(),
-                _minutes_to_time_str(in_minutes),
-                _minutes_to_time_str(out_minutes),
-            ),
+    created = result["rows"]
+    skipped = result["requested"] - created
+    if dry_run:
+        flash(
+            f"Preview: {created} attendance records would be created for {result['users']} candidate(s)"
+            f" ({skipped} short of free dates). Nothing was saved."
         )
-        created += 1
-
-    conn.commit()
-    conn.close()
-
-    skipped = total_classes - created
-    if skipped > 0:
+    elif not created:
+        flash("No free dates available in the selected window for this candidate.")
+    elif skipped > 0:
         flash(
             f"Created {created} attendance records. {skipped} could not be scheduled because there were not enough free dates."
         )
     else:
         flash(f"Successfully created {created} attendance records.")
-
-    return redirect(
-        url_for("admin_bp.admin_user_detail", user_id=user_id, _anchor="backfill-tool")
+    current_app.logger.info(
+        "generate_attendance: %d rows for %d users in %.3fs (%.0f rows/s)%s",
+        created, result["users"], result["seconds"], result["rows_per_second"],
+        " [dry run]" if dry_run else "",
     )
+
+    if user_ids and len(user_ids) == 1:
+        return redirect(
+            url_for("admin_bp.admin_user_detail", user_id=user_ids[0], _anchor="backfill-tool")
+        )
+    return redirect(url_for("admin_bp.admin_dashboard"))
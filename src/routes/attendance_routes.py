@@ -1,6 +1,11 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, Response, current_app, render_template, request, jsonify
+from markupsafe import Markup
 from datetime import date, datetime
-from src.database import get_db_connection
+from src.database import get_db
+from src.models import attendance_model, live_event_model, version_model
+from src.services.event_bus import get_event_bus
+from src.services.image_service import image_url
+from src.services.render_cache import get_render_cache, render_fragment
 
 attendance_bp = Blueprint("attendance_bp", __name__)
 
@@ -8,7 +13,31 @@ attendance_bp = Blueprint("attendance_bp", __name__)
 @attendance_bp.route("/attendance")
 def attendance_page():
     today = date.today().isoformat()
-    conn = get_db_connection()
+    conn = get_db()
+    # Read before the query so the board's stream starts no later than its data
+    last_event_id = live_event_model.head(conn)
+    version = version_model.data_version(conn)
+    cards, total_students, active_sessions, completed_sessions = get_render_cache().fetch(
+        "attendance", (today, version), lambda: _render_board(conn, today)
+    )
+
+    return render_template(
+        "attendance.html",
+        cards=cards,
+        today=today,
+        page="attendance",
+        total_students=total_students,
+        active_sessions=active_sessions,
+        completed_sessions=completed_sessions,
+        last_event_id=last_event_id,
+    )
+
+
+def _render_board(conn, today):
+    """
+    Cards and counters for the board. Each card is cached under its own
+    values, so a write re-renders only the rows it changed.
+    """
     users = conn.execute(
         """
         SELECT u.id,
@@ -17,93 +46,190 @@ def attendance_page():
                u.image_path,
                todays.in_time   AS today_in,
                todays.out_time  AS today_out,
-               COALESCE(totals.total_classes, 0) AS total_classes
+               COALESCE(stats.total_classes, 0) AS total_classes
         FROM users u
         LEFT JOIN (
             SELECT user_id, in_time, out_time
             FROM attendance
             WHERE date = ?
         ) AS todays ON todays.user_id = u.id
-        LEFT JOIN (
-            SELECT user_id, COUNT(*) AS total_classes
-            FROM attendance
-            WHERE in_time IS NOT NULL
-            GROUP BY user_id
-        ) AS totals ON totals.user_id = u.id
+        LEFT JOIN user_stats stats ON stats.user_id = u.id
         ORDER BY u.name COLLATE NOCASE
         """,
         (today,),
     ).fetchall()
-    conn.close()
 
-    total_students = len(users)
+    cards = Markup("\n").join(
+        render_fragment(
+            "attendance_card", tuple(user), "partials/attendance_card.html",
+            user=user, image_url=image_url,
+        )
+        for user in users
+    )
     active_sessions = sum(1 for user in users if user["today_in"] and not user["today_out"])
     completed_sessions = sum(1 for user in users if user["today_out"])
+    return cards, len(users), active_sessions, completed_sessions
+
+
+def _parse_sync_event(raw):
+    """
+    Validate one kiosk event. Returns the dict mark_batch expects.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("Event must be an object")
+
+    key = raw.get("idempotency_key")
+    if not isinstance(key, str) or not key or len(key) > 128:
+        raise ValueError("idempotency_key must be a non-empty string")
+
+    action = raw.get("action")
+    if action not in ("in", "out"):
+        raise ValueError("action must be 'in' or 'out'")
+
+    user_id = raw.get("user_id")
+    if isinstance(user_id, str) and user_id.isdigit():
+        user_id = int(user_id)
+    if not isinstance(user_id, int) or isinstance(user_id, bool):
+        raise ValueError("user_id must be an integer")
+
+    try:
+        tapped = datetime.fromisoformat(str(raw.get("client_timestamp")))
+    except ValueError:
+        raise ValueError("client_timestamp must be an ISO 8601 datetime") from None
+
+    return {
+        "key": key,
+        "user_id": user_id,
+        "action": action,
+        "day": tapped.date().isoformat(),
+        "time": tapped.strftime("%H:%M:%S"),
+    }
+
+
+@attendance_bp.route("/attendance/sync", methods=["POST"])
+def sync_attendance():
+    """
+    Bulk check-in sync for kiosks. Takes {"events": [{user_id, action,
+    client_timestamp, idempotency_key}, ...]} in tap order and applies the
+    batch in one transaction. Replayed keys come back as "duplicate".
+    """
+    payload = request.get_json(silent=True)
+    raw_events = payload.get("events") if isinstance(payload, dict) else None
+    if not isinstance(raw_events, list):
+        return jsonify({"status": "error", "message": "Expected {\"events\": [...]}"}), 400
+    if len(raw_events) > current_app.config["SYNC_MAX_BATCH"]:
+        return jsonify({"status": "error", "message": "Batch too large"}), 413
+
+    results = [None] * len(raw_events)
+    events = []
+    positions = []
+    for index, raw in enumerate(raw_events):
+        try:
+            events.append(_parse_sync_event(raw))
+            positions.append(index)
+        except ValueError as exc:
+            key = raw.get("idempotency_key") if isinstance(raw, dict) else None
+            results[index] = {"idempotency_key": key, "status": "error", "message": str(exc)}
+
+    conn = get_db()
+    applied_results, totals, applied = attendance_model.mark_batch(conn, events)
+    for index, result in zip(positions, applied_results):
+        results[index] = result
 
-    return render_template(
-        "attendance.html",
-        users=users,
-        today=today,
-        page="attendance",
-        total_students=total_students,
-        active_sessions=active_sessions,
-        completed_sessions=completed_sessions,
+    today = date.today().isoformat()
+    todays = [event for event in applied if event["day"] == today]
+    if todays:
+        # Only today's sheet is live; backlog from earlier days is not pushed
+        active, completed = attendance_model.day_counters(conn, today)
+        get_event_bus().publish_all(
+            conn,
+            "attendance",
+            (
+                {
+                    "date": today,
+                    "user_id": event["user_id"],
+                    "in_time": event["in_time"],
+                    "out_time": event["out_time"],
+                    "total_classes": totals.get(event["user_id"], 0),
+                    "active": active,
+                    "completed": completed,
+                }
+                for event in todays
+            ),
+        )
+
+    return jsonify(
+        {
+            "status": "success",
+            "results": results,
+            "total_classes": {str(user_id): total for user_id, total in totals.items()},
+        }
+    )
+
+
+@attendance_bp.route("/attendance/stream")
+def attendance_stream():
+    """
+    Server-sent events for open attendance boards: one "attendance" event
+    per successful tap, carrying just that user's row and the day's counters.
+    """
+    bus = get_event_bus()
+    head = live_event_model.head(get_db())
+    try:
+        last_id = int(request.headers.get("Last-Event-ID") or request.args.get("last_id") or head)
+    except ValueError:
+        last_id = head
+    if last_id > head:
+        # Not an id from this database (recreated, or another branch's):
+        # replay what is kept, or reset the board if that is not enough
+        last_id = 0
+
+    if not bus.subscribe():
+        return Response("Too many live boards", status=503, headers={"Retry-After": "30"})
+
+    response = Response(
+        bus.stream(last_id, keepalive=current_app.config["EVENT_KEEPALIVE"]),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+    # The server closes every response it was handed, including one whose
+    # client left before the first chunk
+    response.call_on_close(bus.unsubscribe)
+    return response
 
 
 @attendance_bp.route("/attendance/mark", methods=["POST"])
 def mark_attendance():
-    user_id = request.form["user_id"]
-    action = request.form["action"]  # in / out
+    action = request.form.get("action")
+    if action not in ("in", "out"):
+        return jsonify({"status": "error", "message": "action must be 'in' or 'out'"}), 400
+    try:
+        user_id = int(request.form.get("user_id", ""))
+    except ValueError:
+        return jsonify({"status": "error", "message": "user_id must be an integer"}), 400
 
     today = date.today().isoformat()
     now_time = datetime.now().strftime("%H:%M:%S")
 
-    conn = get_db_connection()
-    record = conn.execute(
-        "SELECT * FROM attendance WHERE user_id=? AND date=?",
-        (user_id, today)
-    ).fetchone()
-
-    if not record:
-        if action == "in":
-            conn.execute(
-                "INSERT INTO attendance (user_id, date, in_time) VALUES (?, ?, ?)",
-                (user_id, today, now_time)
-            )
-        else:
-            conn.execute(
-                "INSERT INTO attendance (user_id, date, out_time) VALUES (?, ?, ?)",
-                (user_id, today, now_time)
-            )
-    else:
-        if action == "in" and record["in_time"] is None:
-            conn.execute(
-                "UPDATE attendance SET in_time=? WHERE id=?",
-                (now_time, record["id"])
-            )
-        elif action == "out" and record["out_time"] is None:
-            conn.execute(
-                "UPDATE attendance SET out_time=? WHERE id=?",
-                (now_time, record["id"])
-            )
-        else:
-            conn.close()
-            return jsonify({"status": "error", "message": "Already marked"})
-
-    conn.commit()
-
-    updated_record = conn.execute(
-        "SELECT in_time, out_time FROM attendance WHERE user_id=? AND date=?",
-        (user_id, today),
-    ).fetchone()
-
-    total_classes = conn.execute(
-        "SELECT COUNT(*) FROM attendance WHERE user_id=? AND in_time IS NOT NULL",
-        (user_id,),
-    ).fetchone()[0]
-
-    conn.close()
+    conn = get_db()
+    record, total_classes = attendance_model.mark(conn, user_id, action, today, now_time)
+    if record is None:
+        return jsonify({"status": "error", "message": "Already marked"})
+
+    active, completed = attendance_model.day_counters(conn, today)
+    get_event_bus().publish(
+        conn,
+        "attendance",
+        {
+            "date": today,
+            "user_id": user_id,
+            "in_time": record["in_time"],
+            "out_time": record["out_time"],
+            "total_classes": total_classes,
+            "active": active,
+            "completed": completed,
+        },
+    )
 
     action_message = "Start time captured" if action == "in" else "End time captured"
 
@@ -112,8 +238,8 @@ def mark_attendance():
             "status": "success",
             "message": action_message,
             "record": {
-                "in_time": updated_record["in_time"] if updated_record else None,
-                "out_time": updated_record["out_time"] if updated_record else None,
+                "in_time": record["in_time"],
+                "out_time": record["out_time"],
             },
             "total_classes": total_classes,
         }
@@ -1,45 +1,77 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
-from src.database import get_db_connection
-from src.services.image_service import resize_and_compress
-from src.config import Config
-import os
+import sqlite3
 
-user_bp = Blueprint("user_bp", __name__)
-
-def _absolute_image_path(stored_path: str | None) -> str | None:
-    if not stored_path:
-        return None
-
-    normalized = str(stored_path).replace("\\", "/")
-
-    if normalized.startswith("http://") or normalized.startswith("https://"):
-        return None
-
-    if os.path.isabs(normalized):
-        return normalized
-
-    normalized = normalized.lstrip("/")
-    if normalized.startswith("static/"):
-        normalized = normalized.split("static/", 1)[1]
-
-    return os.path.join(Config.STATIC_FOLDER, normalized)
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, current_app, jsonify
+from src import shards
+from src.database import get_db
+from src.models import archive_model, user_model, version_model
+from src.services.image_service import image_url, remove_image
+from src.services.biometric_service import forget_fingerprint_template
 
+user_bp = Blueprint("user_bp", __name__)
 
-def _cleanup_image(path: str | None) -> None:
-    absolute_path = _absolute_image_path(path)
-    if absolute_path and os.path.exists(absolute_path):
-        try:
-            os.remove(absolute_path)
-        except OSError:
-            pass
+def page_args():
+    """
+    Read q/after/before/limit from the query string.
+    """
+    limit = request.args.get("limit", current_app.config["PAGE_SIZE"], type=int)
+    return dict(
+        search=request.args.get("q", "").strip(),
+        after=request.args.get("after") or None,
+        before=request.args.get("before") or None,
+        limit=max(1, min(limit or 1, current_app.config["PAGE_SIZE_MAX"])),
+    )
+
+
+def page_users(conn, args, with_totals=False):
+    """
+    Page for an HTML listing. A stale or hand-edited cursor falls back to
+    the first page instead of failing the request.
+    """
+    try:
+        return user_model.page_users(conn, with_totals=with_totals, **args)
+    except ValueError:
+        args.update(after=None, before=None)
+        return user_model.page_users(conn, with_totals=with_totals, **args)
 
 
 @user_bp.route("/")
 def list_users():
-    conn = get_db_connection()
-    users = conn.execute("SELECT * FROM users").fetchall()
-    conn.close()
-    return render_template("users.html", users=users, page="users")
+    args = page_args()
+    users, next_cursor, prev_cursor = page_users(get_db(), args)
+    return render_template(
+        "users.html",
+        users=users,
+        search=args["search"],
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+        page="users",
+    )
+
+
+@user_bp.route("/api/users")
+def users_api():
+    try:
+        users, next_cursor, prev_cursor = user_model.page_users(get_db(), with_totals=True, **page_args())
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    return jsonify(
+        {
+            "users": [
+                {
+                    "id": user["id"],
+                    "name": user["name"],
+                    "phone": user["phone"],
+                    "created_at": user["created_at"],
+                    "total_classes": user["total_classes"],
+                    "image_url": image_url(user["image_path"], 112),
+                }
+                for user in users
+            ],
+            "next": next_cursor,
+            "prev": prev_cursor,
+        }
+    )
 
 
 @user_bp.route("/users")
@@ -54,17 +86,22 @@ def add_user():
         phone = request.form["phone"]
         image_file = request.files["image"]
 
-        saved_image_path = resize_and_compress(image_file)
+        job_queue = current_app.extensions["image_queue"]
+        if not job_queue.has_capacity():
+            return _queue_full("add_user.html", page="add-user")
 
-        conn = get_db_connection()
-        conn.execute(
-            "INSERT INTO users (name, phone, image_path) VALUES (?, ?, ?)",
-            (name, phone, saved_image_path)
+        spool_name = job_queue.spool(image_file)
+
+        conn = get_db()
+        cursor = conn.execute(
+            "INSERT INTO users (name, phone, image_path, pending_image) VALUES (?, ?, '', ?)",
+            (name, phone, spool_name)
         )
+        version_model.bump_data_version(conn)
         conn.commit()
-        conn.close()
+        job_queue.submit(cursor.lastrowid, spool_name)
 
-        flash("User added successfully!")
+        flash("User added successfully! The photo will appear once it has been processed.")
         return redirect(url_for("user_bp.list_users"))
 
     return render_template("add_user.html", page="add-user")
@@ -72,11 +109,10 @@ def add_user():
 
 @user_bp.route("/users/<int:user_id>/edit", methods=["GET", "POST"])
 def edit_user(user_id):
-    conn = get_db_connection()
-    user = conn.execute("SELECT * FROM users WHERE id=?", (user_id,)).fetchone()
+    conn = get_db()
+    user = conn.execute(f"SELECT {user_model.PROFILE_COLUMNS} FROM users WHERE id=?", (user_id,)).fetchone()
 
     if not user:
-        conn.close()
         abort(404)
 
     if request.method == "POST":
@@ -84,41 +120,58 @@ def edit_user(user_id):
         phone = request.form["phone"]
         image_file = request.files.get("image")
 
-        image_path = user["image_path"]
+        job_queue = current_app.extensions["image_queue"]
+        spool_name = user["pending_image"]
         if image_file and image_file.filename:
-            new_path = resize_and_compress(image_file)
-            _cleanup_image(image_path)
-            image_path = new_path
+            if not job_queue.has_capacity():
+                return _queue_full("edit_user.html", user=user, page="users")
+            spool_name = job_queue.spool(image_file)
 
         conn.execute(
-            "UPDATE users SET name=?, phone=?, image_path=? WHERE id=?",
-            (name, phone, image_path, user_id)
+            "UPDATE users SET name=?, phone=?, pending_image=? WHERE id=?",
+            (name, phone, spool_name, user_id)
         )
+        version_model.bump_data_version(conn)
         conn.commit()
-        conn.close()
+        if spool_name != user["pending_image"]:
+            job_queue.submit(user_id, spool_name)
 
         flash("Candidate updated successfully!")
         return redirect(url_for("user_bp.list_users"))
 
-    conn.close()
     return render_template("edit_user.html", user=user, page="users")
 
 
+def _queue_full(template, **context):
+    current_app.extensions["image_queue"].rejected()
+    flash("Photo processing is busy right now. Please try again in a moment.")
+    return render_template(template, **context), 503
+
+
 @user_bp.route("/users/<int:user_id>/delete", methods=["POST"])
 def delete_user(user_id):
-    conn = get_db_connection()
-    user = conn.execute("SELECT * FROM users WHERE id=?", (user_id,)).fetchone()
+    conn = get_db()
+    user = conn.execute(f"SELECT {user_model.PROFILE_COLUMNS} FROM users WHERE id=?", (user_id,)).fetchone()
 
     if not user:
-        conn.close()
         abort(404)
 
+    # Archived years first: if one fails, the candidate is still here to
+    # retry the delete, and years already cleared stay cleared
+    try:
+        archive_model.delete_user(conn, shards.archive_folder(), user_id)
+    except sqlite3.Error:
+        current_app.logger.exception("Removing archived attendance of user %s failed", user_id)
+        flash("Could not remove the candidate's archived attendance. Nothing else was deleted; please try again.")
+        return redirect(url_for("user_bp.list_users"))
+
     conn.execute("DELETE FROM attendance WHERE user_id=?", (user_id,))
     conn.execute("DELETE FROM users WHERE id=?", (user_id,))
+    version_model.bump_data_version(conn)
     conn.commit()
-    conn.close()
 
-    _cleanup_image(user["image_path"])
+    remove_image(user["image_path"])
+    forget_fingerprint_template(user_id)
 
     flash("Candidate deleted.")
     return redirect(url_for("user_bp.list_users"))
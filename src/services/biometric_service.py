@@ -1,48 +1,192 @@
+import threading
+
+import click
+from flask.cli import with_appcontext
+
+from src import shards
+from src.config import Config
 from src.database import get_db_connection
+from src.services.parallel_matcher import ParallelMatcher
+from src.services.template_index import TemplateIndex
+from src.services.template_store import TemplateStore
+
+
+# Per branch (None for the unsharded database): user ids are only
+# unique within one branch's shard
+_indexes = {}
+_index_lock = threading.Lock()
+# (store generation, log position) each resident index has applied
+_applied = {}
+
+_stores = {}
+
+# Compact once tombstones and superseded records outnumber live ones
+_COMPACT_MIN_DEAD = 1024
+
+
+def get_template_store():
+    """
+    The active branch's template store.
+    """
+    shard = shards.current()
+    key = shard.name if shard else None
+    store = _stores.get(key)
+    if store is None:
+        with _index_lock:
+            store = _stores.get(key)
+            if store is None:
+                path = shard.fingerprint_store if shard else Config.FINGERPRINT_STORE_PATH
+                store = _stores[key] = TemplateStore(path, Config.FINGERPRINT_RECORD_BYTES)
+    return store
+
+
+def _build_index(store):
+    # --- PLACEHOLDER FOR SDK MATCH FUNCTION ---
+    # The vendor SDK usually provides something like:
+    # score = SDK.MatchTemplates(stored_template, incoming_template)
+    # Wrap it in an object with __call__, feature() and max_feature_gap()
+    # (see template_index.BitSimilarityScorer) and set FINGERPRINT_SCORER.
+    if Config.FINGERPRINT_SCORER is not None and Config.FINGERPRINT_WORKERS:
+        return ParallelMatcher(
+            store,
+            scorer=Config.FINGERPRINT_SCORER,
+            threshold=Config.FINGERPRINT_MATCH_THRESHOLD,
+            workers=Config.FINGERPRINT_WORKERS,
+            deadline_ms=Config.FINGERPRINT_DEADLINE_MS,
+        )
+    return TemplateIndex(
+        scorer=Config.FINGERPRINT_SCORER,
+        threshold=Config.FINGERPRINT_MATCH_THRESHOLD,
+        batch_size=Config.FINGERPRINT_BATCH_SIZE,
+    )
+
+
+def _legacy_templates(store):
+    # Templates still in users.fingerprint_template, until
+    # move-fingerprint-templates has run
+    conn = get_db_connection()
+    rows = conn.execute(
+        "SELECT id, fingerprint_template FROM users WHERE fingerprint_template IS NOT NULL"
+    ).fetchall()
+    conn.close()
+    stored = {user_id for user_id, _ in store.items()}
+    return [(row["id"], row["fingerprint_template"]) for row in rows if row["id"] not in stored]
+
+
+def get_template_index():
+    """
+    Return the active branch's resident template index, loading it from
+    the template store on first use and catching up with appends made
+    since, by this or any other process.
+    """
+    store = get_template_store()
+    key = shards.current_name()
+    with _index_lock:
+        index = _indexes.get(key)
+        applied_generation, applied_end = _applied.get(key, (None, 0))
+        generation, end = store.position()
+        changes = []
+        if index is not None and applied_generation == generation:
+            changes = store.changes(generation, applied_end, end)
+
+        if changes is None or index is None or applied_generation != generation:
+            index = index or _build_index(store)
+            # Templates are memoryviews into the store's mapping, not
+            # copies; the parallel matcher's workers map the store too. Replaying a few records twice after a racing append
+            # is harmless: the log's last record per user still wins.
+            index.load(store.items() + _legacy_templates(store))
+            _indexes[key] = index
+        elif changes:
+            index.apply(changes)
+        _applied[key] = (generation, end)
+    return index
+
+
+def reset_template_index():
+    with _index_lock:
+        for index in _indexes.values():
+            if isinstance(index, ParallelMatcher):
+                index.close()
+        _indexes.clear()
+        _applied.clear()
 
 
 def store_fingerprint_template(user_id, template_bytes):
     """
     Store fingerprint template for a user.
     """
+    get_template_store().put(user_id, template_bytes)
+
     conn = get_db_connection()
     conn.execute(
-        "UPDATE users SET fingerprint_template=? WHERE id=?",
-        (template_bytes, user_id)
+        "UPDATE users SET fingerprint_template=NULL, fingerprint_updated_at=CURRENT_TIMESTAMP WHERE id=?",
+        (user_id,)
     )
     conn.commit()
     conn.close()
 
+    if shards.current_name() in _indexes:
+        get_template_index()
+
+
+def forget_fingerprint_template(user_id):
+    """
+    Drop a deleted user's template from the store and the resident index.
+    """
+    store = get_template_store()
+    if store.delete(user_id):
+        stats = store.stats()
+        if stats["dead"] >= max(stats["live"], _COMPACT_MIN_DEAD):
+            store.compact()
+    if shards.current_name() in _indexes:
+        get_template_index()
+
 
 def match_fingerprint(template_bytes):
     """
     Match incoming fingerprint template against stored templates.
     Returns matched user_id or None.
-    
+
     NOTE:
     Actual fingerprint matching is done by the MFS110 SDK.
-    Here we simply compare templates using SDK-provided match function.
+    Without a configured scorer, templates must match exactly.
     """
+    user_id, _ = get_template_index().match(template_bytes)
+    return user_id
+
+
+def init_app(app):
+    app.cli.add_command(move_fingerprint_templates_command)
+    app.cli.add_command(compact_templates_command)
 
-    # --- PLACEHOLDER FOR SDK MATCH FUNCTION ---
-    # The vendor SDK usually provides something like:
-    # score = SDK.MatchTemplates(stored_template, incoming_template)
 
+@click.command("move-fingerprint-templates")
+@with_appcontext
+@shards.branch_option
+def move_fingerprint_templates_command():
+    """Move templates from the users table into the template store."""
+    store = get_template_store()
     conn = get_db_connection()
-    users = conn.execute(
-        "SELECT id, fingerprint_template FROM users"
+    rows = conn.execute(
+        "SELECT id, fingerprint_template FROM users WHERE fingerprint_template IS NOT NULL"
     ).fetchall()
-    conn.close()
-
-    for user in users:
-        stored_template = user["fingerprint_template"]
+    templates = [(row["id"], row["fingerprint_template"]) for row in rows if row["fingerprint_template"]]
+    store.put_many(templates)
+    moved = len(templates)
 
-        # Placeholder comparison
-        if stored_template == template_bytes:
-            return user["id"]
+    # Cleared only once the store has the templates on disk
+    conn.executemany(
+        "UPDATE users SET fingerprint_template=NULL WHERE id=?", [(row["id"],) for row in rows]
+    )
+    conn.commit()
+    conn.close()
+    click.echo(f"Moved {moved} fingerprint templates to {store.path}.")
 
-        # In real integration:
-        # if SDK.match(stored_template, template_bytes) >= threshold:
-        #     return user["id"]
 
-    return None
+@click.command("compact-templates")
+@with_appcontext
+@shards.branch_option
+def compact_templates_command():
+    """Rewrite the template store without deleted or replaced records."""
+    dropped = get_template_store().compact()
+    click.echo(f"Dropped {dropped} dead records.")
@@ -0,0 +1,66 @@
+"""
+Summary across every branch's shard, for the admin.
+
+The same summary queries run against all shards at once, one connection
+and thread per shard (sqlite3 lets go of the GIL while a statement runs,
+and the shards are separate files), and the results are merged: branch
+totals side by side and added up, daily occupancy summed by date. A
+shard's reporting replica is read instead when it is fresh enough.
+"""
+import concurrent.futures
+
+from src.database import get_db_connection
+from src.models import attendance_model, rollup_model
+from src.services import replica
+
+
+_TOTALS = ("candidates", "total_classes", "active_today", "completed_today")
+
+
+def branch_totals(conn, today, start, end):
+    """
+    One database's summary: candidates, classes, today's sessions and
+    daily_rollup sums for [start, end].
+    """
+    candidates = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    total_classes = conn.execute("SELECT COALESCE(SUM(total_classes), 0) FROM user_stats").fetchone()[0]
+    active, completed = attendance_model.day_counters(conn, today)
+    return {
+        "candidates": candidates,
+        "total_classes": total_classes,
+        "active_today": active,
+        "completed_today": completed,
+        "days": rollup_model.daily_totals(conn, start, end),
+    }
+
+
+def _query_shard(shard, today, start, end, max_staleness):
+    conn, _ = replica.open_fresh_replica(shard.database, max_staleness)
+    if conn is None:
+        conn = get_db_connection(shard.database)
+    try:
+        return branch_totals(conn, today, start, end)
+    finally:
+        conn.close()
+
+
+def summarize(branches, today, start, end, workers=8, max_staleness=None):
+    """
+    Fan branch_totals out over the branches' shards (or their replicas
+    within max_staleness seconds) and merge the results. Returns {"branches": [...], "totals": {...}, "days": [...]}.
+    """
+    results = []
+    if branches:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(branches))) as pool:
+            futures = [pool.submit(_query_shard, shard, today, start, end, max_staleness) for shard in branches]
+            results = [future.result() for future in futures]
+
+    totals = dict.fromkeys(_TOTALS, 0)
+    rows = []
+    for shard, result in zip(branches, results):
+        for name in _TOTALS:
+            totals[name] += result[name]
+        rows.append({"branch": shard.name, **{name: result[name] for name in _TOTALS}})
+
+    days = rollup_model.merge_daily_totals(result["days"] for result in results)
+    return {"branches": rows, "totals": totals, "days": rollup_model.daily_points(days)}
@@ -0,0 +1,461 @@
+"""
+Bulk enrollment from a CSV of candidates plus a ZIP of their photos.
+
+The CSV needs name and phone columns and may name each photo in a photo
+column; otherwise the ZIP member named after the phone number is used
+(9876543210.jpg). Both files are kept under IMPORT_FOLDER/<job id> (the
+branch's imports folder for a branch) and
+the ZIP is never extracted: a process pool reads each member straight
+from the archive and runs resize_and_compress on it.
+
+Results are committed in CSV order, IMPORT_CHUNK_ROWS at a time, and each
+chunk's transaction also advances import_jobs.next_row. A job that stops
+part way (crash, restart, deploy) resumes from that row without creating
+any candidate twice. Rows that cannot be imported are recorded in
+import_errors with their line number.
+"""
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+import zipfile
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+from werkzeug.datastructures import FileStorage
+
+from src import shards
+from src.config import Config
+from src.database import get_db_connection
+from src.models import version_model
+from src.services.image_service import allowed_file, remove_image, resize_and_compress
+
+
+logger = logging.getLogger(__name__)
+
+CSV_NAME = "candidates.csv"
+ZIP_NAME = "photos.zip"
+
+# Photos larger than this once decompressed are rejected rather than decoded
+_MAX_PHOTO_BYTES = 25 * 1024 * 1024
+_IMAGE_SETTINGS = (
+    "DATABASE_PATH", "UPLOAD_FOLDER", "IMAGE_PROFILE", "IMAGE_SIZE", "IMAGE_QUALITY", "IMAGE_RENDITIONS",
+)
+
+# A job whose heartbeat is older than this is taken to have died
+_STALE_SECONDS = 300
+
+
+class RowError(ValueError):
+    """A CSV row that cannot be imported; the message goes to import_errors."""
+
+
+# --- worker process state ---------------------------------------------------
+
+_archives = {}
+
+
+def _image_settings():
+    # The app's values where there is one, else the defaults
+    if has_app_context():
+        return {name: current_app.config[name] for name in _IMAGE_SETTINGS}
+    return {name: getattr(Config, name) for name in _IMAGE_SETTINGS}
+
+
+def _worker_init(settings, shard):
+    # Spawned workers start from the class defaults
+    for name, value in settings.items():
+        setattr(Config, name, value)
+    shards.serve_only(shard)
+
+
+def _process_photo(zip_path, member):
+    archive = _archives.get(zip_path)
+    if archive is None:
+        archive = _archives[zip_path] = zipfile.ZipFile(zip_path)
+    data = archive.read(member)
+    return resize_and_compress(FileStorage(stream=io.BytesIO(data), filename=member))
+
+
+# --- parent process -----------------------------------------------------------
+
+def _read_rows(csv_path):
+    """
+    Yield (line number, row dict) for each data row, streaming the file.
+    """
+    with open(csv_path, newline="", encoding="utf-8-sig") as handle:
+        reader = csv.DictReader(handle)
+        fields = {name.strip().lower() for name in reader.fieldnames or ()}
+        if not {"name", "phone"} <= fields:
+            raise ValueError("The CSV needs a header row with name and phone columns.")
+        for row in reader:
+            yield reader.line_num, {
+                (key or "").strip().lower(): (value or "").strip() for key, value in row.items()
+                if key is not None  # surplus cells on a ragged row
+            }
+
+
+def _base_name(path):
+    return os.path.basename(path.replace("\\", "/")).lower()
+
+
+def _photo_index(archive):
+    """
+    Map lower-cased base names to ZIP members, from the central directory.
+    """
+    index = {}
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        base = _base_name(info.filename)
+        if base and not base.startswith("."):
+            index[base] = info
+    return index
+
+
+def _find_photo(index, row):
+    wanted = row.get("photo")
+    names = [wanted] if wanted else [f"{row['phone']}.{ext}" for ext in ("jpg", "jpeg", "png")]
+    info = next((index[name] for name in map(_base_name, names) if name in index), None)
+    if info is None:
+        raise RowError(f"No photo {names[0]} in the ZIP")
+    if not allowed_file(info.filename):
+        raise RowError(f"{info.filename}: only PNG, JPG and JPEG photos are allowed")
+    if info.file_size > _MAX_PHOTO_BYTES:
+        raise RowError(f"{info.filename} is too large")
+    return info.filename
+
+
+def create_job(conn, job_folder, csv_file, zip_file):
+    """
+    Store the uploaded files for a new job and return its id. Raises
+    ValueError for a CSV or ZIP that cannot be read at all.
+
+    The files are saved and counted under a temporary name before the job
+    row is written, so the write transaction lasts only for the INSERT
+    however large the upload; the folder then takes the job's id.
+    """
+    directory = os.path.join(job_folder, f"new-{uuid.uuid4().hex}")
+    os.makedirs(directory)
+    try:
+        csv_file.save(os.path.join(directory, CSV_NAME))
+        zip_file.save(os.path.join(directory, ZIP_NAME))
+        total = sum(1 for _ in _read_rows(os.path.join(directory, CSV_NAME)))
+        if not zipfile.is_zipfile(os.path.join(directory, ZIP_NAME)):
+            raise ValueError("The photos file is not a ZIP archive.")
+    except (ValueError, UnicodeDecodeError, csv.Error) as exc:
+        _remove_job_files(directory)
+        raise ValueError(str(exc)) from None
+    except BaseException:
+        _remove_job_files(directory)
+        raise
+
+    try:
+        job_id = conn.execute(
+            "INSERT INTO import_jobs (status, total_rows) VALUES ('queued', ?)", (total,)
+        ).lastrowid
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        _remove_job_files(directory)
+        raise
+
+    try:
+        os.rename(directory, os.path.join(job_folder, str(job_id)))
+    except OSError:
+        # Nothing can run the job without its files
+        conn.execute("DELETE FROM import_jobs WHERE id = ?", (job_id,))
+        conn.commit()
+        _remove_job_files(directory)
+        raise
+    return job_id
+
+
+def _remove_job_files(directory):
+    for name in (CSV_NAME, ZIP_NAME):
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+    try:
+        os.rmdir(directory)
+    except OSError:
+        pass
+
+
+def claim_job(conn, job_id):
+    """
+    Mark a job as running unless a live process already is. Returns False
+    if the job is finished or still being worked on elsewhere.
+    """
+    claimed = conn.execute(
+        """
+        UPDATE import_jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+          AND (status IN ('queued', 'interrupted')
+               OR (status = 'running' AND updated_at < datetime('now', ?)))
+        """,
+        (job_id, f"-{_STALE_SECONDS} seconds"),
+    ).rowcount
+    conn.commit()
+    return bool(claimed)
+
+
+def _commit_chunk(conn, job_id, chunk, next_row):
+    imported = failed = 0
+    orphans = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for line, row, image_path, error in chunk:
+            if error is None:
+                # Phones identify candidates at the desk; skip repeats,
+                # including repeats within the same file
+                inserted = conn.execute(
+                    """
+                    INSERT INTO users (name, phone, image_path)
+                    SELECT ?, ?, ?
+                    WHERE NOT EXISTS (SELECT 1 FROM users WHERE phone = ?)
+                    """,
+                    (row["name"], row["phone"], image_path, row["phone"]),
+                ).rowcount
+                if inserted:
+                    imported += 1
+                    continue
+                error = f"Phone {row['phone']} is already registered"
+                orphans.append(image_path)
+            failed += 1
+            conn.execute(
+                "INSERT INTO import_errors (job_id, line, message) VALUES (?, ?, ?)",
+                (job_id, line, error),
+            )
+        conn.execute(
+            """
+            UPDATE import_jobs SET next_row = ?, imported = imported + ?, failed = failed + ?,
+                                   updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            (next_row, imported, failed, job_id),
+        )
+        if imported:
+            version_model.bump_data_version(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    for image_path in orphans:
+        remove_image(image_path)
+    return imported, failed
+
+
+def run_job(database, job_folder, job_id, workers=None, chunk_rows=200, progress=None):
+    """
+    Import a claimed job from its next_row to the end. Returns the final
+    (imported, failed) totals.
+    """
+    directory = os.path.join(job_folder, str(job_id))
+    zip_path = os.path.join(directory, ZIP_NAME)
+    workers = workers or os.cpu_count() or 1
+
+    conn = get_db_connection(database)
+    try:
+        start = conn.execute("SELECT next_row FROM import_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_worker_init,
+            initargs=(_image_settings(), shards.current()),
+        )
+        with pool, zipfile.ZipFile(zip_path) as archive:
+            index = _photo_index(archive)
+            # Results are taken in CSV order, so a few photos per worker
+            # in flight keeps every worker busy without buffering the file
+            window = collections.deque()
+            chunk = []
+
+            def take_oldest():
+                line, row, outcome = window.popleft()
+                image_path, error = None, outcome
+                if isinstance(outcome, concurrent.futures.Future):
+                    try:
+                        image_path, error = outcome.result(), None
+                    except concurrent.futures.process.BrokenProcessPool:
+                        # Not the photo's fault; stop so the row is retried on resume
+                        raise
+                    except Exception as exc:
+                        error = f"Could not process photo: {exc}"
+                chunk.append((line, row, image_path, error))
+                if len(chunk) >= chunk_rows:
+                    flush(line + 1)
+
+            def flush(next_row):
+                _commit_chunk(conn, job_id, chunk, next_row)
+                chunk.clear()
+                if progress is not None:
+                    progress(*conn.execute(
+                        "SELECT imported, failed FROM import_jobs WHERE id = ?", (job_id,)
+                    ).fetchone())
+
+            for line, row in _read_rows(os.path.join(directory, CSV_NAME)):
+                if line < start:
+                    continue
+                try:
+                    if not row.get("name") or not row.get("phone"):
+                        raise RowError("Name and phone are required")
+                    outcome = pool.submit(_process_photo, zip_path, _find_photo(index, row))
+                except RowError as exc:
+                    outcome = str(exc)
+                window.append((line, row, outcome))
+                if len(window) >= workers * 4:
+                    take_oldest()
+
+            last_line = window[-1][0] if window else None
+            while window:
+                take_oldest()
+            if chunk:
+                flush(last_line + 1)
+
+        conn.execute(
+            "UPDATE import_jobs SET status = 'done', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (job_id,),
+        )
+        conn.commit()
+        _remove_job_files(directory)
+        return conn.execute(
+            "SELECT imported, failed FROM import_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    except BaseException:
+        conn.rollback()
+        conn.execute(
+            "UPDATE import_jobs SET status = 'interrupted', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (job_id,),
+        )
+        conn.commit()
+        raise
+    finally:
+        conn.close()
+
+
+def job_status(conn, job_id, error_limit=200):
+    job = conn.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+    if job is None:
+        return None
+    errors = conn.execute(
+        "SELECT line, message FROM import_errors WHERE job_id = ? ORDER BY line LIMIT ?",
+        (job_id, error_limit),
+    ).fetchall()
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "total_rows": job["total_rows"],
+        "processed": job["imported"] + job["failed"],
+        "imported": job["imported"],
+        "failed": job["failed"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "errors": [{"line": row["line"], "message": row["message"]} for row in errors],
+    }
+
+
+class ImportRunner:
+    """
+    Runs claimed jobs on background threads of the web process. Job ids,
+    like candidates, belong to the active branch.
+    """
+
+    def __init__(self, database, job_folder, workers=None, chunk_rows=200, app=None):
+        self.app = app
+        self._database = database
+        self._job_folder = job_folder
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+
+    @property
+    def database(self):
+        shard = shards.current()
+        return shard.database if shard else self._database
+
+    @property
+    def job_folder(self):
+        shard = shards.current()
+        return shard.import_folder if shard else self._job_folder
+
+    def start(self, job_id):
+        conn = get_db_connection(self.database)
+        claimed = claim_job(conn, job_id)
+        conn.close()
+        if not claimed:
+            return False
+        thread = threading.Thread(
+            target=self._run, args=(job_id, shards.current()), name=f"import-{job_id}", daemon=True
+        )
+        thread.start()
+        return True
+
+    def _run(self, job_id, shard):
+        # The job thread has no app context of its own
+        app_context = self.app.app_context() if self.app is not None else contextlib.nullcontext()
+        with app_context, shards.activate(shard):
+            try:
+                run_job(self.database, self.job_folder, job_id, self.workers, self.chunk_rows)
+            except Exception:
+                logger.exception("Import job %s stopped", job_id)
+
+
+def get_import_runner():
+    return current_app.extensions["bulk_import"]
+
+
+def init_app(app):
+    app.extensions["bulk_import"] = ImportRunner(
+        app.config["DATABASE_PATH"],
+        app.config["IMPORT_FOLDER"],
+        workers=app.config["IMPORT_WORKERS"] or None,
+        chunk_rows=app.config["IMPORT_CHUNK_ROWS"],
+        app=app,
+    )
+    app.cli.add_command(import_candidates_command)
+
+
+@click.command("import-candidates")
+@click.option("--csv", "csv_path", type=click.Path(exists=True, dir_okay=False), help="CSV with name, phone[, photo].")
+@click.option("--zip", "zip_path", type=click.Path(exists=True, dir_okay=False), help="ZIP of photos.")
+@click.option("--resume", "resume_id", type=int, default=None, help="Continue an interrupted job instead.")
+@with_appcontext
+@shards.branch_option
+def import_candidates_command(csv_path, zip_path, resume_id):
+    """Enroll candidates in bulk from a CSV and a ZIP of photos."""
+    runner = get_import_runner()
+    conn = get_db_connection(runner.database)
+    if resume_id is None:
+        if not (csv_path and zip_path):
+            raise click.UsageError("Pass --csv and --zip, or --resume JOB_ID.")
+        with open(csv_path, "rb") as csv_handle, open(zip_path, "rb") as zip_handle:
+            try:
+                job_id = create_job(
+                    conn, runner.job_folder,
+                    FileStorage(csv_handle, filename=CSV_NAME), FileStorage(zip_handle, filename=ZIP_NAME),
+                )
+            except ValueError as exc:
+                raise click.UsageError(str(exc))
+    else:
+        job_id = resume_id
+    if not claim_job(conn, job_id):
+        raise click.UsageError(f"Import {job_id} is finished or running elsewhere.")
+    total = conn.execute("SELECT total_rows FROM import_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    conn.close()
+
+    def progress(imported, failed):
+        click.echo(f"  import {job_id}: {imported + failed}/{total} rows")
+
+    imported, failed = run_job(
+        runner.database, runner.job_folder, job_id, runner.workers, runner.chunk_rows, progress
+    )
+    click.echo(f"Import {job_id}: {imported} candidates added, {failed} rows rejected.")
@@ -0,0 +1,270 @@
+"""
+Publish/subscribe for live attendance boards, across server processes.
+
+Publishing appends to the live_events table (models/live_event_model.py),
+whose ids are the same in every process. Each process that has boards
+open runs one poller thread per database, which copies new rows into a
+bounded in-memory ring of pre-encoded events and wakes the boards; a
+publish also wakes its own process's poller at once. So a tap reaches
+every board, whichever process handled it and whichever holds the board,
+and polling costs one indexed query per process per EVENT_POLL_INTERVAL
+however many boards are connected.
+
+Each subscriber remembers the last id it sent and waits on a shared
+condition; a reconnecting EventSource resumes from Last-Event-ID. A
+subscriber that falls further behind than the ring gets a "reset" event
+and reloads the page. Idle subscribers hold no database connection and no
+CPU, only a blocked wait.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+
+from flask import current_app
+
+from src import shards
+from src.database import get_db_connection
+from src.models import live_event_model
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventBus:
+    def __init__(self, database, buffer_size=1024, max_subscribers=500, poll_interval=0.25):
+        self.database = database
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.poll_interval = poll_interval
+
+        self._events = collections.deque(maxlen=buffer_size)
+        self._last_id = 0
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._closed = False
+        self._poller_pid = None
+        # Shared by every branch's bus in the process; see limit_boards()
+        self.process_slots = None
+
+        self._subscribers = 0
+        self._stats = {
+            "published": 0,
+            "polled": 0,
+            "delivered": 0,
+            "resets": 0,
+            "rejected": 0,
+            "peak_subscribers": 0,
+        }
+
+    @property
+    def last_id(self):
+        """
+        Newest event this process has picked up; live_event_model.head()
+        is the newest in the database.
+        """
+        with self._cond:
+            return self._last_id
+
+    def publish(self, conn, event, data):
+        return self.publish_all(conn, event, [data])
+
+    def publish_all(self, conn, event, payloads):
+        """
+        Append the events for every process's boards, in one transaction
+        on conn, and wake this process's poller. Returns the last id.
+        """
+        payloads = list(payloads)
+        if not payloads:
+            return None
+        last_id = live_event_model.append(conn, event, payloads, keep=self.buffer_size)
+        with self._cond:
+            self._stats["published"] += len(payloads)
+        self._wake.set()
+        return last_id
+
+    def subscribe(self):
+        """
+        Reserve a subscriber slot. Returns False when the bus is full;
+        otherwise the caller must unsubscribe() once, however the stream ends.
+        """
+        with self._cond:
+            if (
+                self._closed
+                or self._subscribers >= self.max_subscribers
+                or (self.process_slots is not None and not self.process_slots.acquire(blocking=False))
+            ):
+                self._stats["rejected"] += 1
+                return False
+            self._subscribers += 1
+            if self._subscribers > self._stats["peak_subscribers"]:
+                self._stats["peak_subscribers"] = self._subscribers
+            self._start_poller()
+            self._cond.notify_all()
+            return True
+
+    def unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+            if self.process_slots is not None:
+                self.process_slots.release()
+
+    def _start_poller(self):
+        # Caller holds self._cond. Once per process: a bus built before a
+        # fork has no poller thread in the child.
+        if self._poller_pid == os.getpid():
+            return
+        self._poller_pid = os.getpid()
+        thread = threading.Thread(target=self._poll_loop, name="live-events", daemon=True)
+        thread.start()
+
+    def _poll_loop(self):
+        conn = None
+        try:
+            while True:
+                with self._cond:
+                    # Nothing to poll for while no board is open here
+                    while not self._closed and not self._subscribers:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                try:
+                    if conn is None:
+                        conn = get_db_connection(self.database)
+                        self._load_tail(conn)
+                    self._poll(conn)
+                except Exception:
+                    logger.exception("Polling live events from %s failed", self.database)
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _load_tail(self, conn):
+        # Start from the newest buffer_size events so that boards opened
+        # before this process started polling can still catch up
+        start = max(0, live_event_model.head(conn) - self.buffer_size)
+        with self._cond:
+            if self._last_id < start:
+                self._last_id = start
+                self._events.clear()
+
+    def _poll(self, conn):
+        while True:
+            rows = live_event_model.events_after(conn, self.last_id, self.buffer_size)
+            if not rows:
+                return
+            with self._cond:
+                if rows[0]["id"] != self._last_id + 1:
+                    # Pruned past what this process had; boards behind it reset
+                    self._events.clear()
+                for row in rows:
+                    self._events.append((
+                        row["id"],
+                        f"id: {row['id']}\nevent: {row['event']}\ndata: {row['data']}\n\n",
+                    ))
+                self._last_id = rows[-1]["id"]
+                self._stats["polled"] += len(rows)
+                self._cond.notify_all()
+            if len(rows) < self.buffer_size:
+                return
+
+    def stream(self, last_id, keepalive=15.0):
+        """
+        Yield SSE-formatted chunks after last_id until the bus closes or the
+        client goes away. Call subscribe() first. The slot is not released
+        here: a generator that is never started never runs its finally, so
+        the route releases it when the response is closed.
+        """
+        yield "retry: 3000\n\n"
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + keepalive
+                while not self._closed and self._last_id <= last_id:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                if self._closed:
+                    return
+                batch = self._after(last_id)
+
+            if batch is None:
+                with self._cond:
+                    self._stats["resets"] += 1
+                yield "event: reset\ndata: {}\n\n"
+                return
+            if not batch:
+                yield ": keepalive\n\n"
+                continue
+
+            last_id = batch[-1][0]
+            with self._cond:
+                self._stats["delivered"] += len(batch)
+            yield "".join(message for _, message in batch)
+
+    def _after(self, last_id):
+        # Caller holds self._cond. None means the client cannot catch up:
+        # its events were evicted. A client ahead of this process (another
+        # process served its page) waits for the poller to get there.
+        if last_id >= self._last_id:
+            return []
+        if not self._events or self._events[0][0] > last_id + 1:
+            return None
+        start = len(self._events) - (self._last_id - last_id)
+        return [self._events[index] for index in range(start, len(self._events))]
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._wake.set()
+
+    def stats(self):
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot.update(
+                subscribers=self._subscribers,
+                max_subscribers=self.max_subscribers,
+                last_id=self._last_id,
+                buffered=len(self._events),
+            )
+        return snapshot
+
+
+def get_event_bus():
+    """
+    The active branch's bus; boards only hear their own branch's taps.
+    """
+    shard = shards.current()
+    if shard is None:
+        return current_app.extensions["event_bus"]
+    return current_app.extensions["branch_event_buses"][shard.name]
+
+
+def limit_boards(app, count):
+    """
+    Cap the boards open in this process at count, across every branch's bus.
+    """
+    slots = threading.BoundedSemaphore(count)
+    for bus in [app.extensions["event_bus"], *app.extensions["branch_event_buses"].values()]:
+        bus.process_slots = slots
+
+
+def _bus(app, database):
+    return EventBus(
+        database,
+        buffer_size=app.config["EVENT_BUFFER_SIZE"],
+        max_subscribers=app.config["EVENT_MAX_SUBSCRIBERS"],
+        poll_interval=app.config["EVENT_POLL_INTERVAL"],
+    )
+
+
+def init_app(app):
+    app.extensions["event_bus"] = _bus(app, app.config["DATABASE_PATH"])
+    app.extensions["branch_event_buses"] = {
+        shard.name: _bus(app, shard.database) for shard in shards.all_shards(app)
+    }
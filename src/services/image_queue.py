@@ -0,0 +1,507 @@
+"""
+Background processing of enrollment photos.
+
+Uploads are written untouched to a spool folder and the user row records
+the spool name in users.pending_image. Worker threads run
+resize_and_compress on the spooled file and then swap image_path in.
+That only happens while pending_image still names the same job, so a
+newer upload or a deleted user simply discards the result.
+
+The spool folder and the workers are shared by every branch; each job
+remembers the branch it was queued from and runs against its shard.
+Workers run inside the app's context, so jobs use its database and
+upload folder rather than Config's defaults.
+
+Every queued job is claimed in image_job_claims by the process queueing
+it, which refreshes its claims every quarter of IMAGE_JOB_STALE_SECONDS
+while it has jobs. Each process periodically requeues the pending jobs
+whose claim has gone stale, or that were never claimed and whose spool
+file is that old, so the jobs of a process that died are picked up by
+another and those of live processes are left alone.
+"""
+import collections
+import contextlib
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+
+from src import shards
+from src.database import get_db_connection
+from src.models import version_model
+from src.services.image_service import allowed_file, collect_garbage, remove_image, resize_and_compress
+
+
+logger = logging.getLogger(__name__)
+
+_STAGES = ("queued", "process", "commit")
+
+
+class ImageJobQueue:
+    def __init__(self, database, spool_folder, workers=2, max_pending=32,
+                 retries=3, retry_delay=0.5, spool_max_age=3600, stale_seconds=120, branches=(), app=None):
+        self.app = app
+        self._database = database
+        self.branches = list(branches)
+        self.spool_folder = spool_folder
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.spool_max_age = spool_max_age
+        self.stale_seconds = stale_seconds
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._in_flight = 0
+        self._threads = []
+        self._started_pid = None
+        self._owner = None
+        self._owner_pid = None
+        self._last_cleanup = 0.0
+        self._last_claims = 0.0
+
+        self._counters = collections.Counter()
+        self._latencies = {stage: collections.deque(maxlen=512) for stage in _STAGES}
+
+    @property
+    def database(self):
+        # The shard of the branch being worked for, if any
+        shard = shards.current()
+        return shard.database if shard else self._database
+
+    def _all_branches(self):
+        # The unsharded database, then every branch's shard
+        return [None] + self.branches
+
+    def _databases(self):
+        return [shard.database if shard else self._database for shard in self._all_branches()]
+
+    @property
+    def owner(self):
+        """
+        This process's name in image_job_claims; a forked child gets its own.
+        """
+        with self._lock:
+            if self._owner_pid != os.getpid():
+                self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+                self._owner_pid = os.getpid()
+            return self._owner
+
+    def _app_context(self):
+        # Worker threads start with no app context of their own
+        return self.app.app_context() if self.app is not None else contextlib.nullcontext()
+
+    def start(self):
+        """
+        Start the worker threads, once per process. Returns False if this
+        process already started them.
+        """
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return False
+            self._started_pid = os.getpid()
+            # Threads started before a fork do not exist in the child
+            self._threads = []
+
+        os.makedirs(self.spool_folder, exist_ok=True)
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"image-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return True
+
+    def has_capacity(self):
+        # Soft limit: concurrent requests can overshoot by a few jobs.
+        with self._lock:
+            return self._pending < self.max_pending
+
+    def rejected(self):
+        with self._lock:
+            self._counters["rejected"] += 1
+
+    def spool(self, image_file):
+        """
+        Write the raw upload to the spool folder and return its name.
+        """
+        if not allowed_file(image_file.filename):
+            raise ValueError("Invalid image format. Only PNG, JPG, JPEG allowed.")
+
+        ext = secure_filename(image_file.filename).rsplit(".", 1)[1].lower()
+        spool_name = f"{uuid.uuid4().hex}.{ext}"
+        image_file.save(os.path.join(self.spool_folder, spool_name))
+        return spool_name
+
+    def submit(self, user_id, spool_name):
+        """
+        Claim and queue a spooled upload for the active branch's user.
+        Returns False if another process has already claimed it.
+        """
+        conn = get_db_connection(self.database)
+        try:
+            claimed = conn.execute(
+                "INSERT INTO image_job_claims (spool_name, owner) VALUES (?, ?) ON CONFLICT DO NOTHING",
+                (spool_name, self.owner),
+            ).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        if claimed:
+            self._enqueue(user_id, spool_name)
+        return bool(claimed)
+
+    def _enqueue(self, user_id, spool_name):
+        with self._lock:
+            self._pending += 1
+            self._counters["submitted"] += 1
+        self._queue.put((user_id, spool_name, shards.current(), 0, time.perf_counter()))
+
+    def wait_idle(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def recover(self):
+        """
+        Requeue jobs left by dead processes, in every branch, and drop
+        stale spool files.
+        """
+        self.recover_claims()
+        self.cleanup_spool()
+
+    def recover_claims(self):
+        """
+        Take over pending jobs whose claim is stale, in every branch.
+        Returns the number requeued.
+        """
+        recovered = 0
+        for shard in self._all_branches():
+            with shards.activate(shard):
+                recovered += self._recover_branch()
+        return recovered
+
+    def _recover_branch(self):
+        stale = f"-{int(self.stale_seconds)} seconds"
+        conn = get_db_connection(self.database)
+        try:
+            rows = conn.execute(
+                """
+                SELECT u.id, u.pending_image, c.owner FROM users u
+                LEFT JOIN image_job_claims c ON c.spool_name = u.pending_image
+                WHERE u.pending_image IS NOT NULL
+                  AND (c.owner IS NULL OR c.claimed_at < datetime('now', ?))
+                """,
+                (stale,),
+            ).fetchall()
+            recovered = 0
+            for row in rows:
+                try:
+                    spooled_at = os.stat(os.path.join(self.spool_folder, row["pending_image"])).st_mtime
+                except FileNotFoundError:
+                    conn.execute(
+                        "UPDATE users SET pending_image=NULL WHERE id=? AND pending_image=?",
+                        (row["id"], row["pending_image"]),
+                    )
+                    conn.execute("DELETE FROM image_job_claims WHERE spool_name=?", (row["pending_image"],))
+                    conn.commit()
+                    continue
+                if row["owner"] is None and spooled_at > time.time() - self.stale_seconds:
+                    # Just uploaded; its request is about to claim it
+                    continue
+                # Only if no other process took it over first
+                claimed = conn.execute(
+                    """
+                    INSERT INTO image_job_claims (spool_name, owner) VALUES (?, ?)
+                    ON CONFLICT (spool_name) DO UPDATE
+                    SET owner = excluded.owner, claimed_at = CURRENT_TIMESTAMP
+                    WHERE claimed_at < datetime('now', ?) AND owner != excluded.owner
+                    """,
+                    (row["pending_image"], self.owner, stale),
+                ).rowcount
+                conn.commit()
+                if claimed:
+                    self._enqueue(row["id"], row["pending_image"])
+                    recovered += 1
+
+            # Claims on uploads that were since replaced or deleted
+            conn.execute(
+                """
+                DELETE FROM image_job_claims
+                WHERE claimed_at < datetime('now', ?)
+                  AND spool_name NOT IN (SELECT pending_image FROM users WHERE pending_image IS NOT NULL)
+                """,
+                (stale,),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._counters["recovered"] += recovered
+        return recovered
+
+    def refresh_claims(self):
+        """
+        Mark this process's claims as still being worked on, in every
+        branch.
+        """
+        owner = self.owner
+        for database in self._databases():
+            conn = get_db_connection(database)
+            try:
+                conn.execute(
+                    "UPDATE image_job_claims SET claimed_at = CURRENT_TIMESTAMP WHERE owner = ?", (owner,)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+    def cleanup_spool(self, max_age=None):
+        """
+        Remove spool files that no user in any branch references and that
+        are older than max_age seconds. Returns the number removed.
+        """
+        max_age = self.spool_max_age if max_age is None else max_age
+        referenced = set()
+        for database in self._databases():
+            conn = get_db_connection(database)
+            referenced.update(
+                row[0] for row in conn.execute(
+                    "SELECT pending_image FROM users WHERE pending_image IS NOT NULL"
+                )
+            )
+            conn.close()
+
+        removed = 0
+        cutoff = time.time() - max_age
+        with os.scandir(self.spool_folder) as entries:
+            for entry in entries:
+                # Dotfiles are not uploads
+                if not entry.is_file() or entry.name.startswith(".") or entry.name in referenced:
+                    continue
+                try:
+                    if entry.stat().st_mtime <= cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    continue
+
+        with self._lock:
+            self._counters["orphans_removed"] += removed
+            self._last_cleanup = time.monotonic()
+        return removed
+
+    def stats(self):
+        with self._lock:
+            latencies = {}
+            for stage, samples in self._latencies.items():
+                ordered = sorted(samples)
+                latencies[stage] = {
+                    "count": len(ordered),
+                    "avg_ms": sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+                    "p95_ms": ordered[int(len(ordered) * 0.95) - 1] * 1000 if ordered else 0.0,
+                    "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+                }
+            return {
+                "depth": self._queue.qsize(),
+                "pending": self._pending,
+                "in_flight": self._in_flight,
+                "max_pending": self.max_pending,
+                "workers": self.workers,
+                **{name: self._counters[name] for name in (
+                    "submitted", "completed", "failed", "retried",
+                    "superseded", "rejected", "recovered", "orphans_removed",
+                )},
+                "latency": latencies,
+            }
+
+    def _run(self):
+        claims_interval = self.stale_seconds / 4
+        while True:
+            try:
+                job = self._queue.get(timeout=min(60, claims_interval))
+            except queue.Empty:
+                job = None
+
+            if job is not None:
+                self._handle(*job)
+
+            with self._lock:
+                claims_due = time.monotonic() - self._last_claims >= claims_interval
+                if claims_due:
+                    self._last_claims = time.monotonic()
+                    has_jobs = self._pending > 0
+            if claims_due:
+                try:
+                    with self._app_context():
+                        if has_jobs:
+                            self.refresh_claims()
+                        self.recover_claims()
+                except Exception:
+                    logger.exception("Image job claim upkeep failed")
+
+            if time.monotonic() - self._last_cleanup > self.spool_max_age:
+                try:
+                    self.cleanup_spool()
+                except Exception:
+                    logger.exception("Spool cleanup failed")
+                for shard in self._all_branches():
+                    try:
+                        with self._app_context(), shards.activate(shard):
+                            collect_garbage()
+                    except Exception:
+                        logger.exception("Upload garbage collection failed (%s)", shard or "main database")
+
+    def _handle(self, user_id, spool_name, shard, attempt, enqueued_at):
+        with self._app_context(), shards.activate(shard):
+            self._process(user_id, spool_name, shard, attempt, enqueued_at)
+
+    def _process(self, user_id, spool_name, shard, attempt, enqueued_at):
+        started = time.perf_counter()
+        with self._lock:
+            self._in_flight += 1
+            self._latencies["queued"].append(started - enqueued_at)
+
+        spool_path = os.path.join(self.spool_folder, spool_name)
+        image_path = None
+        try:
+            with open(spool_path, "rb") as handle:
+                image_path = resize_and_compress(FileStorage(stream=handle, filename=spool_name))
+            processed = time.perf_counter()
+
+            self._commit(user_id, spool_name, image_path)
+            committed = time.perf_counter()
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            if image_path:
+                remove_image(image_path)
+            self._retry_or_fail(user_id, spool_name, shard, attempt)
+            return
+
+        self._remove_file(spool_path)
+        with self._lock:
+            self._in_flight -= 1
+            self._latencies["process"].append(processed - started)
+            self._latencies["commit"].append(committed - processed)
+            self._finish("completed")
+
+    def _commit(self, user_id, spool_name, image_path):
+        conn = get_db_connection(self.database)
+        try:
+            row = conn.execute(
+                "SELECT image_path FROM users WHERE id=? AND pending_image=?",
+                (user_id, spool_name),
+            ).fetchone()
+            if row is None:
+                # Superseded by a newer upload, or the user was deleted
+                conn.execute("DELETE FROM image_job_claims WHERE spool_name=?", (spool_name,))
+                conn.commit()
+                remove_image(image_path)
+                with self._lock:
+                    self._counters["superseded"] += 1
+                return
+
+            conn.execute(
+                "UPDATE users SET image_path=?, pending_image=NULL WHERE id=? AND pending_image=?",
+                (image_path, user_id, spool_name),
+            )
+            conn.execute("DELETE FROM image_job_claims WHERE spool_name=?", (spool_name,))
+            version_model.bump_data_version(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+        if row["image_path"] != image_path:
+            remove_image(row["image_path"])
+
+    def _retry_or_fail(self, user_id, spool_name, shard, attempt):
+        if attempt < self.retries:
+            logger.warning("Image job %s for user %s failed, retrying", spool_name, user_id)
+            with self._lock:
+                self._counters["retried"] += 1
+            timer = threading.Timer(
+                self.retry_delay * 2 ** attempt,
+                self._queue.put,
+                args=((user_id, spool_name, shard, attempt + 1, time.perf_counter()),),
+            )
+            timer.daemon = True
+            timer.start()
+            return
+
+        logger.exception("Image job %s for user %s failed permanently", spool_name, user_id)
+        conn = get_db_connection(self.database)
+        conn.execute(
+            "UPDATE users SET pending_image=NULL WHERE id=? AND pending_image=?",
+            (user_id, spool_name),
+        )
+        conn.execute("DELETE FROM image_job_claims WHERE spool_name=?", (spool_name,))
+        conn.commit()
+        conn.close()
+        self._remove_file(os.path.join(self.spool_folder, spool_name))
+        with self._lock:
+            self._finish("failed")
+
+    def _finish(self, outcome):
+        # Caller holds self._lock
+        self._counters[outcome] += 1
+        self._pending -= 1
+        if not self._pending:
+            self._idle.notify_all()
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def start_workers(app):
+    """
+    Start this process's image workers if they are not running yet, and
+    take over jobs that dead processes left claimed.
+    """
+    job_queue = app.extensions["image_queue"]
+    if job_queue.start():
+        job_queue.recover()
+
+
+def init_app(app):
+    job_queue = ImageJobQueue(
+        app.config["DATABASE_PATH"],
+        app.config["SPOOL_FOLDER"],
+        workers=app.config["IMAGE_WORKERS"],
+        max_pending=app.config["IMAGE_QUEUE_SIZE"],
+        retries=app.config["IMAGE_JOB_RETRIES"],
+        spool_max_age=app.config["SPOOL_MAX_AGE"],
+        stale_seconds=app.config["IMAGE_JOB_STALE_SECONDS"],
+        branches=shards.all_shards(app),
+        app=app,
+    )
+    app.extensions["image_queue"] = job_queue
+    app.cli.add_command(clean_spool_command)
+
+
+@click.command("clean-spool")
+@click.option("--max-age", type=int, default=None, help="Only remove files older than this many seconds.")
+@with_appcontext
+def clean_spool_command(max_age):
+    """Remove spooled uploads that no pending job references."""
+    removed = current_app.extensions["image_queue"].cleanup_spool(max_age)
+    click.echo(f"Removed {removed} orphaned spool files.")
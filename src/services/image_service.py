@@ -1,41 +1,475 @@
+import collections
+import hashlib
+import io
+import logging
 import os
+import re
+import time
 import uuid
-from PIL import Image
-from werkzeug.utils import secure_filename
+
+import click
+from flask import current_app, has_app_context, url_for
+from flask.cli import with_appcontext
+from PIL import ExifTags, Image
+from src import instrumentation, shards
 from src.config import Config
+from src.database import get_db_connection
+from src.models import image_model
+
+
+logger = logging.getLogger(__name__)
 
 
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg"}
 
+# Files resize_and_compress writes: <24 hex>.jpg, its WebP copy and the
+# _<width> renditions, plus _write_atomic temporaries
+_STORED_FILE = re.compile(r"^([0-9a-f]{24})(?:_\d+)?\.(?:jpg|webp)$")
+_TEMP_FILE = re.compile(r"^([0-9a-f]{24}).*\.tmp$")
+
+_EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+_SWAPS_AXES = {
+    Image.Transpose.TRANSPOSE,
+    Image.Transpose.ROTATE_270,
+    Image.Transpose.TRANSVERSE,
+    Image.Transpose.ROTATE_90,
+}
+
+# Speed/size trade-offs, selected with the IMAGE_PROFILE setting.
+# reducing_gap first shrinks with a cheap box reduce() and only uses the
+# resample filter for the last step.
+IMAGE_PROFILES = {
+    "fast": {
+        "resample": Image.Resampling.BILINEAR,
+        "reducing_gap": 2.0,
+        "optimize": False,
+        "progressive": False,
+        "webp_method": 0,
+    },
+    "balanced": {
+        "resample": Image.Resampling.LANCZOS,
+        "reducing_gap": 3.0,
+        "optimize": False,
+        "progressive": False,
+        "webp_method": 4,
+    },
+    "smallest": {
+        "resample": Image.Resampling.LANCZOS,
+        "reducing_gap": None,
+        "optimize": True,
+        "progressive": True,
+        "webp_method": 6,
+    },
+}
+
+
+def _setting(name):
+    # The app's value; bulk import's worker processes have no app and are
+    # given the app's values on Config instead
+    return current_app.config[name] if has_app_context() else getattr(Config, name)
+
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def resize_and_compress(image_file):
+@instrumentation.timed("image_resize_seconds", "image")
+def resize_and_compress(image_file, profile=None):
     """
-    Resizes uploaded image to 600x600 and compresses it.
-    Returns saved image path.
+    Resizes uploaded image to 600x600, compresses it and writes the
+    smaller avatar renditions next to it.
+    Returns saved image path, named after a hash of its content, in the
+    active branch's upload folder.
+    A source already processed with the same settings is not decoded
+    again; its stored image is returned.
     """
 
     if not allowed_file(image_file.filename):
         raise ValueError("Invalid image format. Only PNG, JPG, JPEG allowed.")
 
-    # Generate safe unique filename
-    filename = secure_filename(image_file.filename)
-    ext = filename.rsplit(".", 1)[1].lower()
-    unique_name = f"{uuid.uuid4().hex}.{ext}"
+    profile = profile or _setting("IMAGE_PROFILE")
+    settings = IMAGE_PROFILES[profile]
+    key = _source_key(image_file.stream, profile)
+    upload_folder, upload_prefix = shards.upload_folder()
+
+    known_path = _claim_image(key)
+    if known_path and os.path.exists(os.path.join(upload_folder, os.path.basename(known_path))):
+        return known_path
+
+    image = _decode_resized(image_file, settings)
+    data = _encode(image, "JPEG", settings)
+
+    unique_name = f"{hashlib.sha256(data).hexdigest()[:24]}.jpg"
+    save_path = os.path.join(upload_folder, unique_name)
+    relative_path = f"{upload_prefix}/{unique_name}"
+
+    # Claimed before checking the disk, so a concurrent remove_image or
+    # collection cannot delete the file between the check and our caller
+    # referencing it
+    _claim_image(key, relative_path)
+
+    # Identical output is already on disk with its renditions
+    if not os.path.exists(save_path):
+        write_renditions(image, save_path, settings)
+        _write_atomic(save_path, data)
+
+    return relative_path
+
+
+def _source_key(stream, profile):
+    """
+    Hash of the upload's bytes and everything that shapes the output.
+    """
+    digest = hashlib.sha256(repr(
+        (profile, _setting("IMAGE_SIZE"), _setting("IMAGE_QUALITY"), tuple(_setting("IMAGE_RENDITIONS")))
+    ).encode())
+    for block in iter(lambda: stream.read(1024 * 1024), b""):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def _claim_image(source_key, image_path=None):
+    """
+    Mark an image as just used, recording that source_key produced it.
+    With no image_path, the image source_key produced before is claimed.
+    Returns the claimed path, or None for an unknown source.
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        image_path = image_path or image_model.source_image(conn, source_key)
+        if image_path:
+            image_model.register(conn, image_path, source_key)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return image_path
+
+
+def process_image(source, save_path, profile=None):
+    """
+    Decode, orient, resize and save one image as JPEG.
+    source is a path or file object.
+    """
+    settings = IMAGE_PROFILES[profile or _setting("IMAGE_PROFILE")]
+    image = _decode_resized(source, settings)
+    _write_atomic(save_path, _encode(image, "JPEG", settings))
+    return image
+
+
+def _decode_resized(source, settings):
+    with Image.open(source) as image:
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale while staying at or
+        # above the target size, instead of decoding the full frame.
+        size = _setting("IMAGE_SIZE")
+        image.draft("RGB", size)
+
+        # Apply the EXIF orientation after resizing, on the small image
+        transpose = _EXIF_TRANSPOSE.get(image.getexif().get(ExifTags.Base.Orientation))
+        width, height = size
+        if transpose in _SWAPS_AXES:
+            width, height = height, width
+
+        image = image.convert("RGB")  # Ensure JPEG compatible
+        image = image.resize(
+            (width, height),
+            resample=settings["resample"],
+            reducing_gap=settings["reducing_gap"],
+        )
+        if transpose is not None:
+            image = image.transpose(transpose)
+    return image
+
+
+def _encode(image, fmt, settings):
+    buffer = io.BytesIO()
+    quality = _setting("IMAGE_QUALITY")
+    if fmt == "WEBP":
+        image.save(buffer, format="WEBP", quality=quality, method=settings["webp_method"])
+    else:
+        image.save(
+            buffer,
+            format="JPEG",
+            quality=quality,
+            optimize=settings["optimize"],
+            progressive=settings["progressive"],
+        )
+    return buffer.getvalue()
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as handle:
+        handle.write(data)
+    os.replace(tmp_path, path)
+
+
+def rendition_path(path, width=None, ext="jpg"):
+    """
+    Path of a rendition of path: <stem>_<width>.<ext>, or <stem>.<ext>
+    for the full-size one.
+    """
+    stem = path.rsplit(".", 1)[0]
+    return f"{stem}_{width}.{ext}" if width else f"{stem}.{ext}"
+
+
+def write_renditions(image, save_path, settings):
+    """
+    Write the avatar renditions (and WebP copies) for a full-size image.
+    """
+    full_width, full_height = image.size
+
+    _write_atomic(rendition_path(save_path, ext="webp"), _encode(image, "WEBP", settings))
+    for width in _setting("IMAGE_RENDITIONS"):
+        if width >= full_width:
+            continue
+        height = max(1, round(full_height * width / full_width))
+        small = image.resize(
+            (width, height),
+            resample=settings["resample"],
+            reducing_gap=settings["reducing_gap"],
+        )
+        _write_atomic(rendition_path(save_path, width), _encode(small, "JPEG", settings))
+        _write_atomic(rendition_path(save_path, width, "webp"), _encode(small, "WEBP", settings))
+
+
+def pick_rendition(relative_path, size, ext="jpg"):
+    """
+    Return the smallest existing rendition of a static-relative image path
+    that is at least size pixels wide, falling back to the original.
+    """
+    widths = [width for width in sorted(_setting("IMAGE_RENDITIONS")) if width >= size]
+    widths.append(None)
+
+    candidates = []
+    for width in widths:
+        candidates.append(rendition_path(relative_path, width, ext))
+        if ext != "jpg":
+            candidates.append(rendition_path(relative_path, width))
+
+    static_folder = _setting("STATIC_FOLDER")
+    for candidate in candidates:
+        if candidate == relative_path:
+            break
+        # Not cached: remove_image and gc-uploads delete renditions, often
+        # from another worker or process
+        if os.path.exists(os.path.join(static_folder, candidate)):
+            return candidate
+    return relative_path
+
+
+def backfill_renditions(paths):
+    """
+    Create missing renditions for already stored full-size images.
+    Returns the number of images processed.
+    """
+    settings = IMAGE_PROFILES[_setting("IMAGE_PROFILE")]
+    processed = 0
+    for stored_path in paths:
+        absolute_path = absolute_image_path(stored_path)
+        if not absolute_path or not os.path.exists(absolute_path):
+            continue
+        if os.path.exists(rendition_path(absolute_path, ext="webp")):
+            continue
+        with Image.open(absolute_path) as image:
+            write_renditions(image.convert("RGB"), absolute_path, settings)
+        processed += 1
+    return processed
+
+
+def image_url(path, size=None, fmt="jpg"):
+    """
+    Public URL for a stored image path. With size, the smallest rendition
+    at least that many pixels wide is used when it exists.
+    """
+    if not path:
+        # Photo still being processed in the background
+        return url_for("static", filename="images/photo_pending.svg")
+
+    normalized = str(path).replace("\\", "/")
+
+    if normalized.startswith("http://") or normalized.startswith("https://"):
+        return normalized
+
+    for marker in ("/static/", "static/"):
+        if marker in normalized:
+            normalized = normalized.split(marker, 1)[1]
+            break
+
+    if size:
+        normalized = pick_rendition(normalized, size, fmt)
+
+    return url_for("static", filename=normalized)
+
+
+def absolute_image_path(stored_path: str | None) -> str | None:
+    if not stored_path:
+        return None
+
+    normalized = str(stored_path).replace("\\", "/")
+
+    if normalized.startswith("http://") or normalized.startswith("https://"):
+        return None
+
+    if os.path.isabs(normalized):
+        return normalized
+
+    normalized = normalized.lstrip("/")
+    if normalized.startswith("static/"):
+        normalized = normalized.split("static/", 1)[1]
+
+    return os.path.join(_setting("STATIC_FOLDER"), normalized)
+
+
+def remove_image(path: str | None) -> None:
+    """
+    Delete a stored image and its renditions, unless another user still
+    points at the same content-addressed file. Images produced or reused
+    within IMAGE_GC_GRACE are left to collect_garbage, since an upload
+    being committed may be about to point at them.
+    """
+    absolute_path = absolute_image_path(path)
+    if not absolute_path or not os.path.exists(absolute_path):
+        return
+
+    conn = get_db_connection()
+    try:
+        _release(conn, path, absolute_path, _setting("IMAGE_GC_GRACE"))
+    finally:
+        conn.close()
+
+
+def _release(conn, path, absolute_path, grace):
+    # The files go while the write lock is held, so no upload can claim
+    # the image between the reference check and the delete
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if not image_model.releasable(conn, path, grace):
+            conn.rollback()
+            return False
+        image_model.forget(conn, path)
+        candidates = [absolute_path, rendition_path(absolute_path, ext="webp")]
+        for width in _setting("IMAGE_RENDITIONS"):
+            candidates += [rendition_path(absolute_path, width), rendition_path(absolute_path, width, "webp")]
+        for candidate in candidates:
+            _remove_file(candidate)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return True
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        # Left for the next collection
+        logger.warning("Could not remove %s", path, exc_info=True)
+        return False
+    return True
+
+
+def collect_garbage(grace=None):
+    """
+    Reconcile the active branch's upload folder with its database. Images no user points
+    at are deleted, and so are store files that no images row accounts
+    for (left by crashed or rolled-back uploads), once untouched for
+    grace seconds. The folder is walked with scandir and the database
+    paged by key, so neither is loaded into memory.
+    Returns counts of released images and orphaned files removed.
+    """
+    grace = _setting("IMAGE_GC_GRACE") if grace is None else grace
+    removed = collections.Counter(released=0, orphans=0)
+    upload_folder, upload_prefix = shards.upload_folder()
+
+    conn = get_db_connection()
+    try:
+        after = ""
+        while True:
+            page = image_model.unreferenced(conn, grace, after)
+            if not page:
+                break
+            for path in page:
+                absolute_path = os.path.join(upload_folder, os.path.basename(path))
+                removed["released"] += _release(conn, path, absolute_path, grace)
+            after = page[-1]
+
+        cutoff = time.time() - grace
+        with os.scandir(upload_folder) as entries:
+            for entry in entries:
+                match = _STORED_FILE.match(entry.name) or _TEMP_FILE.match(entry.name)
+                if match is None or not entry.is_file():
+                    continue
+                try:
+                    if entry.stat().st_mtime > cutoff:
+                        continue
+                except OSError:
+                    continue
+                removed["orphans"] += _remove_orphan(conn, entry, f"{upload_prefix}/{match.group(1)}.jpg")
+    finally:
+        conn.close()
+    return dict(removed)
+
+
+def _remove_orphan(conn, entry, image_path):
+    if entry.name.endswith(".tmp"):
+        return _remove_file(entry.path)
+    # Checked under the write lock, as in _release
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if image_model.is_registered(conn, image_path):
+            return False
+        return _remove_file(entry.path)
+    finally:
+        conn.rollback()
+
+
+def init_app(app):
+    app.cli.add_command(backfill_renditions_command)
+    app.cli.add_command(gc_uploads_command)
+
 
-    save_path = os.path.join(Config.UPLOAD_FOLDER, unique_name)
+@click.command("backfill-renditions")
+@with_appcontext
+@shards.branch_option
+def backfill_renditions_command():
+    """Create avatar renditions for uploads stored before they existed."""
+    conn = get_db_connection()
+    paths = [row[0] for row in conn.execute("SELECT image_path FROM users WHERE image_path != ''")]
+    conn.close()
 
-    # Open image with Pillow
-    image = Image.open(image_file)
-    image = image.convert("RGB")  # Ensure JPEG compatible
-    image = image.resize(Config.IMAGE_SIZE)
+    processed = backfill_renditions(paths)
+    click.echo(f"Created renditions for {processed} images.")
 
-    # Save compressed
-    image.save(save_path, format="JPEG", quality=Config.IMAGE_QUALITY, optimize=True)
 
-    relative_path = os.path.join("uploads", unique_name)
+@click.command("gc-uploads")
+@click.option("--grace", type=int, default=None, help="Leave images touched within this many seconds.")
+@click.option("--recount", is_flag=True, help="Recount image references from users first.")
+@with_appcontext
+@shards.branch_option
+def gc_uploads_command(grace, recount):
+    """Delete uploads and renditions that no candidate uses."""
+    if recount:
+        conn = get_db_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        image_model.rebuild_image_refs(conn)
+        conn.commit()
+        conn.close()
 
-    return relative_path.replace("\\", "/")
+    removed = collect_garbage(grace)
+    click.echo(f"Released {removed['released']} unused images and {removed['orphans']} orphaned files.")
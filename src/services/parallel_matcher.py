@@ -0,0 +1,311 @@
+"""
+1:N fingerprint scoring spread over a persistent process pool.
+
+Workers read templates straight from the branch's template store: each
+keeps its own TemplateStore open on the same file, whose mapping and
+user-to-record index catch up with appends by one stat() per task. A
+search pickles only the store path, a record range and the probe, and
+nothing is copied or rewritten when a candidate enrolls. Templates the
+store does not hold yet (still in users.fingerprint_template) are scored
+in the calling thread while the workers run. One pool serves every
+branch's matcher in a process.
+"""
+import atexit
+import concurrent.futures
+import itertools
+import mmap
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from src.services.template_store import TemplateStore
+
+
+_CANCEL_SLOTS = 256
+_CANCEL_CHECK_EVERY = 64
+
+
+def _cancel_dir():
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+# --- worker process state ---------------------------------------------------
+
+_worker = {}
+
+
+def _worker_init(scorer, cancel_path):
+    with open(cancel_path, "r+b") as handle:
+        _worker["cancel"] = mmap.mmap(handle.fileno(), _CANCEL_SLOTS)
+    _worker["scorer"] = scorer
+    _worker["stores"] = {}
+
+
+def _worker_store(path, record_bytes):
+    store = _worker["stores"].get(path)
+    if store is None:
+        store = _worker["stores"][path] = TemplateStore(path, record_bytes)
+    return store
+
+
+def _score_records(path, record_bytes, generation, first, last, probe, threshold, slot):
+    """
+    Score the live records among [first, last). Returns (best id, best
+    score, scored, seconds, cancelled, stale); stale means the store was
+    compacted since the search read its position.
+    """
+    started = time.perf_counter()
+    cancel = _worker["cancel"]
+    if cancel[slot]:
+        return None, 0.0, 0, 0.0, True, False
+
+    records = _worker_store(path, record_bytes).live_records(generation, first, last)
+    if records is None:
+        return None, 0.0, 0, time.perf_counter() - started, False, True
+
+    scorer = _worker["scorer"]
+    best_id, best_score, scored = None, 0.0, 0
+    for user_id, template in records:
+        if scored % _CANCEL_CHECK_EVERY == 0 and scored and cancel[slot]:
+            return best_id, best_score, scored, time.perf_counter() - started, True, False
+
+        score = scorer(probe, template)
+        scored += 1
+        if score > best_score:
+            best_id, best_score = user_id, score
+            if score >= threshold:
+                break
+
+    return best_id, best_score, scored, time.perf_counter() - started, False, False
+
+
+def _noop(_):
+    return None
+
+
+# --- coordinator --------------------------------------------------------------
+
+class _ScoringPool:
+    """
+    Worker processes and cancel flags shared by every matcher in this
+    process with the same scorer and size, so each branch does not start
+    a pool of its own. Shut down when the last matcher using it closes.
+    """
+
+    def __init__(self, scorer, workers):
+        self.key = (scorer, workers)
+        self.workers = workers
+        self.users = 0
+        self.slots = itertools.count()
+
+        fd, self.cancel_path = tempfile.mkstemp(prefix="cancel-", dir=_cancel_dir())
+        os.write(fd, b"\0" * _CANCEL_SLOTS)
+        os.close(fd)
+        with open(self.cancel_path, "r+b") as handle:
+            self.cancel = mmap.mmap(handle.fileno(), _CANCEL_SLOTS)
+
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_worker_init,
+            initargs=(scorer, self.cancel_path),
+        )
+        atexit.register(self.shutdown)
+
+    def shutdown(self):
+        if self.executor is None:
+            return
+        # Running shards notice within _CANCEL_CHECK_EVERY records
+        self.cancel[:] = b"\1" * _CANCEL_SLOTS
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.executor = None
+        try:
+            os.remove(self.cancel_path)
+        except OSError:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _acquire_pool(scorer, workers):
+    with _pools_lock:
+        pool = _pools.get((scorer, workers))
+        if pool is None:
+            pool = _pools[(scorer, workers)] = _ScoringPool(scorer, workers)
+        pool.users += 1
+        return pool
+
+
+def _release_pool(pool):
+    with _pools_lock:
+        pool.users -= 1
+        if pool.users == 0:
+            _pools.pop(pool.key, None)
+            pool.shutdown()
+
+
+class ParallelMatcher:
+    """
+    Same load/upsert/remove/apply/match interface as TemplateIndex, with
+    the scoring fanned out over worker processes reading `store`.
+    """
+
+    def __init__(self, store, scorer, threshold, workers=None, deadline_ms=2000, shards_per_worker=4):
+        self.store = store
+        self.scorer = scorer
+        self.threshold = threshold
+        self.workers = workers or os.cpu_count() or 1
+        self.deadline_ms = deadline_ms
+        self.shards_per_worker = shards_per_worker
+
+        self._lock = threading.Lock()
+        # Templates the store does not hold
+        self._extra = {}
+
+        self._pool = _acquire_pool(scorer, self.workers)
+        atexit.register(self.close)
+
+    def __len__(self):
+        return len(self.store) + len(self._extra)
+
+    def load(self, rows):
+        stored = {user_id for user_id, _ in self.store.items()}
+        with self._lock:
+            self._extra = {user_id: bytes(t) for user_id, t in rows if t and user_id not in stored}
+
+    def upsert(self, user_id, template_bytes):
+        self.apply([(user_id, template_bytes)])
+
+    def remove(self, user_id):
+        self.apply([(user_id, None)])
+
+    def apply(self, changes):
+        """
+        Changes replayed from the store need nothing here beyond dropping
+        an older copy of the user's template from outside it.
+        """
+        with self._lock:
+            for user_id, template_bytes in changes:
+                self._extra.pop(user_id, None)
+                if template_bytes and self.store.get(user_id) is None:
+                    self._extra[user_id] = bytes(template_bytes)
+
+    def warm_up(self):
+        """
+        Start every worker.
+        """
+        list(self._pool.executor.map(_noop, range(self.workers)))
+
+    def _score_extra(self, probe):
+        best_id, best_score = None, 0.0
+        with self._lock:
+            extra = list(self._extra.items())
+        for user_id, template in extra:
+            score = self.scorer(probe, template)
+            if score > best_score:
+                best_id, best_score = user_id, score
+                if score >= self.threshold:
+                    break
+        return best_id, best_score, len(extra)
+
+    def search(self, probe, deadline_ms=None):
+        """
+        Score the probe against every enrolled template.
+        Returns a dict with user_id (None without a match), score and
+        timing details.
+        """
+        started = time.perf_counter()
+        deadline = started + (deadline_ms or self.deadline_ms) / 1000
+        probe = bytes(probe)
+        # Compaction between reading the position and a worker's scan
+        # renumbers the records; that search is run once more
+        for attempt in range(2):
+            result = self._search(probe, started, deadline)
+            if not result.pop("stale") or time.perf_counter() >= deadline:
+                break
+        return result
+
+    def _search(self, probe, started, deadline):
+        store = self.store
+        # A candidate re-enrolling meanwhile is found by the next search:
+        # workers skip the record this position still covers
+        generation, end = store.position()
+        count = store.record_count(end) if generation is not None else 0
+
+        pool = self._pool
+        slot = next(pool.slots) % _CANCEL_SLOTS
+        pool.cancel[slot] = 0
+        shard_count = min(count, self.workers * self.shards_per_worker) or 1
+        bounds = [count * i // shard_count for i in range(shard_count + 1)]
+        futures = [
+            pool.executor.submit(
+                _score_records, store.path, store.record_bytes, generation, bounds[i], bounds[i + 1],
+                probe, self.threshold, slot,
+            )
+            for i in range(shard_count)
+            if bounds[i] < bounds[i + 1]
+        ]
+        dispatched = time.perf_counter()
+
+        best_id, best_score, scored = self._score_extra(probe)
+        shards_done = 0
+        shard_seconds = []
+        timed_out = stale = False
+        pending = set(futures)
+        while pending and best_score < self.threshold:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                timed_out = True
+                break
+            done, pending = concurrent.futures.wait(
+                pending, timeout=remaining, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                user_id, score, count_scored, seconds, _, shard_stale = future.result()
+                shards_done += 1
+                scored += count_scored
+                shard_seconds.append(seconds)
+                stale = stale or shard_stale
+                if score > best_score:
+                    best_id, best_score = user_id, score
+
+        cancelled = 0
+        if pending:
+            pool.cancel[slot] = 1
+            cancelled = sum(future.cancel() for future in pending)
+
+        finished = time.perf_counter()
+        matched = best_score >= self.threshold
+        return {
+            "user_id": best_id if matched else None,
+            "score": best_score,
+            "best_candidate": best_id,
+            "timed_out": timed_out and not matched,
+            "candidates": len(self),
+            "scored": scored,
+            "shards": len(futures),
+            "shards_done": shards_done,
+            "shards_cancelled": cancelled,
+            "stale": stale and not matched,
+            "timings_ms": {
+                "dispatch": (dispatched - started) * 1000,
+                "wait": (finished - dispatched) * 1000,
+                "shard_max": max(shard_seconds, default=0.0) * 1000,
+                "shard_total": sum(shard_seconds) * 1000,
+                "total": (finished - started) * 1000,
+            },
+        }
+
+    def match(self, probe):
+        result = self.search(probe)
+        return result["user_id"], result["score"]
+
+    def close(self):
+        if self._pool is None:
+            return
+        _release_pool(self._pool)
+        self._pool = None
@@ -0,0 +1,131 @@
+"""
+In-process LRU cache for rendered HTML fragments.
+
+Keys carry everything the fragment was rendered from: whole listings key
+on the database-wide data version (models/version_model.py), which every
+write path bumps, and single rows key on their own column values. After
+a check-in the board's listing misses once and is reassembled from cached
+rows, of which only the changed one is rendered again. Stale entries are
+never looked up again and age out of the LRU. Versions and ids are per
+database, so every key is also qualified by the active branch.
+
+The cache is per process and bounded by RENDER_CACHE_MAX_BYTES of cached
+text; RENDER_CACHE_MAX_BYTES = 0 turns it off.
+"""
+import collections
+import threading
+
+from flask import current_app
+from markupsafe import Markup
+
+from src import instrumentation, shards
+
+# Rough per-entry cost of the key, node and bookkeeping, on top of the text
+_ENTRY_OVERHEAD = 200
+
+
+def _weight(value):
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_weight(item) for item in value)
+    return 16
+
+
+class RenderCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = collections.Counter()
+        self._misses = collections.Counter()
+        self._evictions = 0
+
+    def fetch(self, namespace, key, build):
+        """
+        Return the cached value for (namespace, key), calling build() and
+        storing its result on a miss. Two requests missing the same key at
+        once both build; the second store wins.
+        """
+        full_key = (namespace, shards.current_name(), key)
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                self._entries.move_to_end(full_key)
+                self._hits[namespace] += 1
+                return entry[0]
+            self._misses[namespace] += 1
+
+        value = build()
+        size = _weight(value) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return value
+
+        with self._lock:
+            previous = self._entries.pop(full_key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[full_key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self._evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            namespaces = sorted(self._hits.keys() | self._misses.keys())
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+                "hits": {name: self._hits[name] for name in namespaces},
+                "misses": {name: self._misses[name] for name in namespaces},
+            }
+
+
+def render_fragment(namespace, key, template, **context):
+    """
+    Render a partial template through the cache. The result is Markup, so
+    it can be placed into a page without being escaped again.
+    """
+    def build():
+        return current_app.jinja_env.get_template(template).render(**context)
+
+    return Markup(get_render_cache().fetch(namespace, key, build))
+
+
+def get_render_cache():
+    return current_app.extensions["render_cache"]
+
+
+def _gauges(cache):
+    def sample():
+        stats = cache.stats()
+        gauges = [
+            ("render_cache_bytes", {}, stats["bytes"]),
+            ("render_cache_entries", {}, stats["entries"]),
+            ("render_cache_evictions", {}, stats["evictions"]),
+        ]
+        for namespace, hits in stats["hits"].items():
+            gauges.append(("render_cache_hits", {"namespace": namespace}, hits))
+        for namespace, misses in stats["misses"].items():
+            gauges.append(("render_cache_misses", {"namespace": namespace}, misses))
+        return gauges
+    return sample
+
+
+def init_app(app):
+    cache = RenderCache(max_bytes=app.config["RENDER_CACHE_MAX_BYTES"])
+    app.extensions["render_cache"] = cache
+    if instrumentation.enabled():
+        instrumentation.METRICS.add_gauges(_gauges(cache))
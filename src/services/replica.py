@@ -0,0 +1,367 @@
+"""
+Read-only reporting replica of each database, fed from its change log.
+
+`flask replicate` is the applier: a separate process that snapshots each
+database (main and every branch) into <database>-reporting.db with the
+SQLite backup API, then tails change_log and replays it there in seq
+order, a batch per transaction. The replica keeps the primary's triggers
+except the capture ones, so user_stats and the rollups follow the
+replayed rows exactly as they do on the primary. Each batch records how
+far it got in replica_state, and the primary's log is pruned behind it.
+
+fresh_as_of is the time before which every committed write is known to
+be on the replica: the time of the read that found no more changes, or
+the changed_at of the first change not yet applied. Admin reports read
+the replica while it is no more than REPLICA_MAX_STALENESS seconds behind
+(?max_staleness= per request) and the primary otherwise, so long exports
+and charts stop competing with check-ins for the primary's pages, pool
+and WAL checkpoints.
+"""
+import json
+import os
+import sqlite3
+import time
+
+import click
+from flask import abort, current_app, g, request
+from flask.cli import with_appcontext
+from src import migrations, shards
+from src.database import get_db, get_db_connection
+from src.models import change_model
+
+
+CONSUMER = "reporting"
+
+
+def replica_path(database):
+    root, ext = os.path.splitext(database)
+    return f"{root}-reporting{ext}"
+
+
+def _statements():
+    statements = {}
+    for table, (key, columns) in change_model.CAPTURED.items():
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column not in key)
+        statements[table] = {
+            "upsert": (
+                f"INSERT INTO {table} ({', '.join(columns)}) "
+                f"VALUES ({', '.join(':' + column for column in columns)}) "
+                f"ON CONFLICT ({', '.join(key)}) DO "
+                + (f"UPDATE SET {updates}" if updates else "NOTHING")
+            ),
+            "delete": f"DELETE FROM {table} WHERE " + " AND ".join(f"{column} = :{column}" for column in key),
+        }
+    return statements
+
+
+_STATEMENTS = _statements()
+
+
+# --- reading ----------------------------------------------------------------------
+
+def open_replica(path):
+    conn = get_db_connection(path)
+    conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+def replica_state(conn):
+    """
+    The replica's applied_seq, fresh_as_of and applied_at, or None while
+    it is being (re)built or is behind the code's schema.
+    """
+    if migrations.schema_version(conn) != len(migrations.MIGRATIONS):
+        return None
+    try:
+        return conn.execute("SELECT applied_seq, fresh_as_of, applied_at FROM replica_state").fetchone()
+    except sqlite3.OperationalError:
+        return None
+
+
+def open_fresh_replica(database, max_staleness):
+    """
+    (read-only connection, staleness in seconds) for database's replica,
+    or (None, None) when it has none within max_staleness seconds.
+    """
+    path = replica_path(database)
+    if not max_staleness or max_staleness <= 0 or not os.path.exists(path):
+        return None, None
+    conn = open_replica(path)
+    state = replica_state(conn)
+    staleness = max(0.0, time.time() - state["fresh_as_of"]) if state else None
+    if staleness is None or staleness > max_staleness:
+        conn.close()
+        return None, None
+    return conn, staleness
+
+
+def max_staleness():
+    """
+    How stale a replica this request accepts, in seconds: ?max_staleness=,
+    else REPLICA_MAX_STALENESS. None when reports use the primary.
+    """
+    if not current_app.config["REPORTING_REPLICA"]:
+        return None
+    raw = request.args.get("max_staleness", "").strip()
+    if not raw:
+        return current_app.config["REPLICA_MAX_STALENESS"]
+    try:
+        return float(raw)
+    except ValueError:
+        abort(400, description=f"Invalid max_staleness: {raw}")
+
+
+def get_report_db():
+    """
+    Connection for an admin report in this request: the active branch's
+    replica when it is fresh enough, else the pooled primary connection.
+    """
+    if "report_db" not in g:
+        conn, staleness = open_fresh_replica(shards.database_path(), max_staleness())
+        g.report_staleness = staleness
+        g.report_db = conn if conn is not None else get_db()
+    return g.report_db
+
+
+def choose_report_database():
+    """
+    For responses that open their own connection later: the replica path
+    when it is fresh enough (noting the staleness for the response
+    header), else None for the primary.
+    """
+    database = shards.database_path()
+    conn, staleness = open_fresh_replica(database, max_staleness())
+    if conn is None:
+        g.report_staleness = None
+        return None
+    conn.close()
+    g.report_staleness = staleness
+    return replica_path(database)
+
+
+def close_report_db(exc=None):
+    conn = g.pop("report_db", None)
+    if conn is not None and g.get("report_staleness") is not None:
+        conn.close()
+
+
+def _report_source_header(response):
+    if "report_staleness" in g:
+        staleness = g.report_staleness
+        response.headers["X-Report-Source"] = (
+            "primary" if staleness is None else f"replica; staleness={staleness:.1f}"
+        )
+    return response
+
+
+# --- applying ---------------------------------------------------------------------
+
+def rebuild(primary, replica):
+    """
+    Snapshot the primary into the replica and start replaying from the
+    snapshot's log head. Readers fall back to the primary until it is done.
+    """
+    change_model.register_consumer(primary, CONSUMER)
+    taken = time.time()
+    primary.backup(replica)
+
+    replica.execute("BEGIN IMMEDIATE")
+    try:
+        # Everything logged up to the snapshot is already in its tables
+        applied = change_model.head(replica)
+        for table in change_model.CAPTURED:
+            for trigger in change_model.capture_triggers(table):
+                replica.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        replica.execute("DELETE FROM change_log")
+        replica.execute("DELETE FROM change_consumers")
+        replica.execute("""
+        CREATE TABLE IF NOT EXISTS replica_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            applied_seq INTEGER NOT NULL,
+            fresh_as_of REAL NOT NULL,
+            applied_at REAL NOT NULL
+        )
+        """)
+        replica.execute(
+            "INSERT OR REPLACE INTO replica_state (id, applied_seq, fresh_as_of, applied_at) VALUES (1, ?, ?, ?)",
+            (applied, taken, time.time()),
+        )
+        replica.commit()
+    except Exception:
+        replica.rollback()
+        raise
+    change_model.acknowledge(primary, CONSUMER, applied)
+    return applied
+
+
+def needs_rebuild(primary, replica):
+    state = replica_state(replica)
+    if state is None or migrations.schema_version(primary) != migrations.schema_version(replica):
+        return True
+    position = change_model.consumer_position(primary, CONSUMER)
+    # Unregistered, or the log was pruned past what the replica has
+    return position is None or state["applied_seq"] < position
+
+
+def apply_batch(primary, replica, batch_rows):
+    """
+    Replay the next batch of changes in one replica transaction. Returns
+    the number applied; fewer than batch_rows means caught up.
+    """
+    applied = replica_state(replica)["applied_seq"]
+    read_at = time.time()
+    changes = change_model.changes_after(primary, applied, batch_rows + 1)
+    batch = changes[:batch_rows]
+    fresh_as_of = changes[batch_rows]["changed_at"] if len(changes) > batch_rows else read_at
+
+    replica.execute("BEGIN IMMEDIATE")
+    try:
+        for change in batch:
+            replica.execute(_STATEMENTS[change["table_name"]][change["op"]], json.loads(change["row_data"]))
+        if batch:
+            applied = batch[-1]["seq"]
+        replica.execute(
+            "UPDATE replica_state SET applied_seq = ?, fresh_as_of = ?, applied_at = ?",
+            (applied, fresh_as_of, time.time()),
+        )
+        replica.commit()
+    except Exception:
+        replica.rollback()
+        raise
+    if batch:
+        change_model.acknowledge(primary, CONSUMER, applied)
+    return len(batch)
+
+
+class Applier:
+    """
+    Keeps one database's replica up to date. Holds a connection to each.
+    """
+
+    def __init__(self, database, batch_rows):
+        self.database = database
+        self.replica = replica_path(database)
+        self.batch_rows = batch_rows
+        self._primary = None
+        self._replica = None
+
+    def step(self, force_rebuild=False):
+        """
+        Catch up once: rebuild first if needed, then apply batches until
+        the log is drained. Returns (rebuilt, changes applied).
+        """
+        if self._primary is None:
+            self._primary = get_db_connection(self.database)
+            self._replica = get_db_connection(self.replica)
+        rebuilt = force_rebuild or needs_rebuild(self._primary, self._replica)
+        if rebuilt:
+            rebuild(self._primary, self._replica)
+        total = 0
+        while True:
+            applied = apply_batch(self._primary, self._replica, self.batch_rows)
+            total += applied
+            if applied < self.batch_rows:
+                return rebuilt, total
+
+    def close(self):
+        for conn in (self._primary, self._replica):
+            if conn is not None:
+                conn.close()
+        self._primary = self._replica = None
+
+
+def status(database):
+    """
+    Replication lag of one database: log entries and seconds behind.
+    """
+    primary = get_db_connection(database)
+    try:
+        head = change_model.head(primary)
+        registered = change_model.consumer_position(primary, CONSUMER) is not None
+    finally:
+        primary.close()
+    path = replica_path(database)
+    state = None
+    if os.path.exists(path):
+        conn = open_replica(path)
+        try:
+            state = replica_state(conn)
+        finally:
+            conn.close()
+    return {
+        "replica": path,
+        "registered": registered,
+        "head_seq": head,
+        "applied_seq": state["applied_seq"] if state else None,
+        "behind": head - state["applied_seq"] if state else None,
+        "staleness_seconds": round(max(0.0, time.time() - state["fresh_as_of"]), 3) if state else None,
+    }
+
+
+def init_app(app):
+    app.teardown_appcontext(close_report_db)
+    app.after_request(_report_source_header)
+    app.cli.add_command(replicate_command)
+    app.cli.add_command(replica_status_command)
+    app.cli.add_command(detach_replica_command)
+
+
+@click.command("replicate")
+@click.option("--once", is_flag=True, help="Catch up once and exit instead of following the logs.")
+@click.option("--rebuild", "force_rebuild", is_flag=True, help="Take a fresh snapshot of each database first.")
+@click.option("--interval", type=float, default=None, help="Seconds between polls of an idle log.")
+@with_appcontext
+def replicate_command(once, force_rebuild, interval):
+    """Keep the reporting replica of every database up to date."""
+    interval = current_app.config["REPLICA_POLL_INTERVAL"] if interval is None else interval
+    appliers = [
+        Applier(database, current_app.config["REPLICA_BATCH_ROWS"])
+        for database in shards.databases(current_app)
+    ]
+    try:
+        first = True
+        while True:
+            busy = False
+            for applier in appliers:
+                rebuilt, applied = applier.step(force_rebuild=force_rebuild and first)
+                if rebuilt:
+                    click.echo(f"Snapshot {applier.database} -> {applier.replica}.")
+                if once:
+                    click.echo(f"{applier.replica}: applied {applied} changes.")
+                busy = busy or applied > 0
+            first = False
+            if once:
+                break
+            if not busy:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for applier in appliers:
+            applier.close()
+
+
+@click.command("replica-status")
+@with_appcontext
+def replica_status_command():
+    """Show how far each reporting replica is behind its database."""
+    for database in shards.databases(current_app):
+        lag = status(database)
+        if lag["applied_seq"] is None:
+            click.echo(f"{lag['replica']}: not built (run `flask replicate`).")
+            continue
+        click.echo(
+            f"{lag['replica']}: applied {lag['applied_seq']} of {lag['head_seq']}"
+            f" ({lag['behind']} behind, {lag['staleness_seconds']:.1f}s stale)."
+        )
+
+
+@click.command("detach-replica")
+@with_appcontext
+@shards.branch_option
+def detach_replica_command():
+    """Stop logging changes for the reporting replica and empty the log."""
+    conn = get_db_connection()
+    change_model.unregister_consumer(conn, CONSUMER)
+    conn.close()
+    click.echo(f"Detached; {replica_path(shards.database_path())} can be deleted.")
@@ -0,0 +1,208 @@
+import bisect
+import hashlib
+import threading
+
+
+def _digest(template_bytes):
+    return hashlib.blake2b(template_bytes, digest_size=16).digest()
+
+
+class BitSimilarityScorer:
+    """
+    Stand-in for the MFS110 SDK matcher: the fraction of identical bits
+    between two equally sized templates.
+
+    feature() is the template's popcount. Two templates whose popcounts
+    differ by k differ in at least k bits, so it bounds the score cheaply.
+    """
+
+    def __call__(self, probe, candidate):
+        if len(probe) != len(candidate) or not probe:
+            return 0.0
+        differing = (int.from_bytes(probe, "big") ^ int.from_bytes(candidate, "big")).bit_count()
+        return 1.0 - differing / (8 * len(probe))
+
+    def feature(self, template_bytes):
+        return int.from_bytes(template_bytes, "big").bit_count()
+
+    def max_feature_gap(self, probe, threshold):
+        return int((1.0 - threshold) * 8 * len(probe))
+
+
+class TemplateIndex:
+    """
+    Resident fingerprint template index.
+
+    Without a scorer it does exact matching through hash buckets. With a
+    scorer, candidates are visited in batches ordered by how close their
+    feature() is to the probe's, and the search stops at the first score
+    at or above the threshold.
+
+    Matches never lock. Writers replace single entries of the template
+    and bucket dicts (a bucket list is replaced, never changed in place)
+    and publish a new feature list once per batch of changes, so a bulk
+    enrollment costs one flat list copy rather than copies of every
+    structure per template. Templates are kept as the buffers they were given, typically
+    memoryviews into the template store's mapping, so loading copies
+    nothing.
+    """
+
+    def __init__(self, scorer=None, threshold=1.0, batch_size=256):
+        self.scorer = scorer
+        self.threshold = threshold
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self._templates = {}
+        self._buckets = {}
+        self._features = []
+
+    def __len__(self):
+        return len(self._templates)
+
+    def load(self, rows):
+        """
+        Replace the index contents with (user_id, template_bytes) rows.
+        """
+        templates = {}
+        buckets = {}
+        for user_id, template_bytes in rows:
+            if not template_bytes:
+                continue
+            templates[user_id] = template_bytes
+            buckets.setdefault(_digest(template_bytes), []).append(user_id)
+
+        features = []
+        if self.scorer is not None:
+            features = sorted(
+                (self.scorer.feature(template_bytes), user_id)
+                for user_id, template_bytes in templates.items()
+            )
+
+        with self._lock:
+            self._templates = templates
+            self._buckets = buckets
+            self._features = features
+
+    def upsert(self, user_id, template_bytes):
+        self.apply([(user_id, template_bytes)])
+
+    def remove(self, user_id):
+        self.apply([(user_id, None)])
+
+    def apply(self, changes):
+        """
+        Apply (user_id, template_bytes or None for a removal) changes in
+        order, publishing the feature list once at the end.
+        """
+        with self._lock:
+            removed, added = [], []
+            for user_id, template_bytes in changes:
+                old = self._remove_locked(user_id)
+                if old is not None:
+                    removed.append(old)
+                if template_bytes:
+                    self._templates[user_id] = template_bytes
+                    digest = _digest(template_bytes)
+                    self._buckets[digest] = self._buckets.get(digest, []) + [user_id]
+                    added.append((user_id, template_bytes))
+
+            if self.scorer is None or not (removed or added):
+                return
+            # A flat copy, then bisect deletes and inserts
+            features = list(self._features)
+            for user_id, old in removed:
+                entry = (self.scorer.feature(old), user_id)
+                position = bisect.bisect_left(features, entry)
+                if position < len(features) and features[position] == entry:
+                    del features[position]
+            for user_id, template_bytes in added:
+                if self._templates.get(user_id) is template_bytes:
+                    bisect.insort(features, (self.scorer.feature(template_bytes), user_id))
+            self._features = features
+
+    def _remove_locked(self, user_id):
+        """
+        Drop user_id's template and bucket entry. Returns (user_id, old
+        template) or None.
+        """
+        old = self._templates.pop(user_id, None)
+        if old is None:
+            return None
+
+        digest = _digest(old)
+        remaining = [uid for uid in self._buckets.get(digest, []) if uid != user_id]
+        if remaining:
+            self._buckets[digest] = remaining
+        else:
+            self._buckets.pop(digest, None)
+        return user_id, old
+
+    def match(self, probe):
+        """
+        Returns (user_id, score), or (None, best_score) without a match.
+        """
+        if not probe:
+            return None, 0.0
+        probe = bytes(probe)
+
+        if self.scorer is None:
+            templates = self._templates
+            for user_id in self._buckets.get(_digest(probe), ()):
+                if templates.get(user_id) == probe:
+                    return user_id, 1.0
+            return None, 0.0
+
+        return self._match_scored(probe)
+
+    def candidate_batches(self, probe):
+        """
+        Yield batches of user ids whose feature lies within reach of the
+        threshold, nearest to the probe first.
+        """
+        features = self._features
+        scorer = self.scorer
+        target = scorer.feature(probe)
+        max_gap = scorer.max_feature_gap(probe, self.threshold)
+
+        right = bisect.bisect_left(features, (target, float("-inf")))
+        left = right - 1
+        batch = []
+        while True:
+            left_gap = target - features[left][0] if left >= 0 else None
+            right_gap = features[right][0] - target if right < len(features) else None
+
+            if right_gap is not None and (left_gap is None or right_gap <= left_gap):
+                gap, user_id = right_gap, features[right][1]
+                right += 1
+            elif left_gap is not None:
+                gap, user_id = left_gap, features[left][1]
+                left -= 1
+            else:
+                break
+
+            if gap > max_gap:
+                break
+            batch.append(user_id)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def _match_scored(self, probe):
+        templates = self._templates
+        scorer = self.scorer
+        best_score = 0.0
+        for batch in self.candidate_batches(probe):
+            for user_id in batch:
+                candidate = templates.get(user_id)
+                if candidate is None:
+                    continue
+                score = scorer(probe, candidate)
+                if score >= self.threshold:
+                    return user_id, score
+                if score > best_score:
+                    best_score = score
+        return None, best_score
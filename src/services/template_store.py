@@ -0,0 +1,333 @@
+"""
+Append-only file of fingerprint templates, read through mmap.
+
+Layout: a 64-byte header (magic, version, record size) and then fixed
+size records, each a 16-byte head (CRC32 of the rest of the head and
+the template, user id, template length) followed by the template,
+zero-padded. A
+record with length 0 is a tombstone. The last record for an id wins,
+so an update is an append and the id-to-offset index is rebuilt by one
+pass over the record heads.
+
+Appends are fsynced before the index moves past them. A record whose
+CRC does not match ends the log: readers stop there, and the next
+writer truncates it away (it can only be a torn append from a crash,
+since writers hold the lock file). Compaction writes the live records
+to a new file and renames it over the old one, so readers holding the
+old mapping keep a consistent view until they refresh.
+"""
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; one process per store there
+    fcntl = None
+
+try:
+    import numpy
+except ImportError:  # records_array() is unavailable without it
+    numpy = None
+
+
+_MAGIC = b"FPT1"
+_VERSION = 1
+_FILE_HEADER = struct.Struct("<4sII52x")
+_RECORD_HEAD = struct.Struct("<IqI")
+_CRC_START = 4
+
+
+class TemplateStore:
+    def __init__(self, path, record_bytes=1024):
+        self.path = path
+        self.record_bytes = record_bytes
+        self.capacity = record_bytes - _RECORD_HEAD.size
+
+        self._lock = threading.RLock()
+        self._mm = None
+        self._view = None
+        self._inode = None
+        self._end = _FILE_HEADER.size
+        self._offsets = {}
+        self._dead = 0
+
+    # --- reading -----------------------------------------------------------------
+
+    def position(self):
+        """
+        (generation, end of the log) after a refresh. The generation
+        changes whenever compaction replaces the file; log positions
+        from an older generation mean nothing in the new one.
+        """
+        self.refresh()
+        with self._lock:
+            return self._inode, self._end
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def refresh(self):
+        """
+        Map records appended since the last call, or reopen the file
+        after a compaction. Cheap when nothing changed: one stat().
+        """
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            if stat.st_ino != self._inode:
+                self._open(stat.st_ino)
+            elif stat.st_size != len(self._view):
+                # Grown by appends (or a torn tail was cut off)
+                self._map()
+                self._scan()
+
+    def _open(self, inode):
+        self._inode = inode
+        self._mm = self._view = None
+        self._end = _FILE_HEADER.size
+        self._offsets = {}
+        self._dead = 0
+        self._map()
+        magic, version, record_bytes = _FILE_HEADER.unpack_from(self._view, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{self.path} is not a template store")
+        if record_bytes != self.record_bytes:
+            raise ValueError(f"{self.path} has {record_bytes}-byte records, not {self.record_bytes}")
+        self._scan()
+
+    def _map(self):
+        with open(self.path, "rb") as handle:
+            # Views handed out earlier keep the previous mapping alive
+            self._mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mm)
+
+    def _scan(self):
+        view, offsets, size = self._view, self._offsets, self.record_bytes
+        count = (len(view) - self._end) // size
+        heads = struct.Struct(_RECORD_HEAD.format + f"{self.capacity}x")
+        offset = self._end
+        for crc, user_id, length in heads.iter_unpack(view[offset:offset + count * size]):
+            if length > self.capacity or zlib.crc32(
+                view[offset + _CRC_START:offset + _RECORD_HEAD.size + length]
+            ) != crc:
+                break
+            if offsets.pop(user_id, None) is not None:
+                self._dead += 1
+            if length:
+                offsets[user_id] = (offset, length)
+            else:
+                self._dead += 1
+            offset += size
+        self._end = offset
+
+    def _template(self, location):
+        start = location[0] + _RECORD_HEAD.size
+        return self._view[start:start + location[1]]
+
+    def get(self, user_id):
+        """
+        The user's template as a read-only memoryview into the mapping,
+        or None.
+        """
+        self.refresh()
+        with self._lock:
+            location = self._offsets.get(user_id)
+            return None if location is None else self._template(location)
+
+    def items(self):
+        """
+        Snapshot of (user_id, memoryview) for every live template.
+        """
+        self.refresh()
+        with self._lock:
+            return [(user_id, self._template(location)) for user_id, location in self._offsets.items()]
+
+    def changes(self, generation, start, end):
+        """
+        (user_id, memoryview or None for a removal) for each record in
+        [start, end), in log order. None if the file is no longer that
+        generation.
+        """
+        with self._lock:
+            if generation != self._inode:
+                return None
+            changes = []
+            for offset in range(start, end, self.record_bytes):
+                _, user_id, length = _RECORD_HEAD.unpack_from(self._view, offset)
+                changes.append((user_id, self._template((offset, length)) if length else None))
+            return changes
+
+    def record_count(self, end):
+        """
+        Number of records, live or not, before log position end.
+        """
+        return (end - _FILE_HEADER.size) // self.record_bytes
+
+    def live_records(self, generation, first, last):
+        """
+        (user_id, memoryview) for each live record among record numbers
+        [first, last), in log order, skipping superseded records and
+        tombstones. None if the file is no longer that generation.
+        """
+        self.refresh()
+        with self._lock:
+            if generation != self._inode:
+                return None
+            offsets, size = self._offsets, self.record_bytes
+            start = _FILE_HEADER.size + first * size
+            stop = min(_FILE_HEADER.size + last * size, self._end)
+            live = []
+            for offset in range(start, stop, size):
+                _, user_id, length = _RECORD_HEAD.unpack_from(self._view, offset)
+                if length and offsets.get(user_id, (None,))[0] == offset:
+                    live.append((user_id, self._template((offset, length))))
+            return live
+
+    def records_array(self):
+        """
+        Zero-copy NumPy structured view of every record (live or not),
+        with crc, user_id, length and data fields. Needs NumPy.
+        """
+        if numpy is None:
+            raise RuntimeError("records_array() needs NumPy")
+        self.refresh()
+        with self._lock:
+            # Packed, matching the file; user_id is not 8-byte aligned
+            dtype = numpy.dtype([
+                ("crc", "<u4"), ("user_id", "<i8"), ("length", "<u4"), ("data", "u1", (self.capacity,)),
+            ])
+            count = (self._end - _FILE_HEADER.size) // self.record_bytes
+            return numpy.frombuffer(self._mm, dtype=dtype, count=count, offset=_FILE_HEADER.size)
+
+    def stats(self):
+        self.refresh()
+        with self._lock:
+            return {
+                "live": len(self._offsets),
+                "dead": self._dead,
+                "record_bytes": self.record_bytes,
+                "file_bytes": self._end,
+            }
+
+    # --- writing -----------------------------------------------------------------
+
+    def put(self, user_id, template_bytes):
+        if not template_bytes:
+            raise ValueError("Empty fingerprint template")
+        if len(template_bytes) > self.capacity:
+            raise ValueError(f"Template is {len(template_bytes)} bytes; the store holds up to {self.capacity}")
+        self._append([self._record(user_id, bytes(template_bytes))])
+
+    def put_many(self, rows):
+        """
+        Append (user_id, template_bytes) rows with a single fsync.
+        """
+        records = []
+        for user_id, template_bytes in rows:
+            if not template_bytes or len(template_bytes) > self.capacity:
+                raise ValueError(f"Template for user {user_id} is empty or over {self.capacity} bytes")
+            records.append(self._record(user_id, bytes(template_bytes)))
+        if records:
+            self._append(records)
+
+    def delete(self, user_id):
+        """
+        Append a tombstone if the user has a template. Returns whether
+        one was removed.
+        """
+        self.refresh()
+        with self._lock:
+            if user_id not in self._offsets:
+                return False
+        self._append([self._record(user_id, b"")])
+        return True
+
+    def _record(self, user_id, template_bytes):
+        body = _RECORD_HEAD.pack(0, user_id, len(template_bytes))[_CRC_START:] + template_bytes
+        record = struct.pack("<I", zlib.crc32(body)) + body
+        return record.ljust(self.record_bytes, b"\0")
+
+    def _append(self, records):
+        with self._lock, _WriteLock(self.path):
+            self._create_if_missing()
+            self.refresh()
+            with open(self.path, "r+b") as handle:
+                # Anything past the last valid record is a torn append
+                if os.fstat(handle.fileno()).st_size != self._end:
+                    handle.truncate(self._end)
+                handle.seek(self._end)
+                handle.write(b"".join(records))
+                handle.flush()
+                os.fsync(handle.fileno())
+            self.refresh()
+
+    def _create_if_missing(self):
+        if os.path.exists(self.path):
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        _write_file(self.path, [_FILE_HEADER.pack(_MAGIC, _VERSION, self.record_bytes)])
+
+    def compact(self):
+        """
+        Rewrite the file with only live records. Returns the number of
+        records dropped.
+        """
+        with self._lock, _WriteLock(self.path):
+            self._create_if_missing()
+            self.refresh()
+            dropped = self._dead
+            records = [_FILE_HEADER.pack(_MAGIC, _VERSION, self.record_bytes)]
+            for offset, _ in sorted(self._offsets.values()):
+                records.append(self._view[offset:offset + self.record_bytes])
+            _write_file(self.path, records)
+            self.refresh()
+        return dropped
+
+
+def _write_file(path, chunks):
+    """
+    Write chunks to a temporary file and rename it over path, fsyncing
+    the file and then the directory.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as handle:
+        for chunk in chunks:
+            handle.write(chunk)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+class _WriteLock:
+    """
+    Exclusive lock across processes, on a sidecar file that compaction
+    never replaces.
+    """
+
+    def __init__(self, path):
+        self.path = f"{path}.lock"
+        self._handle = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._handle = open(self.path, "a")
+            fcntl.flock(self._handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._handle is not None:
+            fcntl.flock(self._handle, fcntl.LOCK_UN)
+            self._handle.close()
+            self._handle = None
@@ -0,0 +1,211 @@
+"""
+One SQLite database per school branch.
+
+Config.BRANCHES names the branches. Each gets its own database, archive
+folder, import folder and fingerprint store under SHARD_FOLDER/<branch>,
+and its own upload folder, UPLOAD_FOLDER/<branch>, so branches never
+wait on each other's write lock and one branch's history never slows
+another's queries.
+
+A request picks its branch with a /b/<branch> URL prefix or an X-Branch
+header. BranchDispatcher moves the prefix into SCRIPT_NAME, so url_for
+keeps every link inside the branch, and activates the branch for the
+rest of the request. Code below the request (get_db, get_db_connection,
+the image store, the fingerprint store) asks current() which branch it
+is working for; background jobs carry the branch they were queued from
+and activate it themselves. Requests that name no branch, and every
+request when BRANCHES is empty, use DATABASE_PATH and UPLOAD_FOLDER as
+before.
+"""
+import contextlib
+import contextvars
+import functools
+import os
+import re
+
+import click
+from flask import current_app, has_app_context, request, url_for
+from werkzeug.exceptions import BadRequest, NotFound
+
+from src.config import Config
+
+
+BRANCH_NAME = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+URL_PREFIX = "/b/"
+HEADER = "HTTP_X_BRANCH"
+# SCRIPT_NAME as it was before BranchDispatcher added the branch prefix
+ROOT_KEY = "attendance.script_root"
+
+_active = contextvars.ContextVar("shard", default=None)
+
+
+class Shard:
+    """
+    Where one branch keeps its data. Plain attributes, so a shard can be
+    handed to worker processes.
+    """
+
+    def __init__(self, name, shard_folder, upload_folder):
+        if not BRANCH_NAME.match(name):
+            raise ValueError(f"Invalid branch name: {name!r}")
+        folder = os.path.join(shard_folder, name)
+        self.name = name
+        self.database = os.path.join(folder, "attendance.db")
+        self.archive_folder = os.path.join(folder, "archive")
+        self.import_folder = os.path.join(folder, "imports")
+        self.fingerprint_store = os.path.join(folder, "fingerprints.tpl")
+        self.upload_folder = os.path.join(upload_folder, name)
+        # Stored image paths are relative to the static folder
+        self.upload_prefix = f"uploads/{name}"
+
+    def __repr__(self):
+        return f"<Shard {self.name}>"
+
+
+def build_shards(config):
+    return {
+        name: Shard(name, config["SHARD_FOLDER"], config["UPLOAD_FOLDER"])
+        for name in config["BRANCHES"]
+    }
+
+
+def all_shards(app=None):
+    app = app or current_app
+    return list(app.extensions["shards"].values())
+
+
+def get_shard(name, app=None):
+    """
+    The named branch's shard. Raises KeyError for an unknown branch.
+    """
+    app = app or current_app
+    return app.extensions["shards"][name]
+
+
+# --- the active branch ----------------------------------------------------------
+
+def current():
+    """
+    The shard being worked on, or None for the unsharded database.
+    """
+    return _active.get()
+
+
+def current_name():
+    shard = _active.get()
+    return shard.name if shard else None
+
+
+@contextlib.contextmanager
+def activate(shard):
+    token = _active.set(shard)
+    try:
+        yield shard
+    finally:
+        _active.reset(token)
+
+
+def serve_only(shard):
+    """
+    Make shard active for the rest of this thread, for worker processes
+    started to serve one branch.
+    """
+    _active.set(shard)
+
+
+def _setting(name):
+    return current_app.config[name] if has_app_context() else getattr(Config, name)
+
+
+def database_path():
+    shard = _active.get()
+    return shard.database if shard else _setting("DATABASE_PATH")
+
+
+def archive_folder():
+    shard = _active.get()
+    return shard.archive_folder if shard else _setting("ARCHIVE_FOLDER")
+
+
+def upload_folder():
+    """
+    (absolute folder, static-relative prefix) that new uploads go to.
+    """
+    shard = _active.get()
+    if shard:
+        return shard.upload_folder, shard.upload_prefix
+    return _setting("UPLOAD_FOLDER"), "uploads"
+
+
+def databases(app):
+    """
+    Every database the app serves: the unsharded one, then each branch.
+    """
+    return [app.config["DATABASE_PATH"]] + [shard.database for shard in all_shards(app)]
+
+
+# --- routing --------------------------------------------------------------------
+
+class BranchDispatcher:
+    """
+    WSGI middleware that routes a request to its branch: /b/<branch>/...
+    (the prefix is moved to SCRIPT_NAME) or an X-Branch header.
+    """
+
+    def __init__(self, wsgi_app, shards):
+        self.wsgi_app = wsgi_app
+        self.shards = shards
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        name = None
+        environ[ROOT_KEY] = environ.get("SCRIPT_NAME", "")
+        if path.startswith(URL_PREFIX):
+            name, _, rest = path[len(URL_PREFIX):].partition("/")
+            if name not in self.shards:
+                return NotFound()(environ, start_response)
+            environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + URL_PREFIX + name
+            environ["PATH_INFO"] = "/" + rest
+        elif environ.get(HEADER):
+            name = environ[HEADER].strip()
+            if name not in self.shards:
+                return BadRequest(f"Unknown branch: {name}")(environ, start_response)
+
+        if name is None:
+            return self.wsgi_app(environ, start_response)
+        with activate(self.shards[name]):
+            return self.wsgi_app(environ, start_response)
+
+
+def branch_url(name, endpoint, **values):
+    """
+    URL for endpoint in the named branch, from a request in any branch.
+    """
+    path = url_for(endpoint, **values)[len(request.script_root):]
+    return request.environ.get(ROOT_KEY, request.script_root) + URL_PREFIX + name + path
+
+
+def branch_option(command):
+    """
+    Give a CLI command a --branch option that runs it against that
+    branch's shard. Goes below @with_appcontext.
+    """
+    @click.option("--branch", default=None, help="Run against this branch's database (see BRANCHES).")
+    @functools.wraps(command)
+    def wrapper(*args, branch=None, **kwargs):
+        if branch is None:
+            return command(*args, **kwargs)
+        try:
+            shard = get_shard(branch)
+        except KeyError:
+            raise click.BadParameter(f"unknown branch {branch!r}", param_hint="--branch") from None
+        with activate(shard):
+            return command(*args, **kwargs)
+
+    return wrapper
+
+
+def init_app(app):
+    app.extensions["shards"] = build_shards(app.config)
+    if app.extensions["shards"]:
+        app.wsgi_app = BranchDispatcher(app.wsgi_app, app.extensions["shards"])
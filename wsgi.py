@@ -0,0 +1,14 @@
+"""
+Production WSGI entry point.
+
+    flask --app wsgi init-db                  # once per deploy
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+app.py is the development server (single process, debugger on). Here the
+app is built without touching the schema or starting threads, so a
+preloading server can import it once and fork workers from it; each
+worker starts its own image workers on its first request.
+"""
+from src import create_app
+
+app = create_app({"INIT_DB_ON_START": False, "START_BACKGROUND_WORKERS": False})